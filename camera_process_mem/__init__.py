@@ -1,2 +1,14 @@
+from . import camera_control
 from . import camera_main_process
 from . import camera_opencv_process
+from . import frame_notifier
+from . import frame_processor
+from . import frame_recorder
+from . import frame_ring
+from . import frame_synchronizer
+from . import image_writer
+from . import pipeline
+from . import shared_frame
+from . import stage_stats
+from . import supervisor
+from . import trigger_recorder
@@ -0,0 +1,30 @@
+import sys
+
+import numpy as np
+
+import frame_ring
+
+
+if __name__ == '__main__':
+    # 起動中のカメラのリングバッファへ名前で接続するサンプル．
+    # main.pyから起動していないプロセスでもカメラを開き直さずに
+    # 画像をコピーなしで参照できる．
+    # (使い方) python attach_sample.py [共有メモリ名]
+    name = sys.argv[1] if len(sys.argv) > 1 else 'camera0_camera'
+    ring = frame_ring.FrameRing.attach(name)
+    print('attach: ' + name + ' shape: ' + str(ring.shape) +
+          ' dtype: ' + ring.dtype + ' slots: ' + str(ring.slots))
+    reader = frame_ring.FrameReader(ring, 'latest')
+    image = np.empty(ring.shape, dtype=ring.dtype)
+    try:
+        while True:
+            frame_no = reader.read(image, timeout=5)
+            if frame_no is None:
+                print('no frame')
+                break
+            print('frame: ' + str(frame_no) + ' mean: ' + str(image.mean()))
+    except KeyboardInterrupt:
+        pass
+    reader.close()
+    del image
+    ring.close()
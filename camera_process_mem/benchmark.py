@@ -0,0 +1,219 @@
+import argparse
+import multiprocessing
+import time
+
+import numpy as np
+
+import camera_main_process
+import frame_ring
+
+
+"""
+camera_process_memのパイプライン(カメラ→リングバッファ→読み込み側)の
+性能測定スクリプト．
+合成画像のカメラ(SyntheticCapture)を使用するため実機のカメラは不要．
+解像度とスロット数の組み合わせ毎に以下を測定する．
+
+    fps: カメラプロセスが公開したフレームレート
+    read fps: 読み込み側毎のフレームレート
+    p50/p99: 撮影から読み込み完了までの遅延[ms]
+    cpu: プロセス毎のCPU使用率[%]
+    copy: 1フレームあたりのコピー量[MB]
+          (カメラの書き込み1回 + 読み込み側の読み込み回数)
+
+(使い方)
+    python benchmark.py --duration 5 --slots 2 3 8 --consumers latest every
+
+"""
+
+
+# 測定する解像度 (横, 縦)
+RESOLUTIONS = {
+    'vga': (640, 480),
+    'hd': (1280, 720),
+    'fhd': (1920, 1080),
+    '5mp': (2592, 1944),
+}
+
+
+class BenchConsumer:
+    """
+    測定用の読み込み側プロセス．
+    PickPicture，ShowPictureと同じくFrameReaderで読み込み，
+    処理は行わずに遅延のみ記録する．
+
+    """
+    def __init__(self, name, mode):
+        """
+        Parameters
+        --------------------------
+        name: str
+            結果表示用の名前
+        mode: str
+            リングバッファの読み込みモード．'latest'もしくは'every'．
+
+        """
+        self.name = name
+        self.mode = mode
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        return None
+
+    def main(self, kwargs):
+        in_ring = kwargs["in_ring"]
+        stop_event = kwargs["stop_event"]
+        result_queue = kwargs["result_queue"]
+        reader = frame_ring.FrameReader(in_ring, self.mode)
+        image = np.empty(in_ring.shape, dtype=in_ring.dtype)
+        meta = frame_ring.empty_meta()
+        latencies = []
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        while stop_event.is_set() is False:
+            if reader.read(image, self.stop_interval, meta) is not None:
+                latencies.append(
+                    time.monotonic_ns() - int(meta['capture_ns']))
+        elapsed = time.perf_counter() - start
+        reader.close()
+        latencies = np.array(latencies, dtype=np.float64) / 1e6
+        result_queue.put({
+            'stage': self.name,
+            'frames': len(latencies),
+            'dropped': reader.dropped,
+            'p50': np.percentile(latencies, 50) if len(latencies) else 0,
+            'p99': np.percentile(latencies, 99) if len(latencies) else 0,
+            'cpu': (time.process_time() - cpu_start) / elapsed * 100,
+        })
+        return None
+
+
+def run_camera(camera, kwargs):
+    """
+    カメラプロセスの処理時間とCPU使用率を測定する．
+
+    """
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    camera.main(kwargs)
+    elapsed = time.perf_counter() - start
+    kwargs["result_queue"].put({
+        'stage': 'camera',
+        'frames': kwargs["out_ring"].count,
+        'fps': kwargs["out_ring"].count / elapsed,
+        'cpu': (time.process_time() - cpu_start) / elapsed * 100,
+    })
+    return None
+
+
+def run_once(size, slots, modes, duration, fps):
+    """
+    1つの条件でパイプラインを動作させて結果を集計する．
+
+    Parameters
+    --------------------------
+    size: tuple
+        解像度 (横, 縦)
+    slots: int
+        リングバッファのスロット数
+    modes: list of str
+        読み込み側毎の読み込みモード
+    duration: float
+        測定時間[s]
+    fps: float
+        カメラのフレームレート．0の場合は最大速度．
+
+    Returns
+    --------------------------
+    results: dict
+        ステージ名をキーとした測定結果
+
+    """
+    camera = camera_main_process.Camera(
+        'synthetic', width=size[0], height=size[1], fps=fps)
+    camera.run_time = duration
+    frame_shape, frame_dtype = camera.get_frame_format()
+    cam_ring = frame_ring.FrameRing(
+        frame_shape, frame_dtype, slots=slots, subscribers=len(modes))
+    stop_event = multiprocessing.Event()
+    result_queue = multiprocessing.Queue()
+    kwargs = {
+        "in_ring": cam_ring,
+        "out_ring": cam_ring,
+        "stop_event": stop_event,
+        "result_queue": result_queue,
+    }
+    consumers = [
+        BenchConsumer(str(i) + ':' + mode, mode)
+        for i, mode in enumerate(modes)
+    ]
+    consumer_processes = [
+        multiprocessing.Process(target=consumer.main, args=(kwargs,))
+        for consumer in consumers
+    ]
+    for process in consumer_processes:
+        process.start()
+    # 読み込み側の接続を待ってから撮影を開始する
+    time.sleep(0.5)
+    camera_process = multiprocessing.Process(
+        target=run_camera, args=(camera, kwargs))
+    camera_process.start()
+    camera_process.join()
+    stop_event.set()
+    results = {}
+    for _ in range(len(consumers) + 1):
+        result = result_queue.get()
+        results[result['stage']] = result
+    for process in consumer_processes:
+        process.join()
+    results['copy'] = cam_ring.frame_nbytes * (
+        1 + sum(results[c.name]['frames'] for c in consumers) /
+        max(results['camera']['frames'], 1)) / 1e6
+    cam_ring.close()
+    cam_ring.unlink()
+    return results
+
+
+def print_result(label, results, modes):
+    """
+    1つの条件の測定結果を1行で表示する．
+
+    """
+    camera = results['camera']
+    line = label + ' fps: {0:7.1f} cpu: {1:5.1f}% copy: {2:6.2f}MB'.format(
+        camera['fps'], camera['cpu'], results['copy'])
+    for i, mode in enumerate(modes):
+        result = results[str(i) + ':' + mode]
+        line += ' | {0} read: {1:7.1f} p50: {2:6.2f} p99: {3:6.2f} ' \
+            'drop: {4} cpu: {5:5.1f}%'.format(
+                str(i) + ':' + mode,
+                result['frames'] / max(camera['frames'], 1) * camera['fps'],
+                result['p50'], result['p99'], result['dropped'],
+                result['cpu'])
+    print(line, flush=True)
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='camera_process_mem pipeline benchmark')
+    parser.add_argument(
+        '--resolutions', nargs='+', default=list(RESOLUTIONS),
+        choices=list(RESOLUTIONS))
+    parser.add_argument('--slots', nargs='+', type=int, default=[2, 3, 8])
+    parser.add_argument(
+        '--consumers', nargs='+', default=['latest', 'latest'],
+        choices=['latest', 'every'])
+    parser.add_argument('--duration', type=float, default=3)
+    parser.add_argument(
+        '--fps', type=float, default=0, help='0: unlimited')
+    args = parser.parse_args()
+
+    for resolution in args.resolutions:
+        for slots in args.slots:
+            label = '{0:>4} {1:>9} slots: {2}'.format(
+                resolution, '{0}x{1}'.format(*RESOLUTIONS[resolution]),
+                slots)
+            results = run_once(
+                RESOLUTIONS[resolution], slots, args.consumers,
+                args.duration, args.fps)
+            print_result(label, results, args.consumers)
@@ -0,0 +1,356 @@
+import sys
+import time
+
+import numpy as np
+
+import shared_frame
+
+
+"""
+撮影中のカメラのパラメータを他のプロセスから取得，設定する．
+カメラ(cv2.VideoCapture)を操作できるのは撮影プロセスのみのため，
+要求を共有メモリへ書き込み，撮影プロセスがフレームの合間に
+実行して結果を書き戻す．
+
+要求元(client)毎に1つの要求欄を持ち，要求元は自身の欄のみ
+書き込むためロックは不要．要求元は結果が返るまで待つため，
+1つの要求元が同時に出せる要求は1つ．
+
+(使い方) 起動中のパイプラインのカメラのパラメータを取得，設定する
+    python camera_control.py [共有メモリ名] [ステージ名] [パラメータ名] [値]
+    (値を省略した場合は取得のみ)
+
+"""
+
+
+# 要求の種類
+OP_GET = 1
+OP_SET = 2
+# 要求欄毎の内容．request_noとdone_noが異なる間は実行待ち．
+CONTROL_DTYPE = np.dtype([
+    ('client', 'S32'),
+    ('request_no', '<u8'),
+    ('done_no', '<u8'),
+    ('op', '<i4'),
+    ('ok', '<i4'),
+    ('target', 'S32'),
+    ('param_name', 'S32'),
+    ('value', '<f8'),
+    ('result', '<f8'),
+    ('error', 'S96'),
+])
+# 共有メモリがCameraControlであることを示す値
+MAGIC_VALUE = int.from_bytes(b'CAMCTRL1', 'little')
+# 共有メモリ先頭のヘッダ(MAGIC，要求元数)のバイト数
+HEADER_NBYTES = 64
+# パイプライン外のプロセス(コマンド等)用の要求元名
+EXTERNAL_CLIENT = 'external'
+
+
+class CameraControl:
+    """
+    全要求元の要求欄を持つ共有メモリ．
+    パイプラインの起動前に全要求元名を指定して作成し，
+    要求元はclientで自身の要求欄を取得して要求を出す．
+    撮影プロセスはフレームの合間にserveで自身宛ての要求を実行する．
+
+    """
+    def __init__(self, client_names, name=None):
+        """
+        要求元数分の要求欄を名前付き共有メモリに確保する．
+
+        Parameters
+        --------------------------
+        client_names: list of str
+            要求元名の一覧
+        name: str, default None
+            共有メモリ名．コマンドからはこの名前で接続する．
+
+        """
+        nbytes = HEADER_NBYTES + CONTROL_DTYPE.itemsize * len(client_names)
+        shm = shared_frame.create_shared_memory(name, nbytes)
+        header = np.ndarray((2,), np.uint64, buffer=shm.buf)
+        header[1] = len(client_names)
+        records = np.ndarray(
+            (len(client_names),), CONTROL_DTYPE, buffer=shm.buf,
+            offset=HEADER_NBYTES)
+        records[...] = np.zeros((), CONTROL_DTYPE)
+        for i, client_name in enumerate(client_names):
+            records['client'][i] = client_name.encode()
+        header[0] = MAGIC_VALUE
+        del header, records
+        self._setup(shm, True)
+        return None
+
+    @classmethod
+    def attach(cls, name):
+        """
+        既存の要求欄の共有メモリへ接続する．
+
+        Parameters
+        --------------------------
+        name: str
+            共有メモリ名
+
+        Returns
+        --------------------------
+        control: CameraControl
+            接続した要求欄
+
+        """
+        control = cls.__new__(cls)
+        control._setup(shared_frame.attach_shared_memory(name), False)
+        return control
+
+    def _setup(self, shm, is_owner):
+        """
+        共有メモリ上の要求欄をnumpy配列として参照する．
+
+        """
+        header = np.ndarray((2,), np.uint64, buffer=shm.buf)
+        if int(header[0]) != MAGIC_VALUE:
+            raise ValueError('not a CameraControl: ' + shm.name)
+        self.shm = shm
+        self.name = shm.name
+        self.is_owner = is_owner
+        self.records = np.ndarray(
+            (int(header[1]),), CONTROL_DTYPE, buffer=shm.buf,
+            offset=HEADER_NBYTES)
+        return None
+
+    def __getstate__(self):
+        """
+        プロセス生成時のpickle用．共有メモリ名のみ渡して接続し直す．
+
+        """
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        """
+        プロセス生成時のunpickle用．
+
+        """
+        self._setup(shared_frame.attach_shared_memory(state['name']), False)
+        return None
+
+    @property
+    def client_names(self):
+        """
+        要求元名の一覧．
+
+        """
+        return [name.decode() for name in self.records['client']]
+
+    def client(self, client_name):
+        """
+        要求を出すためのインスタンスを取得する．
+        1つの要求元名は1つのプロセスのみで使用すること．
+
+        Parameters
+        --------------------------
+        client_name: str
+            要求元名
+
+        Returns
+        --------------------------
+        client: ControlClient
+            要求用インスタンス
+
+        """
+        return ControlClient(self, self.client_names.index(client_name))
+
+    def has_requests(self, target):
+        """
+        target宛ての実行待ちの要求があるかどうか．
+
+        Parameters
+        --------------------------
+        target: str
+            カメラのステージ名
+
+        Returns
+        --------------------------
+        has_requests: bool
+            実行待ちの要求がある場合True
+
+        """
+        records = self.records
+        waiting = records['request_no'] != records['done_no']
+        return bool(np.any(records['target'][waiting] == target.encode()))
+
+    def serve(self, target, set_param, get_param):
+        """
+        target宛ての実行待ちの要求を全て実行し，結果を書き戻す．
+        撮影プロセスでフレームの合間に呼ぶ．
+        要求がない場合は比較のみのため撮影の速度に影響しない．
+
+        Parameters
+        --------------------------
+        target: str
+            カメラのステージ名
+        set_param: callable
+            set_param(パラメータ名, 値)
+        get_param: callable
+            get_param(パラメータ名) -> 値
+
+        Returns
+        --------------------------
+        changed: int
+            実行した設定要求の数．
+            1以上の場合はフレーム情報へ記録するパラメータ値を取り直す．
+
+        """
+        records = self.records
+        waiting = np.nonzero(records['request_no'] != records['done_no'])[0]
+        changed = 0
+        for index in waiting:
+            record = records[index]
+            if record['target'].decode() != target:
+                continue
+            param_name = record['param_name'].decode()
+            try:
+                if int(record['op']) == OP_SET:
+                    set_param(param_name, float(record['value']))
+                    changed += 1
+                record['result'] = float(get_param(param_name))
+                record['ok'] = 1
+                record['error'] = b''
+            except Exception as e:
+                record['ok'] = 0
+                # 長いメッセージは欄の長さで切り詰められる
+                record['error'] = str(e).encode()
+            # 結果を書き込んでから完了を公開する
+            record['done_no'] = record['request_no']
+        return changed
+
+    def close(self):
+        """
+        共有メモリを閉じる．
+
+        """
+        self.records = None
+        self.shm.close()
+        return None
+
+    def unlink(self):
+        """
+        共有メモリを削除する．作成したプロセスで最後に1度だけ呼ぶ．
+
+        """
+        if self.is_owner is True:
+            self.shm.unlink()
+        return None
+
+
+class ControlClient:
+    """
+    1つの要求元の要求欄へ要求を書き込み，結果を待つクラス．
+
+    """
+    def __init__(self, control, index):
+        """
+        Parameters
+        --------------------------
+        control: CameraControl
+            要求欄の共有メモリ．共有メモリを開いたままにするため保持する．
+        index: int
+            要求元の要求欄の番号
+
+        """
+        self.control = control
+        self.record = control.records[index]
+        # 結果を確認する間隔[s]
+        self.poll_interval = 1/1000
+        return None
+
+    def set_param(self, target, param_name, value, timeout=1.0):
+        """
+        パラメータを設定する．
+
+        Parameters
+        --------------------------
+        target: str
+            カメラのステージ名
+        param_name: str
+            パラメータ名
+        value: float
+            設定する値
+        timeout: float
+            結果を待つ最大時間[s]
+
+        Returns
+        --------------------------
+        value: float
+            設定後の現在値(カメラが丸めた値)
+
+        """
+        return self._request(OP_SET, target, param_name, value, timeout)
+
+    def get_param(self, target, param_name, timeout=1.0):
+        """
+        パラメータの現在値を取得する．
+
+        Parameters
+        --------------------------
+        target: str
+            カメラのステージ名
+        param_name: str
+            パラメータ名
+        timeout: float
+            結果を待つ最大時間[s]
+
+        Returns
+        --------------------------
+        value: float
+            現在値
+
+        """
+        return self._request(OP_GET, target, param_name, 0, timeout)
+
+    def _request(self, op, target, param_name, value, timeout):
+        """
+        要求を書き込み，撮影プロセスが実行するまで待つ．
+
+        """
+        record = self.record
+        deadline = time.monotonic() + timeout
+        # 前回タイムアウトした要求が残っている場合は実行を待つ
+        self._wait(deadline)
+        record['op'] = op
+        record['target'] = target.encode()
+        record['param_name'] = param_name.encode()
+        record['value'] = value
+        # 内容を書き込んでから要求を公開する
+        record['request_no'] += 1
+        self._wait(deadline)
+        if int(record['ok']) != 1:
+            raise RuntimeError(
+                param_name + ': ' + record['error'].decode(errors='replace'))
+        return float(record['result'])
+
+    def _wait(self, deadline):
+        """
+        実行待ちの要求がなくなるまで待つ．
+
+        """
+        record = self.record
+        while record['done_no'] != record['request_no']:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    'no response from ' + record['target'].decode())
+            time.sleep(self.poll_interval)
+        return None
+
+
+if __name__ == '__main__':
+    control_name = sys.argv[1] if len(sys.argv) > 1 else 'camera0_control'
+    target_name = sys.argv[2] if len(sys.argv) > 2 else 'camera'
+    name = sys.argv[3] if len(sys.argv) > 3 else 'camera_width'
+    attached = CameraControl.attach(control_name)
+    external = attached.client(EXTERNAL_CLIENT)
+    if len(sys.argv) > 4:
+        print(name + ': ' + str(
+            external.set_param(target_name, name, float(sys.argv[4]))))
+    else:
+        print(name + ': ' + str(external.get_param(target_name, name)))
+    attached.close()
@@ -4,10 +4,17 @@ import numpy as np
 import cv2
 
 import camera_opencv_process as cv_cam
+import frame_recorder
+import frame_ring
+import image_writer
+import pipeline
+import stage_stats
 from camera_opencv_process import DummyLock
 
 
-class ParameterDefinitions(cv_cam.Width, cv_cam.Height):
+class ParameterDefinitions(
+        cv_cam.Width, cv_cam.Height, cv_cam.Fourcc, cv_cam.Fps,
+        cv_cam.BufferSize, cv_cam.AutoExposure, cv_cam.Exposure):
     """
     Thread版と一緒．
 
@@ -48,7 +55,8 @@ class ParameterDefinitions(cv_cam.Width, cv_cam.Height):
         """
         print('ParameterDefinitions')
         self.param_names = [
-            'camera_width', 'camera_height'
+            'camera_width', 'camera_height', 'camera_fourcc', 'camera_fps',
+            'camera_buffersize', 'camera_auto_exposure', 'camera_exposure'
         ]
         self.param_dicts = {}
         self._make_dicts(camera)
@@ -112,22 +120,94 @@ class Camera:
     外部からはこのインスタンスを通して全ての
     カメラ操作を行う．
 
+    open_in_processがTrueの場合は作成時にカメラを開かず，撮影プロセス内
+    (main)で開く．子プロセスへカメラのオブジェクトを渡さないため
+    start_methodが'spawn'，'forkserver'でも使用でき，
+    画像の形状と型はpipeline.connect_outputsでパイプラインへ送る．
+
     """
-    def __init__(self):
+    def __init__(
+            self, backend='opencv', source=0, open_in_process=False,
+            **options):
         """
         外部からは直接アクセスできない形で使用する
         カメラのインスタンスとパラメータ定義のインスタンスを
         作成する．
 
+        Parameters
+        -----------------------
+        backend: str
+            'opencv'(実機)，'synthetic'(合成画像)，'replay'(再生)
+        source: int or str
+            'opencv'の場合はデバイス番号，'replay'の場合はファイルパス
+        open_in_process: bool
+            Trueの場合はカメラを撮影プロセス内で開く．
+            開く前に設定したパラメータは開いた時に設定する．
+        **options: dict
+            バックエンド毎の設定，取り込みスレッドの使用(grab_thread)．
+            camera_opencv_process.CameraBase参照．
+
         """
         print('__init__:Camera')
-        self.__camera_base = cv_cam.CameraBase()
+        self.backend = backend
+        self.source = source
+        self.options = options
+        self.open_in_process = open_in_process
+        self.__camera_base = None
+        self.__params = None
+        # 開く前に設定されたパラメータ (パラメータ名, 値)
+        self._initial_params = []
+        if open_in_process is not True:
+            self.open()
+        # get_frame_formatで決めた画像の(形状, 型)
+        self.frame_format = None
+        # 撮影を続ける時間[s]．Noneの場合は終了要求まで撮影を続ける．
+        self.run_time = None
+        # 統計情報のステージ名
+        self.stage_name = 'camera'
+        # プレビュー画像の縮小率(1/preview_scale)．Noneの場合は作成しない．
+        # パイプラインで'<ステージ名>.preview'を読むステージがあれば
+        # 撮影プロセスで1フレームにつき1回縮小して別のリングバッファへ書き込む．
+        self.preview_scale = None
+        # 縮小方法．'area'(面積平均)もしくは'pyramid'(ガウシアンピラミッド)．
+        # 'pyramid'の場合preview_scaleは2のべき乗とする．
+        self.preview_method = 'area'
+        # 撮影中に縦横を変えられるかどうか．出力を読む全てのステージが
+        # リングバッファの世代の切り替えに対応している場合のみTrue．
+        # (パイプラインがkwargs["renegotiable"]で渡す)
+        self._renegotiable = False
+        # 撮影中に設定したパラメータ名(画像の形状が変わったかの確認用)
+        self._changed_params = set()
+        return None
+
+    def open(self):
+        """
+        カメラを開き，開く前に設定されたパラメータを設定する．
+        open_in_processがTrueの場合は撮影プロセス内で呼ばれる．
+
+        """
+        if self.is_open is True:
+            return None
+        self.__camera_base = cv_cam.CameraBase(
+            self.backend, self.source, **self.options)
         self.__params = ParameterDefinitions(self.camera)
+        for param_name, value in self._initial_params:
+            self.set_param(param_name, value)
+        self._initial_params = []
         return None
 
+    @property
+    def is_open(self):
+        """
+        カメラを開いているかどうか．
+
+        """
+        return self.__camera_base is not None
+
     def set_param(self, param_name, value):
         """
         パラメータ定義クラスのパラメータ設定メソッドを呼び出す．
+        カメラを開く前の場合は開いた時に設定する．
 
         Parameters
         -----------------------
@@ -139,6 +219,9 @@ class Camera:
             型はパラメータ種類に依存
 
         """
+        if self.is_open is False:
+            self._initial_params.append((param_name, value))
+            return None
         self.__params._set_param(param_name, value)
         return None
 
@@ -161,33 +244,267 @@ class Camera:
         """
         return self.__params._get_param(param_name)
 
+    @property
+    def param_names(self):
+        """
+        使用しているパラメータ名の一覧を取得する．
+
+        Returns
+        ----------------------
+        self.__params.param_names: list of str
+            パラメータ名の一覧
+
+        """
+        return self.__params.param_names
+
+    def get_param_snapshot(self):
+        """
+        全パラメータの現在値をフレーム情報へ記録するために
+        param_namesの順で数値として取得する．
+
+        Returns
+        ----------------------
+        values: list of float
+            パラメータの現在値
+
+        """
+        return [float(self.get_param(name)) for name in self.param_names]
+
+    def get_frame_format(self):
+        """
+        共有メモリ確保のために画像の形状と型を取得する．
+        縦横はget_paramから，チャンネル数と型は実際に1枚撮影して決める．
+        フォーク前に1度だけ呼び出すこと．
+
+        Returns
+        ----------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型 (numpy.dtype.str)
+
+        """
+        width = int(self.get_param('camera_width'))
+        height = int(self.get_param('camera_height'))
+        image = self.__camera_base._take_picture
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        shape = (height, width, channels)
+        if image.shape[:2] != shape[:2]:
+            raise ValueError(
+                'frame shape mismatch: ' + str(image.shape) + ' ' + str(shape))
+        self.frame_format = (shape, image.dtype.str)
+        return self.frame_format
+
+    def get_output_format(self, output):
+        """
+        フルサイズ以外の出力画像の形状と型を取得する．
+        get_frame_formatの後に呼ぶこと．
+
+        Parameters
+        -----------------------
+        output: str
+            出力名．'preview'のみ．
+
+        Returns
+        ----------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型 (numpy.dtype.str)
+
+        """
+        if output != 'preview' or self.preview_scale is None:
+            raise ValueError('unknown output: ' + str(output))
+        shape, dtype = self.frame_format
+        height, width, channels = shape
+        scale = int(self.preview_scale)
+        if self.preview_method == 'area':
+            height, width = height // scale, width // scale
+        elif self.preview_method == 'pyramid':
+            if scale < 2 or scale & (scale - 1) != 0:
+                raise ValueError('scale must be a power of 2: ' + str(scale))
+            for _ in range(scale.bit_length() - 1):
+                height, width = (height + 1) // 2, (width + 1) // 2
+        else:
+            raise ValueError('unknown method: ' + str(self.preview_method))
+        return (height, width, channels), dtype
+
+    def _write_preview(self, frame, preview_ring, capture_ns, params):
+        """
+        書き込んだフレームを縮小してプレビューのリングバッファへ
+        直接書き込む．
+
+        """
+        preview = preview_ring.begin_write()
+        if self.preview_method == 'area':
+            cv2.resize(
+                frame, preview.shape[1::-1], dst=preview,
+                interpolation=cv2.INTER_AREA)
+        else:
+            for _ in range(int(self.preview_scale).bit_length() - 2):
+                frame = cv2.pyrDown(frame)
+            cv2.pyrDown(frame, dst=preview)
+        preview_ring.end_write(capture_ns, params)
+        return None
+
+    def _set_live_param(self, param_name, value):
+        """
+        撮影中にパラメータを設定する．camera_controlの要求から呼ばれる．
+        縦横を変えた場合はmainがリングバッファを次の世代へ置き換える．
+        世代の切り替えに対応していないステージがある場合は，
+        画像の大きさと異なる縦横は設定しない．
+
+        """
+        if param_name in ('camera_width', 'camera_height') and \
+                self._renegotiable is False and \
+                self.frame_format is not None:
+            height, width = self.frame_format[0][:2]
+            size = width if param_name == 'camera_width' else height
+            if int(value) != size:
+                raise ValueError(
+                    'frame size is fixed while capturing: ' + str(size))
+        self.set_param(param_name, value)
+        self._changed_params.add(param_name)
+        return None
+
+    def _format_changed(self, out_ring):
+        """
+        撮影中に設定したパラメータで画像の形状や型が変わった可能性が
+        あるかどうか．露出等の設定ではリングバッファを置き換えない．
+
+        Returns
+        ----------------------
+        changed: bool
+            縦横が変わった，もしくは形式(チャンネル数や型が変わりうる)を
+            設定した場合True
+
+        """
+        param_names = self._changed_params
+        self._changed_params = set()
+        if 'camera_fourcc' in param_names:
+            return True
+        height, width = out_ring.shape[:2]
+        return int(self.get_param('camera_width')) != width or \
+            int(self.get_param('camera_height')) != height
+
+    def _renegotiate(self, out_ring, preview_ring):
+        """
+        パラメータ設定後の画像を1枚撮影して形状を確認し，
+        変わっていればリングバッファを次の世代へ置き換える．
+        読み込み側はフレームの境目で新しい世代へ切り替える．
+
+        Returns
+        ----------------------
+        out_ring: frame_ring.FrameRing
+            書き込むリングバッファ
+        preview_ring: frame_ring.FrameRing or None
+            プレビューのリングバッファ
+
+        """
+        image = self.__camera_base._take_picture
+        channels = 1 if image.ndim == 2 else image.shape[2]
+        shape = image.shape[:2] + (channels,)
+        if (shape, image.dtype.str) == (out_ring.shape, out_ring.dtype):
+            return out_ring, preview_ring
+        self.frame_format = (shape, image.dtype.str)
+        out_ring = _replace_ring(out_ring, out_ring.renegotiate(
+            shape, image.dtype.str))
+        if preview_ring is not None:
+            preview_ring = _replace_ring(
+                preview_ring, preview_ring.renegotiate(
+                    *self.get_output_format('preview')))
+        return out_ring, preview_ring
+
     def main(self, kwargs):
         error = False
-        cam_mems = [
-            kwargs["cam_mem1/3"], kwargs["cam_mem2/3"], kwargs["cam_mem3/3"]
-        ]
-        index = kwargs["cam_mem_index"]
-        cam_pick_lock = kwargs["cam_pick_lock"]
-        length = len(cam_mems) - 1
+        if self.is_open is False:
+            # 撮影プロセス内でカメラを開き，画像の形状と型を送って
+            # パイプラインが確保した出力のリングバッファへ接続する
+            self.open()
+            kwargs = pipeline.connect_outputs(self, kwargs)
+            if self.frame_format is None:
+                self.get_frame_format()
+        # 書き込みはロックを取らないため，読み込み側の速度に影響されない
+        # 再起動時等で既に置き換えられている場合は最新の世代へ書き込む
+        out_ring = kwargs["out_ring"].latest()
+        # プレビューを読むステージがない場合はNone
+        preview_ring = kwargs.get("out_rings", {}).get("preview")
+        if preview_ring is not None:
+            preview_ring = preview_ring.latest()
+        self._renegotiable = kwargs.get("renegotiable", False)
+        if self.frame_format is not None and \
+                out_ring.shape != self.frame_format[0]:
+            # 前のプロセスが変えた縦横へ合わせる
+            self.set_param('camera_width', out_ring.shape[1])
+            self.set_param('camera_height', out_ring.shape[0])
+            self.frame_format = (out_ring.shape, out_ring.dtype)
+        stop_event = kwargs["stop_event"]
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        # 他のプロセスからのパラメータの取得，設定要求
+        control = kwargs.get("control")
+        camera_base = self.__camera_base
+        # フレーム情報へ記録するパラメータ値
+        params = self.get_param_snapshot()
+        # 取り込みスレッドを使用する場合は撮影プロセス内で起動する
+        camera_base.start_grab_thread()
+        skipped = camera_base.skipped
         st = time.perf_counter()
         ti = st - st
         print("start camera")
-        while error is False and ti < 20:
+        while error is False and stop_event.is_set() is False and \
+                (self.run_time is None or ti < self.run_time):
             try:
-                image = self.__camera_base._take_picture
-                cam_pick_lock.acquire()
-                index.value = (index.value + 1) % length
-                np.asarray(cam_mems[index.value])[:] = image.flatten()
-                cam_pick_lock.release()
+                # 取り込み完了を待ってからスロットを書き込み中にし，
+                # 共有メモリへ直接デコードする(コピーは1回のみ)
+                start = time.perf_counter_ns()
+                capture_ns = camera_base._grab()
+                copy_start = time.perf_counter_ns()
+                frame = out_ring.begin_write()
+                camera_base._retrieve(frame)
+                out_ring.end_write(capture_ns, params)
+                if preview_ring is not None:
+                    # 書き込み側は自身のみのため公開後も上書きされない
+                    self._write_preview(
+                        frame, preview_ring, capture_ns, params)
+                if counter is not None:
+                    # 取り込み待ちとデコード(共有メモリへのコピー)の時間
+                    counter.add('wait_ns', copy_start - start)
+                    counter.add('copy_ns', time.perf_counter_ns() - copy_start)
+                    counter.add('frames_out')
+                    # 取り込みスレッドが要求されずに捨てた画像
+                    counter.add('dropped', camera_base.skipped - skipped)
+                    counter.add_latency(time.monotonic_ns() - capture_ns)
+                    counter.beat()
+                skipped = camera_base.skipped
+                # 要求はフレームの合間に実行し，撮影中の画像に影響させない
+                if control is not None and \
+                        control.has_requests(self.stage_name) is True:
+                    # 世代の置き換えで閉じられるようスロットの参照を残さない
+                    del frame
+                    with camera_base.pause_grab():
+                        changed = control.serve(
+                            self.stage_name, self._set_live_param,
+                            self.get_param)
+                    if changed > 0:
+                        params = self.get_param_snapshot()
+                    if changed > 0 and self._renegotiable is True and \
+                            self._format_changed(out_ring) is True:
+                        out_ring, preview_ring = self._renegotiate(
+                            out_ring, preview_ring)
+            except EOFError as e:
+                # 記録済み画像を最後まで再生した場合は正常に終了する
+                print("camera end : " + str(e))
+                break
             except Exception as e:
                 error = e
                 print("camera error : " + str(error))
             ti = time.perf_counter() - st
-        try:
-            cam_pick_lock.release()
-        except (ValueError, RuntimeError):
-            pass
+        camera_base.stop_grab_thread()
         print('end camera')
+        if error is not False:
+            # 異常終了をSupervisorへ伝える
+            raise error
         return None
 
     @property
@@ -206,132 +523,257 @@ class Camera:
         return self.__camera_base.camera
 
 
+def _replace_ring(previous, ring):
+    """
+    書き込み側で置き換えた前の世代のリングバッファを閉じる．
+    最初の世代はパイプラインが持つため閉じない．
+
+    Returns
+    ----------------------
+    ring: frame_ring.FrameRing
+        次の世代のリングバッファ
+
+    """
+    if previous.generation > 0:
+        previous.close()
+    return ring
+
+
 class PickPicture:
     """
     サンプルの作業プロセス
     画像表示を行っている．
     画像をメモリから読み込む以外はThread版と同様．
+    カメラ画像のリングバッファへ他の読み込み側と独立して接続する．
 
     """
-    def __init__(self):
+    def __init__(self, mode='latest'):
         """
         メモリから画像を復元するために縦横の長さを
         インスタンス作成時に引数として受け取る．
 
+        Parameters
+        --------------------------
+        mode: str
+            リングバッファの読み込みモード．'latest'もしくは'every'．
+
         """
         print('__init__:ShowPicture')
         self.interval = 3
-        self.loop_time = 20
+        # 処理する回数．Noneの場合は終了要求まで処理を続ける．
+        self.loop_time = None
+        self.mode = mode
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        # 統計情報のステージ名
+        self.stage_name = 'pick'
+        # 関心領域(x, y, 幅, 高さ)のリスト．指定した場合は画像全体ではなく
+        # 関心領域のみをコピーする．
+        self.rois = None
+        # リングバッファの世代の切り替え(撮影中の縦横の変更)に対応する
+        self.supports_renegotiation = True
         return None
 
     def main(self, kwargs):
-        cam_mems = [
-            kwargs["cam_mem1/3"], kwargs["cam_mem2/3"], kwargs["cam_mem3/3"]
-        ]
-        pick_mem = kwargs["pick_mem1/1"]
-        index = kwargs["cam_mem_index"]
-        need_update = kwargs["need_update"]
-        cam_pick_lock = kwargs["cam_pick_lock"]
-        pick_show_lock = kwargs["pick_show_lock"]
+        in_ring = kwargs["in_ring"]
+        stop_event = kwargs["stop_event"]
+        # 自身の読み込み位置を持つ読み込み側として接続する
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        reader = frame_ring.FrameReader(
+            in_ring, self.mode, counter, self.rois)
+        image = self._empty_image(reader)
+        meta = frame_ring.empty_meta()
 
         error = False
         count = 0
         print("start pick")
-        while error is False and count < self.loop_time:
+        while error is False and stop_event.is_set() is False and \
+                (self.loop_time is None or count < self.loop_time):
             try:
-                pick_show_lock.acquire()
-                if need_update.value == 1:
-                    cam_pick_lock.acquire()
-                    serial_array = np.array(
-                        cam_mems[index.value], dtype=np.float32, copy=True)
-                    cam_pick_lock.release()
-                    np.asarray(pick_mem)[:] = serial_array
-                    need_update.value = 0
-                    pick_show_lock.release()
-                    count += 1
-                    time.sleep(self.interval)
-                else:
-                    time.sleep(0.01)
-                    pick_show_lock.release()
+                # 新しいカメラ画像が公開されるまでブロックする．
+                # 終了要求を確認するため最大待機時間を設ける．
+                frame_no = reader.read(image, self.stop_interval, meta)
+                if frame_no is None:
+                    if self.rois is None and image.shape != reader.ring.shape:
+                        # 縦横が変わった世代へ切り替えた
+                        image = self._empty_image(reader)
+                    continue
+                # 撮影から読み込み完了までの遅延
+                latency = (time.monotonic_ns() - int(meta['capture_ns'])) / 1e6
+                print('pick frame: ' + str(frame_no) +
+                      ' latency[ms]: ' + str(latency))
+                count += 1
+                if counter is not None:
+                    counter.add('frames_out')
+                stop_event.wait(self.interval)
             except Exception as e:
                 error = e
                 print(error)
-        try:
-            cam_pick_lock.release()
-        except (ValueError, RuntimeError):
-            pass
-        try:
-            pick_show_lock.release()
-        except (ValueError, RuntimeError):
-            pass
+        reader.close()
         print('end pick')
+        if error is not False:
+            raise error
         return None
 
+    def _empty_image(self, reader):
+        """
+        読み込み先の画像(関心領域)を作成する．
+
+        """
+        if self.rois is None:
+            return np.empty(reader.ring.shape, dtype=reader.ring.dtype)
+        return reader.empty_rois()
+
 
 class ShowPicture:
     """
     サンプルの作業プロセス．
     ファイルへの画像出力を行う．
     画像をメモリから読み込む以外はThread版と同様．
+    カメラ画像のリングバッファへ他の読み込み側と独立して接続する．
+    画像の保存はimage_writer.ImageWriterへ渡し，表示ループでは
+    エンコードを待たない．
 
     """
-    def __init__(self, height, width):
+    def __init__(self, mode='latest', writer_kwargs=None):
         """
-        メモリから画像を復元するために縦横の長さを
-        インスタンス作成時に引数として受け取る．
+        画像の形状と型は読み込むリングバッファから取得する．
 
         Parameters
         --------------------------
-        height: int
-            縦の長さ
-        width: int
-            縦の長さ
+        mode: str
+            リングバッファの読み込みモード．'latest'もしくは'every'．
+        writer_kwargs: dict, default None
+            image_writer.ImageWriterへ渡す設定
+            (codec, quality, workers, max_queue, policy)．
 
         """
         print('__init__:SavePicture')
-        self.height = height
-        self.width = width
-        # ファイル名の関数ポインタ
-        self.name = '/ramdisk/save_{0:04d}.png'.format
+        self.mode = mode
+        self.writer_kwargs = {} if writer_kwargs is None else writer_kwargs
+        # ファイル名(拡張子なし)の関数ポインタ
+        self.name = '/ramdisk/save_{0:04d}'.format
+        # 画像が更新されない場合にキー入力を確認する間隔[s]
+        self.key_interval = 0.05
+        # ファイルへ保存する間隔[s]．0の場合は表示した全ての画像を保存する．
+        self.save_interval = 3
+        # 統計情報のステージ名
+        self.stage_name = 'show'
+        # リングバッファの世代の切り替え(撮影中の縦横の変更)に対応する
+        self.supports_renegotiation = True
         return None
 
     def main(self, kwargs):
-        pick_mem = kwargs["pick_mem1/1"]
-        pick_show_lock = kwargs["pick_show_lock"]
-        need_update = kwargs["need_update"]
+        in_ring = kwargs["in_ring"]
+        # 自身の読み込み位置を持つ読み込み側として接続する
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        reader = frame_ring.FrameReader(in_ring, self.mode, counter)
+        stop_event = kwargs["stop_event"]
+        # プールを作成するため，このプロセス内で作成する
+        writer = image_writer.ImageWriter(
+            reader.ring.shape, reader.ring.dtype, **self.writer_kwargs)
+        image = np.empty(reader.ring.shape, dtype=reader.ring.dtype)
         error = False
         count = 0
         key = ""
-        is_save = False
+        save_time = time.perf_counter() - self.save_interval
         print('start show')
-        while error is False and key != ord("q"):
-            pick_show_lock.acquire()
+        while error is False and key != ord("q") and \
+                stop_event.is_set() is False:
             try:
-                serial_array = np.array(
-                    pick_mem, dtype=np.float32, copy=True
-                )
-                if need_update.value == 0:
-                    need_update.value = 1
-                    pick_show_lock.release()
-                    is_save = True
-                else:
-                    pick_show_lock.release()
-                    is_save = False
-                    time.sleep(0.05)
-                image = np.reshape(
-                    serial_array, (self.height, self.width, 3)
-                )
-                image = image.astype(np.uint8)
-                cv2.imshow("image", image)
-                if is_save is True:
-                    cv2.imwrite(self.name(count), image)
-                count += 1
-                key = cv2.waitKey(10)
+                # 新しい画像の公開を待つ．キー入力処理のため最大待機時間を設ける．
+                if reader.read(image, self.key_interval) is not None:
+                    cv2.imshow("image", image)
+                    if counter is not None:
+                        counter.add('frames_out')
+                    now = time.perf_counter()
+                    if now - save_time >= self.save_interval:
+                        writer.submit(self.name(count), image)
+                        count += 1
+                        save_time = now
+                elif image.shape != reader.ring.shape:
+                    # 縦横が変わった世代へ切り替えた．保存待ちを保存してから
+                    # 新しい形状の保存用プールを作り直す．
+                    writer.close()
+                    writer = image_writer.ImageWriter(
+                        reader.ring.shape, reader.ring.dtype,
+                        **self.writer_kwargs)
+                    image = np.empty(
+                        reader.ring.shape, dtype=reader.ring.dtype)
+                key = cv2.waitKey(1)
             except Exception as e:
                 error = e
-        try:
-            pick_show_lock.release()
-        except (ValueError, RuntimeError):
-            pass
+        reader.close()
+        # 保存待ちの画像を全て保存してから終了する
+        writer.close()
+        print('saved: ' + str(writer.written) +
+              ' dropped: ' + str(writer.dropped))
         print("end show")
+        if error is not False:
+            raise error
+        return None
+
+
+class RecordPicture:
+    """
+    サンプルの作業プロセス．
+    カメラ画像を全てエンコードせずにファイルへ記録する．
+    カメラ画像のリングバッファから記録ファイル上の領域へ直接読み込むため，
+    1フレームあたりのコピーは1回のみ．
+
+    """
+    def __init__(self, path, capacity):
+        """
+        Parameters
+        --------------------------
+        path: str
+            記録先のファイルパス
+        capacity: int
+            記録する最大フレーム数
+
+        """
+        print('__init__:RecordPicture')
+        self.path = path
+        self.capacity = capacity
+        # 上書きされたフレーム以外は全て記録する
+        self.mode = 'every'
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        # 統計情報のステージ名
+        self.stage_name = 'record'
+        return None
+
+    def main(self, kwargs):
+        in_ring = kwargs["in_ring"]
+        stop_event = kwargs["stop_event"]
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        reader = frame_ring.FrameReader(in_ring, self.mode, counter)
+        recorder = frame_recorder.RawRecorder(
+            self.path, in_ring.shape, in_ring.dtype, self.capacity,
+            in_ring.param_names)
+        meta = frame_ring.empty_meta()
+        error = False
+        print('start record')
+        while error is False and recorder.is_full is False and \
+                stop_event.is_set() is False:
+            try:
+                frame_no = reader.read(
+                    recorder.next_frame(), self.stop_interval, meta)
+                if frame_no is not None:
+                    recorder.commit(meta)
+                    if counter is not None:
+                        counter.add('frames_out')
+            except Exception as e:
+                error = e
+                print(error)
+        reader.close()
+        recorder.close()
+        print('recorded: ' + str(recorder.count) +
+              ' dropped: ' + str(reader.dropped))
+        print('end record')
+        if error is not False:
+            raise error
         return None
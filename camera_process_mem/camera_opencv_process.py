@@ -1,7 +1,12 @@
+import contextlib
+import sys
+import threading
 import time
 import numpy as np
 import cv2
 
+import frame_recorder
+
 
 class DummyLock:
     """
@@ -25,19 +30,353 @@ class DummyLock:
         pass
 
 
+class SyntheticCapture:
+    """
+    cv2.VideoCaptureと同じ使い方ができる合成画像のカメラ．
+    実機のカメラなしでパイプラインの動作確認，性能測定を行うために使用する．
+    画像は横方向に流れるグラデーションで，指定したFPSで生成する．
+
+    """
+    def __init__(self, width=640, height=480, fps=30, channels=3):
+        """
+        Parameters
+        --------------------------
+        width: int
+            画像の横幅
+        height: int
+            画像の縦幅
+        fps: float
+            生成するフレームレート．0の場合は待たずに最大速度で生成する．
+        channels: int
+            チャンネル数
+
+        """
+        self.fps = fps
+        self.channels = channels
+        self.frame_count = 0
+        self._next_time = None
+        self._make_pattern(int(width), int(height))
+        return None
+
+    def _make_pattern(self, width, height):
+        """
+        横幅2倍のグラデーション画像を作成する．
+        各フレームはこの一部を切り出してコピーするだけで生成できる．
+
+        """
+        x = np.arange(width * 2) * 255 // max(width - 1, 1)
+        y = np.arange(height)[:, None] * 255 // max(height - 1, 1)
+        pattern = ((x[None, :] + y) % 256).astype(np.uint8)
+        self._pattern = np.repeat(
+            pattern[:, :, None], self.channels, axis=2)
+        self.width = width
+        self.height = height
+        return None
+
+    def isOpened(self):
+        """
+        cv2.VideoCapture.isOpenedと同じ．
+
+        """
+        return True
+
+    def grab(self):
+        """
+        次のフレームの時刻まで待つ．
+        処理が遅れている場合は待たずに時刻を合わせ直す．
+
+        """
+        if self.fps > 0:
+            now = time.perf_counter()
+            if self._next_time is None or now - self._next_time > 1/self.fps:
+                self._next_time = now
+            else:
+                time.sleep(max(self._next_time - now, 0))
+            self._next_time += 1/self.fps
+        self.frame_count += 1
+        return True
+
+    def retrieve(self, image=None, flag=None):
+        """
+        現在のフレームをimageへ書き込む．imageがNoneの場合は新しく確保する．
+
+        """
+        offset = self.frame_count % self.width
+        frame = self._pattern[:, offset:offset + self.width]
+        if self.channels == 1:
+            frame = frame[:, :, 0]
+        if image is None or image.shape != frame.shape:
+            image = np.empty(frame.shape, dtype=np.uint8)
+        image[...] = frame
+        return True, image
+
+    def read(self, image=None):
+        """
+        cv2.VideoCapture.readと同じ．grabとretrieveを続けて行う．
+
+        """
+        self.grab()
+        return self.retrieve(image)
+
+    def set(self, prop_id, value):
+        """
+        cv2.VideoCapture.setと同じ．対応していない項目はFalseを返す．
+
+        """
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            self._make_pattern(int(value), self.height)
+        elif prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            self._make_pattern(self.width, int(value))
+        elif prop_id == cv2.CAP_PROP_FPS:
+            self.fps = value
+        else:
+            return False
+        return True
+
+    def get(self, prop_id):
+        """
+        cv2.VideoCapture.getと同じ．対応していない項目は0を返す．
+
+        """
+        values = {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_POS_FRAMES: self.frame_count,
+        }
+        return float(values.get(prop_id, 0))
+
+    def release(self):
+        """
+        cv2.VideoCapture.releaseと同じ．
+
+        """
+        return None
+
+
+class ReplayCapture:
+    """
+    cv2.VideoCaptureと同じ使い方ができる記録済み画像の再生カメラ．
+    動画ファイル(OpenCVで読めるもの)もしくはframe_recorderの
+    記録ファイル(.raw)を再生する．
+    リアルタイム(記録時の間隔)もしくは最大速度で再生できる．
+
+    """
+    def __init__(self, path, realtime=True, loop=True):
+        """
+        Parameters
+        --------------------------
+        path: str
+            動画ファイル，もしくはframe_recorderの記録ファイル(.raw)のパス
+        realtime: bool
+            Trueの場合は記録時の間隔で再生する．Falseの場合は最大速度．
+        loop: bool
+            最後まで再生した場合に先頭へ戻るかどうか
+
+        """
+        self.realtime = realtime
+        self.loop = loop
+        self.frame_count = 0
+        # loopがFalseで最後まで再生した場合True
+        self.finished = False
+        self._next_time = None
+        self._player = None
+        self._video = None
+        if path.endswith('.raw'):
+            self._player = frame_recorder.RawPlayer(path)
+            if len(self._player) == 0:
+                self._player.close()
+                raise ValueError('empty recording: ' + path)
+            self.width = self._player.shape[1]
+            self.height = self._player.shape[0]
+            timestamps = self._player.timestamps
+            span = (int(timestamps[-1]) - int(timestamps[0])) / 1e9
+            self.fps = (len(self._player) - 1) / span if span > 0 else 30
+        else:
+            self._video = cv2.VideoCapture(path)
+            self.width = int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.height = int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            self.fps = self._video.get(cv2.CAP_PROP_FPS) or 30
+        return None
+
+    def isOpened(self):
+        """
+        cv2.VideoCapture.isOpenedと同じ．
+
+        """
+        if self._player is not None:
+            return len(self._player) > 0
+        return self._video.isOpened()
+
+    def _wait(self):
+        """
+        リアルタイム再生の場合は次のフレームの時刻まで待つ．
+
+        """
+        if self.realtime is not True:
+            return None
+        if self._player is not None and self.frame_count > 0:
+            timestamps = self._player.timestamps
+            index = self.frame_count % len(self._player)
+            interval = (
+                int(timestamps[index]) - int(timestamps[index - 1])) / 1e9
+            interval = interval if interval > 0 else 1/self.fps
+        else:
+            interval = 1/self.fps
+        now = time.perf_counter()
+        if self._next_time is None or now - self._next_time > interval:
+            self._next_time = now
+        else:
+            time.sleep(max(self._next_time - now, 0))
+        self._next_time += interval
+        return None
+
+    def grab(self):
+        """
+        次のフレームへ進める．最後まで再生してloopがFalseの場合はFalse．
+
+        """
+        self._wait()
+        if self._player is not None:
+            if self.frame_count >= len(self._player) and self.loop is False:
+                self.finished = True
+                return False
+        elif self._video.grab() is not True:
+            if self.loop is False:
+                self.finished = True
+                return False
+            self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            if self._video.grab() is not True:
+                return False
+        self.frame_count += 1
+        return True
+
+    def retrieve(self, image=None, flag=None):
+        """
+        現在のフレームをimageへ書き込む．imageがNoneの場合は新しく確保する．
+
+        """
+        if self._video is not None:
+            return self._video.retrieve(image=image)
+        frame = self._player[(self.frame_count - 1) % len(self._player)]
+        if frame.shape[2] == 1:
+            frame = frame[:, :, 0]
+        if image is None or image.shape != frame.shape:
+            image = np.empty(frame.shape, dtype=frame.dtype)
+        image[...] = frame
+        return True, image
+
+    def read(self, image=None):
+        """
+        cv2.VideoCapture.readと同じ．grabとretrieveを続けて行う．
+
+        """
+        if self.grab() is not True:
+            return False, None
+        return self.retrieve(image)
+
+    def set(self, prop_id, value):
+        """
+        cv2.VideoCapture.setと同じ．対応していない項目はFalseを返す．
+
+        """
+        # 記録済みの画像のため解像度等は変更できない
+        if prop_id == cv2.CAP_PROP_FPS:
+            self.fps = value
+            return True
+        return False
+
+    def get(self, prop_id):
+        """
+        cv2.VideoCapture.getと同じ．対応していない項目は0を返す．
+
+        """
+        values = {
+            cv2.CAP_PROP_FRAME_WIDTH: self.width,
+            cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+            cv2.CAP_PROP_FPS: self.fps,
+            cv2.CAP_PROP_POS_FRAMES: self.frame_count,
+        }
+        return float(values.get(prop_id, 0))
+
+    def release(self):
+        """
+        cv2.VideoCapture.releaseと同じ．
+
+        """
+        if self._player is not None:
+            self._player.close()
+        else:
+            self._video.release()
+        return None
+
+
 class CameraBase:
     """
     実際にカメラを定義，操作するクラス．
     カメラの種類に応じて適切に実装する．
 
+    <backend>
+        'opencv': cv2.VideoCapture(source)．実機のカメラ．
+        'synthetic': SyntheticCapture(**options)．合成画像．
+        'replay': ReplayCapture(source, **options)．記録済み画像の再生．
+    いずれもcv2.VideoCaptureと同じ使い方ができるため，
+    パラメータクラス(Width，Height等)はそのまま使用できる．
+
+    <取り込みスレッド>
+        grab_threadがTrueの場合，start_grab_threadで起動したスレッドが
+        grabを呼び続け，画像を要求された時のみ最新の取り込み済み画像を
+        retrieveする．OpenCV(USBカメラ)内部のバッファに古い画像が
+        溜まらないため，読み込み側が遅くても常に最新の画像を得られる．
+        要求されずに次の取り込みで捨てられた画像はskippedへ加算する．
+        grabとretrieveは同時に呼ばないよう状態変数で順番を決める．
+
     """
-    def __init__(self):
+    def __init__(
+            self, backend='opencv', source=0, grab_thread=False, **options):
         """
         カメラ定義を行う．
 
+        Parameters
+        ---------------------
+        backend: str
+            'opencv'，'synthetic'，'replay'のいずれか
+        source: int or str
+            'opencv'の場合はデバイス番号，'replay'の場合はファイルパス
+        grab_thread: bool
+            Trueの場合は取り込みスレッドを使用する．
+            スレッドはフォークで引き継がれないため，撮影するプロセスで
+            start_grab_threadを呼ぶこと．
+        **options: dict
+            SyntheticCapture，ReplayCaptureへ渡す設定
+
         """
         print('Initialize Camera')
-        self.camera = cv2.VideoCapture(0)
+        self.grab_thread = grab_thread
+        # 取り込みスレッドが取り込んだ画像数，最後の取り込み時刻，
+        # 要求されずに捨てた画像数
+        self.grab_count = 0
+        self.grab_ns = 0
+        self.skipped = 0
+        self._thread = None
+        self._condition = threading.Condition()
+        self._stop_grab = False
+        # 画像の要求待ち，retrieve中，grab中であることを示す状態
+        self._waiting = False
+        self._retrieving = False
+        self._grabbing_now = False
+        # pause_grabが取り込みの停止を要求している
+        self._pause_requested = False
+        # 最後にretrieveした取り込み番号
+        self._retrieved = 0
+        if backend == 'opencv':
+            self.camera = cv2.VideoCapture(source)
+        elif backend == 'synthetic':
+            self.camera = SyntheticCapture(**options)
+        elif backend == 'replay':
+            self.camera = ReplayCapture(source, **options)
+        else:
+            raise ValueError('unknown backend: ' + str(backend))
         return None
 
     @property
@@ -51,12 +390,198 @@ class CameraBase:
             カメラ画像
 
         """
-        ret = False
+        if self._thread is not None:
+            self._grab()
+            try:
+                ret, image = self.camera.retrieve()
+            finally:
+                self._end_retrieve()
+            if ret is not True:
+                raise RuntimeError('retrieve failed')
+            return image
+        # readは次の画像が来るまでブロックするため，
+        # 失敗した場合のみ待ってから再度取得する
+        ret, image = self.camera.read()
         while ret is not True:
+            self._check_finished()
             time.sleep(1/1000)
             ret, image = self.camera.read()
         return image
 
+    def _grab(self):
+        """
+        カメラから次の画像を取り込む(デコードはしない)．
+        取り込みに成功するまで繰り返す．
+        取り込みスレッドの使用中は，前回の_retrieve以降に取り込まれた
+        最新の画像を待ち，_retrieveが終わるまで次の取り込みを止める．
+
+        Returns
+        ---------------------
+        grab_ns: int
+            取り込みが完了した時刻(time.monotonic_ns)
+
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._waiting = True
+                # grab中の場合はその画像を待つ(より新しい画像を得る)
+                while self.grab_count == self._retrieved or \
+                        self._grabbing_now is True:
+                    if self._thread.is_alive() is not True:
+                        self._waiting = False
+                        self._check_finished()
+                        raise RuntimeError('grab thread stopped')
+                    self._condition.wait(1.0)
+                self._waiting = False
+                self._retrieving = True
+                self._retrieved = self.grab_count
+                self._condition.notify_all()
+                return self.grab_ns
+        while self.camera.grab() is not True:
+            self._check_finished()
+            time.sleep(1/1000)
+        self.grab_ns = time.monotonic_ns()
+        return self.grab_ns
+
+    def _check_finished(self):
+        """
+        記録済み画像を最後まで再生した(loopがFalse)場合はEOFErrorを送出する．
+        取り込みに失敗し続けるループを終わらせるために呼ぶ．
+
+        """
+        if getattr(self.camera, 'finished', False) is True:
+            raise EOFError('end of replay')
+        return None
+
+    def _retrieve(self, out):
+        """
+        _grabで取り込んだ画像をoutへ直接デコードする．
+        outの形状と型が一致していればOpenCV内部でのメモリ確保は発生しない．
+
+        Parameters
+        ---------------------
+        out: numpy.ndarray
+            画像の書き込み先．(縦, 横, チャンネル数)の形状．
+
+        """
+        # グレースケールの場合は2次元の配列としてOpenCVへ渡す
+        target = out[:, :, 0] if out.shape[2] == 1 else out
+        try:
+            ret, image = self.camera.retrieve(image=target)
+        finally:
+            self._end_retrieve()
+        if ret is not True:
+            raise RuntimeError('retrieve failed')
+        if np.may_share_memory(image, target) is not True:
+            # 形状が異なる等でOpenCVが新しく確保した場合のみコピーする
+            target[...] = image
+        return None
+
+    def _end_retrieve(self):
+        """
+        取り込みスレッドの使用中はretrieveの終了を知らせ，
+        次の取り込みを再開させる．
+
+        """
+        if self._thread is not None:
+            with self._condition:
+                self._retrieving = False
+                self._pause_requested = False
+                self._condition.notify_all()
+        return None
+
+    @contextlib.contextmanager
+    def pause_grab(self):
+        """
+        取り込みスレッドの使用中は取り込みを止める．
+        withの中でカメラのパラメータ設定等を行う．
+        (cv2.VideoCaptureはgrabと他の操作を同時に呼べない)
+
+        """
+        if self._thread is None:
+            yield
+            return
+        with self._condition:
+            # 取り込みスレッドが次のgrabを始めないよう先に要求する
+            self._pause_requested = True
+            while self._grabbing_now is True:
+                if self._thread.is_alive() is not True:
+                    self._pause_requested = False
+                    raise RuntimeError('grab thread stopped')
+                self._condition.wait(1.0)
+            self._retrieving = True
+        try:
+            yield
+        finally:
+            self._end_retrieve()
+
+    def start_grab_thread(self):
+        """
+        grab_threadがTrueの場合は取り込みスレッドを起動する．
+        撮影するプロセスで呼ぶ．
+
+        """
+        if self.grab_thread is not True or self._thread is not None:
+            return None
+        self._stop_grab = False
+        self._thread = threading.Thread(target=self._grabbing, daemon=True)
+        self._thread.start()
+        return None
+
+    def stop_grab_thread(self):
+        """
+        取り込みスレッドを終了させ，終了を待つ．
+
+        """
+        if self._thread is None:
+            return None
+        with self._condition:
+            self._stop_grab = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        return None
+
+    def _grabbing(self):
+        """
+        取り込みスレッド．終了要求までgrabを呼び続ける．
+        画像の要求待ちがある場合はretrieveが始まるまで，
+        retrieve中の場合は終わるまで次のgrabを待つ．
+
+        """
+        print('start grab thread')
+        condition = self._condition
+        while True:
+            with condition:
+                while self._stop_grab is False and (
+                        self._retrieving is True or
+                        self._pause_requested is True or (
+                            self._waiting is True and
+                            self._retrieved < self.grab_count)):
+                    condition.wait()
+                if self._stop_grab is True:
+                    break
+                self._grabbing_now = True
+            is_grabbed = self.camera.grab()
+            grab_ns = time.monotonic_ns()
+            with condition:
+                self._grabbing_now = False
+                condition.notify_all()
+                if is_grabbed is not True:
+                    if getattr(self.camera, 'finished', False) is True:
+                        # 再生の終わり．_grabがEOFErrorを送出する．
+                        break
+                    condition.wait(1/1000)
+                    continue
+                if self._retrieved < self.grab_count:
+                    # 要求されなかった画像は次の取り込みで捨てられる
+                    self.skipped += 1
+                self.grab_count += 1
+                self.grab_ns = grab_ns
+                condition.notify_all()
+        print('end grab thread')
+        return None
+
     def _taking(self, take_buffer, take_lock=DummyLock()):
         """
         無限ループでカメラ画像をメモリに書き込み続けるメソッド．
@@ -65,6 +590,7 @@ class CameraBase:
         ---------------------
         take_bufffer: multiprocessing.sharedctypes.RawArray
             カメラ画像格納用のメモリ領域．
+            shared_frame.allocate_frame_memoryで確保したもの．
         take_lock: DummyLock or multiprocessing.Lock
             排他制御用の変数．
             基本的に必要だが，複数プロセス間での画像共有方法次第では不要．
@@ -74,14 +600,13 @@ class CameraBase:
         error = False
         while error is False:
             try:
-                time.sleep(1/1000)
-
                 # >>排他制御開始
                 take_lock.acquire()
                 # カメラ画像取得
                 image = self._take_picture
-                # メモリへコピー
-                np.asarray(take_buffer)[:] = image.flatten()
+                # メモリへ画像本来の型のままコピー
+                np.frombuffer(
+                    take_buffer, dtype=image.dtype)[:] = image.ravel()
                 # <<排他制御終了
                 take_lock.release()
             except Exception as e:
@@ -215,3 +740,395 @@ class Height:
             'get': get_value
         }
         return height_dict
+
+
+def fourcc_to_str(code):
+    """
+    cv2.CAP_PROP_FOURCCの値を4文字の文字列にする．
+
+    Parameters
+    -------------------
+    code: int or float
+        FOURCCの値
+
+    Returns
+    -------------------
+    fourcc: str
+        4文字のFOURCC (例: 'MJPG')
+
+    """
+    code = int(code)
+    return ''.join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+
+
+class Fourcc:
+    """
+    OpenCVで取得できるカメラ画像の形式(FOURCC)を定義するパラメータクラス．
+    多くのUSBカメラは'MJPG'にしないと高解像度で最大のフレームレートが出ない．
+    縦横やフレームレートより先に設定すること．
+
+    """
+    def camera_fourcc(self, camera):
+        """
+        パラメータ定義の辞書作成メソッド．
+
+        Parameters
+        -------------------
+        camear: cv2.VideoCapture
+            OpenCVのカメラオブジェクト
+
+        Returns
+        -------------------
+        fourcc_dict: dict
+            画像形式の定義辞書
+
+        """
+        def set_value(value):
+            """
+            パラメータセット用関数
+
+            Parameters
+            ------------------
+            value: str or int
+                4文字のFOURCC(例: 'MJPG')もしくはその値
+
+            """
+            if isinstance(value, str):
+                value = cv2.VideoWriter_fourcc(*value)
+            camera.set(cv2.CAP_PROP_FOURCC, value)
+            return None
+
+        def get_value():
+            """
+            パラメータ取得用関数
+
+            Returns
+            ------------------
+            camera.get(cv2.CAP_PROP_FOURCC): float
+                現在のFOURCCの値．fourcc_to_strで文字列にできる．
+
+            """
+            return camera.get(cv2.CAP_PROP_FOURCC)
+
+        fourcc_dict = {
+            'set': set_value,
+            'get': get_value
+        }
+        return fourcc_dict
+
+
+class Fps:
+    """
+    OpenCVで取得できるカメラのフレームレートを定義するパラメータクラス．
+    カメラが対応していない値は近い値に丸められるため，
+    設定後はgetで確認すること．
+
+    """
+    def camera_fps(self, camera):
+        """
+        パラメータ定義の辞書作成メソッド．
+
+        Parameters
+        -------------------
+        camear: cv2.VideoCapture
+            OpenCVのカメラオブジェクト
+
+        Returns
+        -------------------
+        fps_dict: dict
+            フレームレートの定義辞書
+
+        """
+        def set_value(value):
+            """
+            パラメータセット用関数
+
+            Parameters
+            ------------------
+            value: float
+                フレームレート[fps]
+
+            """
+            camera.set(cv2.CAP_PROP_FPS, value)
+            return None
+
+        def get_value():
+            """
+            パラメータ取得用関数
+
+            Returns
+            ------------------
+            camera.get(cv2.CAP_PROP_FPS): float
+                現在のフレームレート設定値
+
+            """
+            return camera.get(cv2.CAP_PROP_FPS)
+
+        fps_dict = {
+            'set': set_value,
+            'get': get_value
+        }
+        return fps_dict
+
+
+class BufferSize:
+    """
+    OpenCV内部で溜める画像数を定義するパラメータクラス．
+    1にすると古い画像が溜まらず遅延が小さくなる．
+    (対応しているバックエンドのみ．V4L2等)
+
+    """
+    def camera_buffersize(self, camera):
+        """
+        パラメータ定義の辞書作成メソッド．
+
+        Parameters
+        -------------------
+        camear: cv2.VideoCapture
+            OpenCVのカメラオブジェクト
+
+        Returns
+        -------------------
+        buffersize_dict: dict
+            バッファ数の定義辞書
+
+        """
+        def set_value(value):
+            """
+            パラメータセット用関数
+
+            Parameters
+            ------------------
+            value: int
+                バッファ数
+
+            """
+            camera.set(cv2.CAP_PROP_BUFFERSIZE, value)
+            return None
+
+        def get_value():
+            """
+            パラメータ取得用関数
+
+            Returns
+            ------------------
+            camera.get(cv2.CAP_PROP_BUFFERSIZE): float
+                現在のバッファ数
+
+            """
+            return camera.get(cv2.CAP_PROP_BUFFERSIZE)
+
+        buffersize_dict = {
+            'min': 1,
+            'set': set_value,
+            'get': get_value
+        }
+        return buffersize_dict
+
+
+class AutoExposure:
+    """
+    OpenCVで設定できる自動露出を定義するパラメータクラス．
+    値の意味はバックエンドにより異なる．
+    (V4L2: 1が手動，3が自動．DirectShow: 0.25が手動，0.75が自動)
+    自動露出はフレームレートを下げることがあるため，
+    フレームレートを優先する場合は手動にしてcamera_exposureを設定する．
+
+    """
+    def camera_auto_exposure(self, camera):
+        """
+        パラメータ定義の辞書作成メソッド．
+
+        Parameters
+        -------------------
+        camear: cv2.VideoCapture
+            OpenCVのカメラオブジェクト
+
+        Returns
+        -------------------
+        auto_exposure_dict: dict
+            自動露出の定義辞書
+
+        """
+        def set_value(value):
+            """
+            パラメータセット用関数
+
+            Parameters
+            ------------------
+            value: float
+                自動露出の設定値
+
+            """
+            camera.set(cv2.CAP_PROP_AUTO_EXPOSURE, value)
+            return None
+
+        def get_value():
+            """
+            パラメータ取得用関数
+
+            Returns
+            ------------------
+            camera.get(cv2.CAP_PROP_AUTO_EXPOSURE): float
+                現在の自動露出の設定値
+
+            """
+            return camera.get(cv2.CAP_PROP_AUTO_EXPOSURE)
+
+        auto_exposure_dict = {
+            'set': set_value,
+            'get': get_value
+        }
+        return auto_exposure_dict
+
+
+class Exposure:
+    """
+    OpenCVで設定できる露出時間を定義するパラメータクラス．
+    値の単位はバックエンドにより異なる．
+    (V4L2: 100マイクロ秒単位．DirectShow，MSMF: 2^値 秒)
+    自動露出が手動の場合のみ有効．
+
+    """
+    def camera_exposure(self, camera):
+        """
+        パラメータ定義の辞書作成メソッド．
+
+        Parameters
+        -------------------
+        camear: cv2.VideoCapture
+            OpenCVのカメラオブジェクト
+
+        Returns
+        -------------------
+        exposure_dict: dict
+            露出時間の定義辞書
+
+        """
+        def set_value(value):
+            """
+            パラメータセット用関数
+
+            Parameters
+            ------------------
+            value: float
+                露出時間の設定値
+
+            """
+            camera.set(cv2.CAP_PROP_EXPOSURE, value)
+            return None
+
+        def get_value():
+            """
+            パラメータ取得用関数
+
+            Returns
+            ------------------
+            camera.get(cv2.CAP_PROP_EXPOSURE): float
+                現在の露出時間の設定値
+
+            """
+            return camera.get(cv2.CAP_PROP_EXPOSURE)
+
+        exposure_dict = {
+            'set': set_value,
+            'get': get_value
+        }
+        return exposure_dict
+
+
+def probe_capture_modes(
+        camera, fourccs=('MJPG', 'YUYV'),
+        sizes=((640, 480), (1280, 720), (1920, 1080)),
+        fps_list=(30, 60), frames=30):
+    """
+    FOURCC，縦横，フレームレートの組み合わせを実際に設定して撮影し，
+    カメラが実際に出せるフレームレートを測定する．
+    カメラが受け付けず別の値に丸めた組み合わせは結果に含めない．
+    撮影を止めた状態(撮影プロセスの起動前)で呼ぶこと．
+    測定後のカメラは最後に試した設定のままとなる．
+
+    Parameters
+    -------------------
+    camera: cv2.VideoCapture
+        OpenCVのカメラオブジェクト
+    fourccs: list of str
+        試すFOURCC
+    sizes: list of tuple
+        試す(横幅, 縦幅)
+    fps_list: list of float
+        試すフレームレート
+    frames: int
+        測定に使う画像数
+
+    Returns
+    -------------------
+    results: list of dict
+        組み合わせ毎の{'fourcc', 'width', 'height', 'fps', 'measured_fps'}．
+        測定したフレームレート，画素数の大きい順．
+        先頭が最も速い組み合わせ．
+
+    """
+    results = []
+    for fourcc in fourccs:
+        for width, height in sizes:
+            for fps in fps_list:
+                # 形式，縦横，フレームレートの順に設定しないと
+                # 反映されないカメラがある
+                camera.set(cv2.CAP_PROP_FOURCC,
+                           cv2.VideoWriter_fourcc(*fourcc))
+                camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                camera.set(cv2.CAP_PROP_FPS, fps)
+                actual = (
+                    int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+                actual_fourcc = fourcc_to_str(
+                    camera.get(cv2.CAP_PROP_FOURCC))
+                # FOURCCを返さないバックエンドでは確認しない
+                if actual != (width, height) or (
+                        actual_fourcc.strip('\x00') != '' and
+                        actual_fourcc != fourcc):
+                    print('unsupported: ' + fourcc + ' ' + str(width) +
+                          'x' + str(height) + ' ' + str(fps))
+                    continue
+                measured_fps = _measure_fps(camera, frames)
+                print(fourcc + ' ' + str(width) + 'x' + str(height) + ' ' +
+                      str(fps) + ' -> ' + '{0:.1f}'.format(measured_fps))
+                results.append({
+                    'fourcc': fourcc,
+                    'width': width,
+                    'height': height,
+                    'fps': fps,
+                    'measured_fps': measured_fps,
+                })
+    results.sort(
+        key=lambda r: (round(r['measured_fps']), r['width'] * r['height']),
+        reverse=True)
+    return results
+
+
+def _measure_fps(camera, frames, warmup=5):
+    """
+    grabのみを繰り返して実際のフレームレートを測定する．
+    設定直後の不安定な画像はwarmup枚読み捨てる．
+
+    """
+    for _ in range(warmup):
+        camera.grab()
+    start = time.perf_counter()
+    grabbed = 0
+    for _ in range(frames):
+        if camera.grab() is True:
+            grabbed += 1
+    elapsed = time.perf_counter() - start
+    return grabbed / elapsed if elapsed > 0 else 0.0
+
+
+if __name__ == '__main__':
+    device = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    capture = cv2.VideoCapture(device)
+    modes = probe_capture_modes(capture)
+    if len(modes) > 0:
+        print('fastest: ' + str(modes[0]))
+    capture.release()
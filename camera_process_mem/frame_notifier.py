@@ -0,0 +1,141 @@
+import multiprocessing
+import multiprocessing.sharedctypes
+import os
+
+
+class FrameNotifier:
+    """
+    新しいフレームの公開を待機中のプロセスへ通知するクラス．
+    購読者毎にパイプを持ち，書き込み側は公開の度に購読中のパイプへ
+    1バイト書き込む．読み込み側はパイプが読めるようになるまで
+    ブロックするため，フレーム間はCPUを使用しない．
+
+    パイプは書き込み側をノンブロッキングにしているため，
+    読み込み側が遅くパイプが一杯になっても書き込み側は待たされない．
+    パイプはフォーク前に作成するため，購読者数の上限を最初に決める．
+
+    """
+    def __init__(self, subscribers=4, context=None):
+        """
+        購読者数分のパイプと購読状態の共有変数を作成する．
+
+        Parameters
+        --------------------------
+        subscribers: int
+            購読者数の上限
+        context: multiprocessing.context.BaseContext, default None
+            プロセスの起動方法に合わせたコンテキスト．
+            Noneの場合はmultiprocessingの既定値．
+
+        """
+        self._pipes = [
+            multiprocessing.Pipe(duplex=False) for _ in range(subscribers)
+        ]
+        for _, send_conn in self._pipes:
+            os.set_blocking(send_conn.fileno(), False)
+        self._active = multiprocessing.sharedctypes.RawArray('b', subscribers)
+        # 購読中のプロセスID．異常終了したプロセスの購読を解放するために使う．
+        self._owners = multiprocessing.sharedctypes.RawArray('l', subscribers)
+        if context is None:
+            context = multiprocessing.get_context()
+        # 'spawn'等で起動するプロセスへ渡すロックは同じコンテキストで作成する
+        self._lock = context.Lock()
+        return None
+
+    def subscribe(self):
+        """
+        空いている購読者番号を取得する．
+
+        Returns
+        --------------------------
+        subscriber: int
+            購読者番号．wait，unsubscribeで使用する．
+
+        """
+        with self._lock:
+            for i, active in enumerate(self._active):
+                if active == 0:
+                    self._drain(i)
+                    self._active[i] = 1
+                    self._owners[i] = os.getpid()
+                    return i
+        raise RuntimeError('no free subscriber: ' + str(len(self._active)))
+
+    def unsubscribe(self, subscriber):
+        """
+        購読を終了し，購読者番号を解放する．
+
+        Parameters
+        --------------------------
+        subscriber: int
+            subscribeで取得した購読者番号
+
+        """
+        with self._lock:
+            self._active[subscriber] = 0
+        return None
+
+    def release(self, pid):
+        """
+        プロセスが持つ購読を全て解放する．
+        unsubscribeを呼ばずに終了したプロセスを再起動する前に呼ぶ．
+
+        Parameters
+        --------------------------
+        pid: int
+            終了したプロセスのプロセスID
+
+        """
+        with self._lock:
+            for i, owner in enumerate(self._owners):
+                if owner == pid:
+                    self._active[i] = 0
+        return None
+
+    def notify(self):
+        """
+        購読中の全プロセスを起こす．書き込み側から呼ぶ．
+        待たされることはない．
+
+        """
+        for i, active in enumerate(self._active):
+            if active == 1:
+                try:
+                    os.write(self._pipes[i][1].fileno(), b'\0')
+                except BlockingIOError:
+                    # パイプが一杯なら既に起こされる状態にある
+                    pass
+        return None
+
+    def wait(self, subscriber, timeout=None):
+        """
+        notifyが呼ばれるまでブロックする．
+        待機前にnotifyされていた場合はすぐに戻る．
+
+        Parameters
+        --------------------------
+        subscriber: int
+            subscribeで取得した購読者番号
+        timeout: float, default None
+            最大待機時間[s]．Noneの場合は無制限．
+
+        Returns
+        --------------------------
+        is_notified: bool
+            通知された場合True，タイムアウトした場合False．
+
+        """
+        if self._pipes[subscriber][0].poll(timeout) is not True:
+            return False
+        self._drain(subscriber)
+        return True
+
+    def _drain(self, subscriber):
+        """
+        パイプに溜まった通知を全て読み捨てる．
+
+        """
+        recv_conn = self._pipes[subscriber][0]
+        while recv_conn.poll(0) is True:
+            os.read(recv_conn.fileno(), 4096)
+        return None
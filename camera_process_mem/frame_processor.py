@@ -0,0 +1,411 @@
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+import cv2
+
+import frame_ring
+import shared_frame
+import stage_stats
+
+
+# ワーカープロセス内で参照する入力リングバッファと処理結果の共有メモリ
+_worker_ring = None
+_worker_shm = None
+_worker_results = None
+_worker_function = None
+_worker_image = None
+_worker_meta = None
+
+
+def sample_function(image):
+    """
+    処理関数のサンプル．エッジ画像を返す．
+
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.Canny(gray, 100, 200)
+
+
+def _init_worker(ring, results_name, shape, dtype, slots, function):
+    """
+    ワーカープロセスの初期化関数．
+    入力のリングバッファと処理結果の共有メモリへ接続する．
+
+    """
+    global _worker_ring, _worker_shm, _worker_results, _worker_function
+    global _worker_image, _worker_meta
+    _worker_ring = ring
+    _worker_function = function
+    _worker_image = np.empty(ring.shape, dtype=ring.dtype)
+    _worker_meta = frame_ring.empty_meta()
+    if results_name is not None:
+        _worker_shm = shared_frame.attach_shared_memory(results_name)
+        _worker_results = np.ndarray(
+            (slots,) + tuple(shape), dtype, buffer=_worker_shm.buf)
+    return None
+
+
+def _process_frame(frame_no, slot):
+    """
+    ワーカープロセスでフレームを読み込んで処理関数を実行し，
+    結果を共有メモリ上の処理結果スロットへ書き込む．
+
+    Returns
+    ---------------------
+    frame_no: int
+        処理したフレーム番号
+    slot: int
+        処理結果スロット番号
+    capture_ns: int or None
+        撮影時刻．読み込む前に上書きされていた場合None．
+    error: str or None
+        処理に失敗した場合のエラーメッセージ
+
+    """
+    try:
+        if _worker_ring.read(frame_no, _worker_image, _worker_meta) \
+                is not True:
+            return frame_no, slot, None, None
+        result = _worker_function(_worker_image)
+        if _worker_results is not None:
+            _worker_results[slot] = np.reshape(
+                result, _worker_results.shape[1:])
+    except Exception as e:
+        return frame_no, slot, None, str(e)
+    return frame_no, slot, int(_worker_meta['capture_ns']), None
+
+
+class FrameProcessor:
+    """
+    フレーム処理ステージ．
+    入力のリングバッファのフレームを複数のワーカープロセスへ振り分け，
+    numpy/OpenCVの処理関数を並列に実行する．
+    処理の完了順はばらばらになるが，並べ替えバッファでフレーム番号順に
+    戻してから出力のリングバッファへ書き込む．
+
+    ワーカーは入力のリングバッファから直接読み込むため，
+    振り分けで送るのはフレーム番号のみ．処理結果は共有メモリ上の
+    処理結果スロットへ書き込まれ，出力時に1回コピーする．
+
+    <モード>
+        'latest': ワーカーが全て処理中の場合は新しいフレームを読み飛ばす．
+        'every': ワーカーが空くまで待つ．待つ間に上書きされたフレームは
+                 読み飛ばしてdroppedへ加算する．
+
+    """
+    def __init__(
+            self, function, workers=None, mode='every', output_format=None):
+        """
+        Parameters
+        --------------------------
+        function: callable
+            処理関数．画像を受け取り，処理結果の画像を返す．
+            spawnで起動する場合はpickleできる(モジュールの関数)こと．
+        workers: int, default None
+            ワーカープロセス数．Noneの場合はCPU数．
+        mode: str
+            'latest'もしくは'every'
+        output_format: tuple, default None
+            処理結果の(形状, 型)．Noneの場合は0の画像を処理して決める．
+
+        """
+        print('__init__:FrameProcessor')
+        if mode not in ('latest', 'every'):
+            raise ValueError('unknown mode: ' + str(mode))
+        self.function = function
+        self.workers = workers
+        self.mode = mode
+        self.output_format = output_format
+        # 処理中にできるワーカー1つあたりのフレーム数
+        self.queue_per_worker = 2
+        # 処理結果を待つ最大時間[s]．ワーカーが異常終了した場合，
+        # Poolはそのフレームの結果を返さないため，過ぎたら読み飛ばす．
+        self.task_timeout = 5.0
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        # 統計情報のステージ名
+        self.stage_name = 'process'
+        return None
+
+    def get_frame_format(self, shape, dtype):
+        """
+        処理結果の形状と型を取得する．
+
+        Parameters
+        --------------------------
+        shape: tuple
+            入力画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            入力画像の型
+
+        Returns
+        ----------------------
+        shape: tuple
+            処理結果の形状 (縦, 横, チャンネル数)
+        dtype: str
+            処理結果の型 (numpy.dtype.str)
+
+        """
+        if self.output_format is not None:
+            shape, dtype = self.output_format
+            return tuple(shape), np.dtype(dtype).str
+        result = np.asarray(self.function(np.zeros(shape, dtype=dtype)))
+        shape = result.shape if result.ndim == 3 else result.shape + (1,)
+        return shape, result.dtype.str
+
+    def main(self, kwargs):
+        in_ring = kwargs["in_ring"]
+        # 出力がない(sink)場合は処理関数の実行のみ行う
+        out_ring = kwargs.get("out_ring")
+        stop_event = kwargs["stop_event"]
+        self._out_ring = out_ring
+        self._counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        workers = self.workers if self.workers is not None else \
+            multiprocessing.cpu_count()
+        slots = workers * self.queue_per_worker
+        results_name = results_shape = results_dtype = None
+        self._results = None
+        if out_ring is not None:
+            results_shape, results_dtype = out_ring.shape, out_ring.dtype
+            results_shm = shared_frame.create_shared_memory(
+                None, out_ring.frame_nbytes * slots)
+            results_name = results_shm.name
+            self._results = np.ndarray(
+                (slots,) + out_ring.shape, out_ring.dtype,
+                buffer=results_shm.buf)
+        # 空いている処理結果スロット番号
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        # 並べ替えバッファ．振り分けた順のフレーム番号と処理済みの結果．
+        self._pending = collections.deque()
+        self._done = {}
+        # 処理中のフレーム番号: (処理結果スロット番号, 振り分けた時刻,
+        # AsyncResult)
+        self._tasks = {}
+        # 期限切れにしたが処理中の可能性があるフレーム番号:
+        # 処理結果スロット番号．結果が返るまでスロットを空きへ戻さない．
+        # (ワーカーが異常終了した場合は戻らない)
+        self._quarantine = {}
+        self._lock = threading.Lock()
+        # 並べ替えバッファはコールバックと期限切れの破棄の両方から
+        # 操作するため，統計情報とは別のロックを取る
+        self._order_lock = threading.Lock()
+        self._stop_event = stop_event
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.expired = 0
+        pool = multiprocessing.Pool(
+            workers, initializer=_init_worker,
+            initargs=(in_ring, results_name, results_shape, results_dtype,
+                      slots, self.function))
+        subscriber = in_ring.subscribe()
+        cursor = in_ring.count
+        error = False
+        print('start process')
+        while error is False and stop_event.is_set() is False:
+            try:
+                start = time.perf_counter_ns()
+                is_ready = in_ring.wait(
+                    cursor, subscriber, self.stop_interval)
+                self._add('wait_ns', time.perf_counter_ns() - start)
+                self._expire()
+                if is_ready is not True:
+                    continue
+                cursor = self._dispatch(pool, in_ring, cursor)
+            except Exception as e:
+                error = e
+                print(error)
+        # 処理中のフレームを全て出力してから終了する
+        self._drain()
+        if self.expired == 0:
+            pool.close()
+        else:
+            # 結果の返らないフレームがPoolに残るとjoinが終わらない
+            pool.terminate()
+        pool.join()
+        in_ring.unsubscribe(subscriber)
+        if out_ring is not None:
+            self._results = None
+            results_shm.close()
+            results_shm.unlink()
+        print('processed: ' + str(self.processed) +
+              ' dropped: ' + str(self.dropped) +
+              ' errors: ' + str(self.errors) +
+              ' expired: ' + str(self.expired))
+        print('end process')
+        if error is not False:
+            raise error
+        return None
+
+    def _dispatch(self, pool, in_ring, cursor):
+        """
+        cursor以降の公開済みフレームをワーカーへ振り分ける．
+
+        Returns
+        --------------------------
+        cursor: int
+            次に振り分けるフレーム番号
+
+        """
+        count = in_ring.count
+        if self.mode == 'latest':
+            first = count - 1
+        else:
+            # 書き込み中のスロットを除いたslots - 1枚が読める範囲
+            first = max(cursor, count - in_ring.slots + 1)
+        self._add('dropped', first - cursor)
+        for frame_no in range(first, count):
+            slot = self._get_slot()
+            if slot is None:
+                self._add('dropped', 1)
+                continue
+            with self._order_lock:
+                self._pending.append(frame_no)
+                self._tasks[frame_no] = (slot, time.monotonic(), None)
+            self._add('frames_in', 1)
+            result = pool.apply_async(
+                _process_frame, (frame_no, slot), callback=self._collect)
+            with self._order_lock:
+                # コールバックが先に呼ばれた場合は登録済みでない
+                if frame_no in self._tasks:
+                    self._tasks[frame_no] = (
+                        slot, self._tasks[frame_no][1], result)
+        return count
+
+    def _get_slot(self):
+        """
+        空いている処理結果スロットを取得する．
+        'every'の場合は空くまで待つが，終了要求と期限切れを確認する．
+
+        Returns
+        --------------------------
+        slot: int or None
+            処理結果スロット番号．取得できなかった場合None．
+
+        """
+        if self.mode == 'latest':
+            try:
+                return self._free.get(block=False)
+            except queue.Empty:
+                return None
+        while self._stop_event.is_set() is False:
+            try:
+                return self._free.get(timeout=self.stop_interval)
+            except queue.Empty:
+                self._expire()
+                if self._counter is not None:
+                    with self._lock:
+                        self._counter.beat()
+        return None
+
+    def _expire(self):
+        """
+        task_timeoutを過ぎても結果の返らないフレームを読み飛ばし，
+        並べ替えバッファを進める．処理が遅れているだけのワーカーが
+        後から書き込むため，処理結果スロットは結果が返るまで空きへ戻さない．
+
+        """
+        deadline = time.monotonic() - self.task_timeout
+        with self._order_lock:
+            expired = [
+                frame_no for frame_no, (_, dispatched, result)
+                in self._tasks.items()
+                if dispatched < deadline and
+                (result is None or result.ready() is False)]
+            for frame_no in expired:
+                slot, _, _ = self._tasks.pop(frame_no)
+                self.expired += 1
+                print('process timeout : ' + str(frame_no))
+                self._quarantine[frame_no] = slot
+                self._done[frame_no] = (None, None, None)
+            if len(expired) > 0:
+                self._flush()
+        return None
+
+    def _drain(self):
+        """
+        処理中のフレームの結果を待つ．期限切れは読み飛ばす．
+
+        """
+        while len(self._tasks) > 0:
+            time.sleep(self.stop_interval)
+            self._expire()
+        return None
+
+    def _collect(self, result):
+        """
+        処理完了時のコールバック．並べ替えバッファへ入れ，
+        フレーム番号順に揃った分を出力する．
+
+        """
+        frame_no, slot, capture_ns, error = result
+        with self._order_lock:
+            # 期限切れで読み飛ばし済みの場合は，書き込みが終わった
+            # 処理結果スロットを空きへ戻すのみ
+            if self._tasks.pop(frame_no, None) is None:
+                if self._quarantine.pop(frame_no, None) is not None:
+                    self._free.put(slot)
+                return None
+            if error is not None:
+                print('process error : ' + error)
+            self._done[frame_no] = (slot, capture_ns, error)
+            self._flush()
+        return None
+
+    def _flush(self):
+        """
+        並べ替えバッファのフレーム番号順に揃った分を出力する．
+        _order_lockを取った状態で呼ぶ．
+
+        """
+        while len(self._pending) > 0 and self._pending[0] in self._done:
+            slot, capture_ns, error = self._done.pop(
+                self._pending.popleft())
+            if error is not None:
+                self.errors += 1
+            elif capture_ns is None:
+                self._add('dropped', 1)
+            else:
+                self._emit(slot, capture_ns)
+            # 期限切れの場合，スロットは結果が返るまで空きへ戻さない
+            if slot is not None:
+                self._free.put(slot)
+        return None
+
+    def _emit(self, slot, capture_ns):
+        """
+        処理結果を出力のリングバッファへ書き込む．
+
+        """
+        self.processed += 1
+        if self._out_ring is not None:
+            start = time.perf_counter_ns()
+            self._out_ring.write(self._results[slot], capture_ns)
+            self._add('copy_ns', time.perf_counter_ns() - start)
+        self._add('frames_out', 1, time.monotonic_ns() - capture_ns)
+        return None
+
+    def _add(self, field, value, latency_ns=None):
+        """
+        統計情報へ加算する．振り分けとコールバックの
+        両方のスレッドから呼ばれるためロックを取る．
+
+        """
+        if value == 0:
+            return None
+        with self._lock:
+            if field == 'dropped':
+                self.dropped += value
+            if self._counter is not None:
+                self._counter.add(field, value)
+                if latency_ns is not None:
+                    self._counter.add_latency(latency_ns)
+                self._counter.beat()
+        return None
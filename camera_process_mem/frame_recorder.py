@@ -0,0 +1,341 @@
+import mmap
+import os
+import time
+
+import numpy as np
+
+import frame_ring
+import shared_frame
+
+
+# ファイルがRawRecorderの形式であることを示す値
+MAGIC_VALUE = b'FRMREC01'
+# ファイル先頭のヘッダ
+FILE_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('count', '<u8'),
+    ('capacity', '<u8'),
+    ('height', '<u8'),
+    ('width', '<u8'),
+    ('channels', '<u8'),
+    ('dtype', 'S8'),
+    ('frame_stride', '<u8'),
+    ('index_offset', '<u8'),
+    ('data_offset', '<u8'),
+    ('param_count', '<u8'),
+    ('param_names', 'S' + str(frame_ring.PARAM_NAMES_NBYTES)),
+])
+# フレーム毎の索引．フレーム情報に画像のファイル内位置を加えたもの．
+INDEX_DTYPE = np.dtype(
+    frame_ring.FRAME_META_DTYPE.descr + [('offset', '<u8')])
+# ヘッダ，画像領域の先頭をページ境界へ揃える
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def _align(nbytes, alignment):
+    """
+    nbytesをalignmentの倍数へ切り上げる．
+
+    """
+    return (nbytes + alignment - 1) // alignment * alignment
+
+
+class RawRecorder:
+    """
+    画像をエンコードせずにそのままファイルへ追記する録画クラス．
+    ファイルは作成時に最大フレーム数分確保してメモリマップするため，
+    1フレームの記録は画像とフレーム情報のコピー(memcpy)のみとなる．
+
+    <ファイルの配置>
+        ヘッダ(FILE_HEADER_DTYPE，PAGE_SIZEに揃える)
+        索引(INDEX_DTYPE * capacity，PAGE_SIZEに揃える)
+        画像(frame_stride * capacity)
+
+    索引は固定長のため，n番目のフレームの位置と時刻はO(1)で求まる．
+    記録したファイルはRawPlayerで読み込む．
+
+    """
+    def __init__(self, path, shape, dtype, capacity, param_names=()):
+        """
+        ファイルを作成して最大フレーム数分の領域を確保する．
+
+        Parameters
+        --------------------------
+        path: str
+            記録先のファイルパス
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型
+        capacity: int
+            記録できる最大フレーム数
+        param_names: list of str
+            フレーム情報に記録されているカメラパラメータ名
+
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype).str
+        frame_stride = _align(
+            shared_frame.frame_nbytes(shape, dtype), frame_ring.ALIGNMENT)
+        index_offset = _align(FILE_HEADER_DTYPE.itemsize, PAGE_SIZE)
+        data_offset = index_offset + _align(
+            INDEX_DTYPE.itemsize * capacity, PAGE_SIZE)
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.capacity = capacity
+        self.count = 0
+        self._file = open(path, 'w+b')
+        self._file.truncate(data_offset + frame_stride * capacity)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        self._header = np.ndarray((), FILE_HEADER_DTYPE, buffer=self._mmap)
+        self._header['magic'] = MAGIC_VALUE
+        self._header['capacity'] = capacity
+        (self._header['height'], self._header['width'],
+         self._header['channels']) = shape
+        self._header['dtype'] = dtype.encode()
+        self._header['frame_stride'] = frame_stride
+        self._header['index_offset'] = index_offset
+        self._header['data_offset'] = data_offset
+        self._header['param_count'] = len(param_names)
+        self._header['param_names'] = ','.join(param_names).encode()
+        self._index = np.ndarray(
+            (capacity,), INDEX_DTYPE, buffer=self._mmap, offset=index_offset)
+        self._frames = _frame_array(
+            self._mmap, shape, dtype, capacity, data_offset, frame_stride)
+        self._data_offset = data_offset
+        self._frame_stride = frame_stride
+        return None
+
+    @property
+    def is_full(self):
+        """
+        最大フレーム数まで記録済みかどうか．
+
+        """
+        return self.count >= self.capacity
+
+    def next_frame(self):
+        """
+        次に記録するフレームの画像領域を返す．
+        リングバッファから直接この領域へ読み込めば途中のコピーは不要．
+        書き込み後はcommitを呼ぶこと．
+
+        Returns
+        --------------------------
+        frame: numpy.ndarray
+            ファイル上の画像領域
+
+        """
+        if self.is_full is True:
+            raise IndexError('recorder is full: ' + str(self.capacity))
+        return self._frames[self.count]
+
+    def commit(self, meta=None):
+        """
+        next_frameへ書き込んだフレームを索引へ登録して確定する．
+
+        Parameters
+        --------------------------
+        meta: numpy.ndarray, default None
+            フレーム情報(frame_ring.empty_meta)．Noneの場合は現在時刻．
+
+        Returns
+        --------------------------
+        index: int
+            記録したフレームのファイル内での番号
+
+        """
+        entry = self._index[self.count]
+        if meta is None:
+            now = time.monotonic_ns()
+            entry['frame_id'] = self.count
+            entry['capture_ns'] = entry['publish_ns'] = now
+        else:
+            for name in frame_ring.FRAME_META_DTYPE.names:
+                entry[name] = meta[name]
+        entry['offset'] = self._data_offset + self._frame_stride * self.count
+        self.count += 1
+        self._header['count'] = self.count
+        return self.count - 1
+
+    def append(self, image, meta=None):
+        """
+        画像をコピーして記録する．
+
+        Parameters
+        --------------------------
+        image: numpy.ndarray
+            記録する画像
+        meta: numpy.ndarray, default None
+            フレーム情報(frame_ring.empty_meta)
+
+        Returns
+        --------------------------
+        index: int
+            記録したフレームのファイル内での番号
+
+        """
+        self.next_frame()[...] = image.reshape(self.shape)
+        return self.commit(meta)
+
+    def extend(self, images, metas):
+        """
+        複数の画像とフレーム情報をまとめて記録する．
+        画像は1回のスライス代入(連続した領域へのコピー)で書き込む．
+
+        Parameters
+        --------------------------
+        images: numpy.ndarray
+            記録する画像 (フレーム, 縦, 横, チャンネル数)
+        metas: numpy.ndarray
+            フレーム情報 (FRAME_META_DTYPEの1次元配列)
+
+        Returns
+        --------------------------
+        count: int
+            記録済みのフレーム数
+
+        """
+        first = self.count
+        last = first + len(images)
+        if last > self.capacity:
+            raise IndexError('recorder is full: ' + str(self.capacity))
+        self._frames[first:last] = images.reshape((-1,) + self.shape)
+        entries = self._index[first:last]
+        for name in frame_ring.FRAME_META_DTYPE.names:
+            entries[name] = metas[name]
+        entries['offset'] = self._data_offset + self._frame_stride * \
+            np.arange(first, last, dtype=np.uint64)
+        self.count = last
+        self._header['count'] = self.count
+        return self.count
+
+    def close(self):
+        """
+        ファイルへ書き出し，記録したフレーム数までファイルを切り詰める．
+
+        """
+        self._header = self._index = self._frames = None
+        self._mmap.flush()
+        self._mmap.close()
+        self._file.truncate(
+            self._data_offset + self._frame_stride * self.count)
+        self._file.close()
+        return None
+
+
+class RawPlayer:
+    """
+    RawRecorderで記録したファイルを読み込むクラス．
+    ファイルをメモリマップするため，任意のフレームへO(1)で
+    コピーなしにアクセスできる．
+
+    """
+    def __init__(self, path):
+        """
+        ファイルを読み込み専用でメモリマップし，ヘッダを読み込む．
+
+        Parameters
+        --------------------------
+        path: str
+            RawRecorderで記録したファイルパス
+
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.ndarray((), FILE_HEADER_DTYPE, buffer=self._mmap)
+        if header['magic'].item() != MAGIC_VALUE:
+            raise ValueError('not a raw recording: ' + path)
+        self.shape = (
+            int(header['height']), int(header['width']),
+            int(header['channels']))
+        self.dtype = header['dtype'].item().decode()
+        names = header['param_names'].item().decode()
+        self.param_names = names.split(',')[:int(header['param_count'])]
+        # 記録中のファイルを開いた場合も考慮し，ファイルサイズに収まる分のみ
+        frame_stride = int(header['frame_stride'])
+        data_offset = int(header['data_offset'])
+        self.count = min(
+            int(header['count']),
+            (os.path.getsize(path) - data_offset) // frame_stride)
+        self.index = np.ndarray(
+            (self.count,), INDEX_DTYPE, buffer=self._mmap,
+            offset=int(header['index_offset']))
+        self._frames = _frame_array(
+            self._mmap, self.shape, self.dtype, self.count,
+            data_offset, frame_stride)
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        """
+        index番目の画像をコピーせずに返す(読み込み専用)．
+
+        """
+        return self._frames[index]
+
+    @property
+    def timestamps(self):
+        """
+        全フレームの撮影時刻(time.monotonic_ns)．
+
+        """
+        return self.index['capture_ns']
+
+    def play(self, realtime=False, speed=1.0):
+        """
+        記録したフレームを順番に返すジェネレータ．
+
+        Parameters
+        --------------------------
+        realtime: bool
+            Trueの場合は撮影時刻の間隔に合わせて返す．
+            Falseの場合は待たずに最大速度で返す．
+        speed: float
+            realtimeの場合の再生速度の倍率
+
+        Yields
+        --------------------------
+        image: numpy.ndarray
+            画像(読み込み専用)
+        meta: numpy.void
+            索引(フレーム情報と画像の位置)
+
+        """
+        start = time.monotonic()
+        timestamps = self.timestamps
+        for i in range(self.count):
+            if realtime is True:
+                delay = (int(timestamps[i]) - int(timestamps[0])) / 1e9
+                wait = start + delay / speed - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            yield self._frames[i], self.index[i]
+
+    def close(self):
+        """
+        メモリマップとファイルを閉じる．
+        取得した画像も事前に破棄しておくこと．
+
+        """
+        self.index = self._frames = None
+        self._mmap.close()
+        self._file.close()
+        return None
+
+
+def _frame_array(buffer, shape, dtype, count, offset, stride):
+    """
+    ファイル上の画像領域を(フレーム, 縦, 横, チャンネル)の配列として参照する．
+
+    """
+    itemsize = np.dtype(dtype).itemsize
+    strides = (stride,) + tuple(
+        int(np.prod(shape[i + 1:])) * itemsize for i in range(len(shape)))
+    return np.ndarray(
+        (count,) + shape, dtype, buffer=buffer, offset=offset,
+        strides=strides)
@@ -0,0 +1,1150 @@
+import time
+
+import numpy as np
+
+import frame_notifier
+import shared_frame
+
+
+# 共有メモリ先頭のヘッダ(uint64配列)の各要素の位置
+HEAD = 0
+MAGIC = 1
+SLOTS = 2
+HEIGHT = 3
+WIDTH = 4
+CHANNELS = 5
+DTYPE = 6
+FRAME_STRIDE = 7
+PARAM_COUNT = 8
+GENERATION = 9
+LATEST = 10
+SUPERSEDED = 11
+HEADER_WORDS = 16
+# ヘッダに続くパラメータ名(カンマ区切りのutf-8)領域のバイト数
+PARAM_NAMES_NBYTES = 256
+# 共有メモリがFrameRingであることを示す値
+MAGIC_VALUE = int.from_bytes(b'FRMRING1', 'little')
+# 各領域の先頭をキャッシュライン境界へ揃える
+ALIGNMENT = 64
+# 通知を受け取れない場合(外部プロセスから接続した場合)のポーリング間隔[s]
+POLL_INTERVAL = 1/1000
+# フレーム毎に記録できるカメラパラメータ数の上限
+MAX_PARAMS = 8
+# 各スロットの画像の直前に置くフレーム情報
+#   frame_id: フレーム番号(単調増加)
+#   capture_ns: 撮影時刻(time.monotonic_ns)
+#   publish_ns: 公開時刻(time.monotonic_ns)
+#   params: 撮影時のカメラパラメータ(param_namesの順)
+FRAME_META_DTYPE = np.dtype([
+    ('frame_id', '<u8'),
+    ('capture_ns', '<u8'),
+    ('publish_ns', '<u8'),
+    ('params', '<f8', (MAX_PARAMS,)),
+])
+
+
+def _align(nbytes):
+    """
+    nbytesをALIGNMENTの倍数へ切り上げる．
+
+    """
+    return (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# フレーム情報領域のバイト数
+META_NBYTES = _align(FRAME_META_DTYPE.itemsize)
+
+
+def roi_slice(roi):
+    """
+    関心領域を画像のスライスへ変換する．
+
+    Parameters
+    --------------------------
+    roi: tuple
+        関心領域 (x, y, 幅, 高さ)
+
+    Returns
+    --------------------------
+    slices: tuple of slice
+        画像[slices]で関心領域を参照するスライス (縦, 横)
+
+    """
+    x, y, width, height = roi
+    return slice(y, y + height), slice(x, x + width)
+
+
+def generation_name(name, generation):
+    """
+    リングバッファの世代毎の共有メモリ名を求める．
+    最初の世代(0)はパイプラインが作成した名前のまま．
+
+    Parameters
+    --------------------------
+    name: str
+        最初の世代の共有メモリ名
+    generation: int
+        世代
+
+    Returns
+    --------------------------
+    name: str
+        世代の共有メモリ名 ('<name>_g<世代>')
+
+    """
+    if generation == 0:
+        return name
+    return name + '_g' + str(generation)
+
+
+def empty_meta():
+    """
+    フレーム情報の読み込み先を作成する．
+
+    Returns
+    --------------------------
+    meta: numpy.ndarray
+        FRAME_META_DTYPE型の0次元配列
+
+    """
+    return np.zeros((), dtype=FRAME_META_DTYPE)
+
+
+class FrameRing:
+    """
+    複数スロットを持つ共有メモリ上の画像リングバッファ．
+    スロット毎のシーケンスカウンタ(seqlock)で排他制御を行うため，
+    書き込み側(カメラプロセス)はロックを取らず待たされることがない．
+    読み込み側はコピー前後のシーケンス値を比較して書き込み途中の
+    画像(torn read)を検出し，最新画像を読み直す．
+
+    書き込み側は1プロセスのみとすること．
+    読み込み側はsubscribeで購読者番号を取得し，waitで新しいフレームの
+    公開を待つ(スリープによるポーリングは不要)．
+
+    共有メモリは名前付き(multiprocessing.shared_memory)で確保し，
+    先頭のヘッダに画像の形状，型，スロット数を記録する．
+    そのためmain.pyから起動していないプロセスでもattachで名前を
+    指定するだけでコピーなしに接続できる．
+    ただし外部から接続した場合は通知用のパイプを共有できないため，
+    waitはPOLL_INTERVAL毎のポーリングとなる．
+
+    <共有メモリの配置>
+        ヘッダ(uint64 * HEADER_WORDS)
+        パラメータ名(PARAM_NAMES_NBYTES)
+        シーケンスカウンタ(uint64 * slots)
+        スロット(stride * slots)
+            フレーム情報(FRAME_META_DTYPE, META_NBYTES)
+            画像(ALIGNMENTに揃えたバイト数)
+
+    フレーム情報は画像と同じシーケンス値で保護されるため，
+    読み込み側はframe_idや撮影時刻から遅延の計測や重複の判定を
+    追加のプロセス間通信なしで行える．
+
+    <シーケンス値>
+        フレーム番号nをスロットn % slotsへ書き込む際，
+        書き込み中は2n+1，書き込み完了後は2n+2とする．
+        そのため偶数であれば書き込み完了で，値からフレーム番号がわかる．
+
+    <世代(解像度の変更)>
+        共有メモリの大きさは変えられないため，書き込み側は
+        renegotiateで新しい形状の次の世代のリングバッファを作成し，
+        以降はそちらへ書き込む．フレーム番号は前の世代から続けて数える．
+        最初の世代のヘッダに最新の世代を記録し，前の世代には
+        置き換えられたこと(SUPERSEDED)を記録して読み込み側へ通知する．
+        読み込み側(FrameReader)は前の世代のフレームを読み終えた
+        フレームの境目でlatestにより最新の世代へ切り替える．
+        通知用のパイプはフォーク前にしか作れないため，全世代で共有する．
+
+    """
+    def __init__(
+            self, shape, dtype, slots=3, subscribers=4, name=None,
+            param_names=(), notifier=None):
+        """
+        名前付き共有メモリを確保してヘッダを書き込み，
+        numpy配列として参照する．
+
+        Parameters
+        --------------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型
+        slots: int
+            スロット数．2以上．
+        subscribers: int
+            新しいフレームの通知を受け取れるプロセス数の上限
+        name: str, default None
+            共有メモリ名．外部プロセスからはこの名前で接続する．
+            Noneの場合は自動で決める．
+        param_names: list of str
+            フレーム情報に記録するカメラパラメータ名．MAX_PARAMS個まで．
+        notifier: frame_notifier.FrameNotifier, default None
+            通知用インスタンス．Noneの場合は新しく作成する．
+            (次の世代は前の世代のものを共有する)
+
+        """
+        if slots < 2:
+            raise ValueError('slots must be 2 or more: ' + str(slots))
+        names = ','.join(param_names).encode()
+        if len(param_names) > MAX_PARAMS or len(names) > PARAM_NAMES_NBYTES:
+            raise ValueError('too many params: ' + str(param_names))
+        shape = tuple(shape)
+        dtype = np.dtype(dtype).str
+        shm = shared_frame.create_shared_memory(
+            name, self.nbytes(shape, dtype, slots))
+        header = np.ndarray((HEADER_WORDS,), np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[SLOTS] = slots
+        header[HEIGHT], header[WIDTH], header[CHANNELS] = shape
+        header[DTYPE] = int.from_bytes(
+            dtype.encode().ljust(8, b'\0'), 'little')
+        header[FRAME_STRIDE] = META_NBYTES + _align(
+            shared_frame.frame_nbytes(shape, dtype))
+        header[PARAM_COUNT] = len(param_names)
+        offset = _align(HEADER_WORDS * 8)
+        shm.buf[offset:offset + len(names)] = names
+        offset += PARAM_NAMES_NBYTES
+        np.ndarray((slots,), np.uint64, buffer=shm.buf, offset=offset)[:] = 0
+        # 初期化が終わってからMAGICを書き込む
+        header[MAGIC] = MAGIC_VALUE
+        del header
+        if notifier is None:
+            notifier = frame_notifier.FrameNotifier(subscribers)
+        self._setup(shm, notifier, True)
+        return None
+
+    @classmethod
+    def attach(cls, name, notifier=None):
+        """
+        既存の名前付き共有メモリへ接続する．
+        形状，型，スロット数はヘッダから読み込む．
+
+        Parameters
+        --------------------------
+        name: str
+            共有メモリ名
+        notifier: frame_notifier.FrameNotifier, default None
+            通知用インスタンス．Noneの場合waitはポーリングとなる．
+
+        Returns
+        --------------------------
+        ring: FrameRing
+            接続したリングバッファ
+
+        """
+        ring = cls.__new__(cls)
+        ring._setup(shared_frame.attach_shared_memory(name), notifier, False)
+        return ring
+
+    @staticmethod
+    def nbytes(shape, dtype, slots):
+        """
+        リングバッファ全体に必要なバイト数を計算する．
+
+        Parameters
+        --------------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型
+        slots: int
+            スロット数
+
+        Returns
+        --------------------------
+        nbytes: int
+            ヘッダ，パラメータ名，シーケンスカウンタ，スロットの合計バイト数
+
+        """
+        stride = META_NBYTES + _align(shared_frame.frame_nbytes(shape, dtype))
+        return (
+            _align(HEADER_WORDS * 8) + PARAM_NAMES_NBYTES +
+            _align(slots * 8) + stride * slots)
+
+    def _setup(self, shm, notifier, is_owner):
+        """
+        ヘッダから形状等を読み込み，共有メモリ上の各領域を
+        コピーせずに参照するnumpy配列を作成する．
+
+        """
+        header = np.ndarray((HEADER_WORDS,), np.uint64, buffer=shm.buf)
+        if int(header[MAGIC]) != MAGIC_VALUE:
+            raise ValueError('not a FrameRing: ' + shm.name)
+        self.shm = shm
+        self.name = shm.name
+        self.notifier = notifier
+        self.is_owner = is_owner
+        self.slots = int(header[SLOTS])
+        self.shape = (
+            int(header[HEIGHT]), int(header[WIDTH]), int(header[CHANNELS]))
+        self.dtype = int(header[DTYPE]).to_bytes(
+            8, 'little').rstrip(b'\0').decode()
+        self.frame_nbytes = shared_frame.frame_nbytes(self.shape, self.dtype)
+        self._header = header
+        offset = _align(HEADER_WORDS * 8)
+        names = bytes(shm.buf[offset:offset + PARAM_NAMES_NBYTES])
+        names = names.rstrip(b'\0').decode()
+        self.param_names = names.split(',')[:int(header[PARAM_COUNT])]
+        self.generation = int(header[GENERATION])
+        # 最初の世代の共有メモリ名
+        self.base_name = self.name
+        if self.generation > 0:
+            self.base_name = self.name[:-len(
+                generation_name('', self.generation))]
+        offset += PARAM_NAMES_NBYTES
+        self._seq = np.ndarray(
+            (self.slots,), np.uint64, buffer=shm.buf, offset=offset)
+        offset += _align(self.slots * 8)
+        stride = int(header[FRAME_STRIDE])
+        self._meta = np.ndarray(
+            (self.slots,), FRAME_META_DTYPE, buffer=shm.buf,
+            offset=offset, strides=(stride,))
+        # 全スロットを(スロット, 縦, 横, チャンネル)の1つの配列として参照する
+        itemsize = np.dtype(self.dtype).itemsize
+        strides = (stride,) + tuple(
+            int(np.prod(self.shape[i + 1:])) * itemsize
+            for i in range(len(self.shape)))
+        self._slot_array = np.ndarray(
+            (self.slots,) + self.shape, self.dtype, buffer=shm.buf,
+            offset=offset + META_NBYTES, strides=strides)
+        self._frames = [self._slot_array[i] for i in range(self.slots)]
+        return None
+
+    def __getstate__(self):
+        """
+        プロセス生成時のpickle用．共有メモリ名のみ渡して接続し直す．
+
+        """
+        return {'name': self.name, 'notifier': self.notifier}
+
+    def __setstate__(self, state):
+        """
+        プロセス生成時のunpickle用．
+
+        """
+        self._setup(
+            shared_frame.attach_shared_memory(state['name']),
+            state['notifier'], False)
+        return None
+
+    def close(self):
+        """
+        共有メモリを参照するnumpy配列を破棄して共有メモリを閉じる．
+        begin_write等で取得した配列も事前に破棄しておくこと．
+
+        """
+        self._header = self._seq = self._meta = None
+        self._slot_array = self._frames = None
+        self.shm.close()
+        return None
+
+    def unlink(self):
+        """
+        共有メモリを削除する．作成したプロセスで最後に1度だけ呼ぶ．
+        最初の世代の場合は残っている次の世代の共有メモリも削除する．
+
+        """
+        if self.is_owner is not True:
+            return None
+        if self.generation == 0:
+            # closeの後でも呼べるよう接続し直して最新の世代を読む
+            origin = FrameRing.attach(self.name)
+            latest = int(origin._header[LATEST])
+            origin.close()
+            for generation in range(1, latest + 1):
+                _unlink_name(generation_name(self.name, generation))
+        self.shm.unlink()
+        return None
+
+    @property
+    def is_superseded(self):
+        """
+        次の世代のリングバッファへ置き換えられたかどうか．
+        置き換えられた後はこの世代へは書き込まれない．
+
+        """
+        return int(self._header[SUPERSEDED]) != 0
+
+    def latest(self):
+        """
+        最新の世代のリングバッファを取得する．
+        最初の世代(パイプラインが作成したもの)で呼ぶ．
+
+        Returns
+        --------------------------
+        ring: FrameRing
+            最新の世代のリングバッファ．
+            置き換えられていない場合は自身．
+
+        """
+        generation = int(self._header[LATEST])
+        if generation == self.generation:
+            return self
+        return FrameRing.attach(
+            generation_name(self.base_name, generation), self.notifier)
+
+    def renegotiate(self, shape, dtype=None):
+        """
+        新しい形状の次の世代のリングバッファを作成して公開する．
+        書き込み側のみ呼ぶ．以降は戻り値のリングバッファへ書き込むこと．
+        2つ前の世代(最初の世代を除く)の共有メモリはこの時点で削除する．
+        (読み込み側が接続中の場合は閉じるまで解放されない)
+
+        Parameters
+        --------------------------
+        shape: tuple
+            新しい画像の形状 (縦, 横, チャンネル数)
+        dtype: str, default None
+            新しい画像の型．Noneの場合は変えない．
+
+        Returns
+        --------------------------
+        ring: FrameRing
+            次の世代のリングバッファ
+
+        """
+        generation = self.generation + 1
+        ring = FrameRing(
+            shape, self.dtype if dtype is None else dtype, slots=self.slots,
+            name=generation_name(self.base_name, generation),
+            param_names=self.param_names, notifier=self.notifier)
+        # 前の世代から続けてフレーム番号を数える
+        ring._header[HEAD] = self.count
+        ring._header[GENERATION] = generation
+        ring.generation = generation
+        ring.base_name = self.base_name
+        # 最新の世代を記録してから置き換えを公開する
+        if self.generation == 0:
+            self._header[LATEST] = generation
+        else:
+            origin = FrameRing.attach(self.base_name)
+            origin._header[LATEST] = generation
+            origin.close()
+        self._header[SUPERSEDED] = 1
+        if self.notifier is not None:
+            self.notifier.notify()
+        if generation - 2 > 0:
+            _unlink_name(generation_name(self.base_name, generation - 2))
+        print('renegotiate: ' + ring.name + ' shape: ' + str(ring.shape))
+        return ring
+
+    @property
+    def count(self):
+        """
+        これまでに書き込みが完了したフレーム数．
+        最新フレームのフレーム番号はcount - 1．
+
+        """
+        return int(self._header[HEAD])
+
+    def begin_write(self):
+        """
+        次のスロットを書き込み中にし，そのスロットを参照するnumpy配列を返す．
+        カメラから直接この配列へ書き込むことで途中のコピーをなくす．
+        書き込み後はend_writeを呼ぶこと．
+        書き込みに失敗した場合はend_writeを呼ばずに再度begin_writeを
+        呼べば同じスロットを使用する．
+
+        Returns
+        --------------------------
+        slot: numpy.ndarray
+            書き込み先スロット．形状と型はリングバッファと同じ．
+
+        """
+        frame_no = self.count
+        slot = frame_no % self.slots
+        self._seq[slot] = 2 * frame_no + 1
+        return self._frames[slot]
+
+    def end_write(self, capture_ns=None, params=None):
+        """
+        begin_writeで書き込み中にしたスロットのフレーム情報を書き込み，
+        書き込み完了にして公開する．
+
+        Parameters
+        --------------------------
+        capture_ns: int, default None
+            撮影時刻(time.monotonic_ns)．Noneの場合は公開時刻と同じ．
+        params: list of float, default None
+            撮影時のカメラパラメータ(param_namesの順)
+
+        Returns
+        --------------------------
+        frame_no: int
+            公開したフレーム番号
+
+        """
+        frame_no = self.count
+        slot = frame_no % self.slots
+        meta = self._meta[slot]
+        publish_ns = time.monotonic_ns()
+        meta['frame_id'] = frame_no
+        meta['capture_ns'] = publish_ns if capture_ns is None else capture_ns
+        meta['publish_ns'] = publish_ns
+        if params is not None:
+            meta['params'][:len(params)] = params
+        self._seq[slot] = 2 * frame_no + 2
+        self._header[HEAD] = frame_no + 1
+        if self.notifier is not None:
+            self.notifier.notify()
+        return frame_no
+
+    def write(self, image, capture_ns=None, params=None):
+        """
+        次のスロットへ画像をコピーして書き込む．ロックは取らない．
+
+        Parameters
+        --------------------------
+        image: numpy.ndarray
+            書き込む画像．要素数がshapeと一致すること．
+        capture_ns: int, default None
+            撮影時刻(time.monotonic_ns)
+        params: list of float, default None
+            撮影時のカメラパラメータ(param_namesの順)
+
+        Returns
+        --------------------------
+        frame_no: int
+            書き込んだフレーム番号
+
+        """
+        # 書き込み中(奇数)にしてからコピーし，完了(偶数)にする
+        self.begin_write()[...] = image.reshape(self.shape)
+        return self.end_write(capture_ns, params)
+
+    def subscribe(self):
+        """
+        新しいフレームの通知を受け取るための購読者番号を取得する．
+        読み込み側のプロセス内で呼ぶ．
+
+        Returns
+        --------------------------
+        subscriber: int
+            購読者番号．通知を受け取れない場合None．
+
+        """
+        if self.notifier is None:
+            return None
+        return self.notifier.subscribe()
+
+    def unsubscribe(self, subscriber):
+        """
+        購読者番号を解放する．
+
+        Parameters
+        --------------------------
+        subscriber: int
+            subscribeで取得した購読者番号
+
+        """
+        if subscriber is not None:
+            self.notifier.unsubscribe(subscriber)
+        return None
+
+    def release(self, pid):
+        """
+        終了したプロセスが解放せずに残した購読者番号を解放する．
+
+        Parameters
+        --------------------------
+        pid: int
+            終了したプロセスのプロセスID
+
+        """
+        if self.notifier is not None:
+            self.notifier.release(pid)
+        return None
+
+    def wait(self, count, subscriber, timeout=None):
+        """
+        公開済みのフレーム数がcountより多くなるまでブロックする．
+
+        Parameters
+        --------------------------
+        count: int
+            既に読み込んだフレーム数(最後に読んだフレーム番号 + 1)
+        subscriber: int
+            subscribeで取得した購読者番号
+        timeout: float, default None
+            最大待機時間[s]．Noneの場合は無制限．
+
+        Returns
+        --------------------------
+        is_updated: bool
+            新しいフレームがある場合，もしくは次の世代へ置き換えられた
+            場合True，タイムアウトした場合False．
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # 置き換えられた場合も読み込み側が切り替えられるよう待機を終える
+        while self.count <= count and self.is_superseded is False:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+            if subscriber is None:
+                time.sleep(POLL_INTERVAL)
+            else:
+                self.notifier.wait(subscriber, remaining)
+        return True
+
+    def read(self, frame_no, out, meta=None, rois=None):
+        """
+        フレーム番号frame_noの画像をoutへコピーする．
+
+        Parameters
+        --------------------------
+        frame_no: int
+            読み込むフレーム番号
+        out: numpy.ndarray or list of numpy.ndarray
+            コピー先．形状と型はリングバッファと同じ．
+            roisを指定した場合は関心領域毎のコピー先のリスト．
+        meta: numpy.ndarray, default None
+            フレーム情報のコピー先(empty_metaで作成)．
+        rois: list of tuple, default None
+            関心領域(x, y, 幅, 高さ)のリスト．指定した場合は
+            関心領域のみをコピーする．
+
+        Returns
+        --------------------------
+        is_read: bool
+            コピーできた場合True．
+            まだ書き込まれていない，もしくはコピー中に上書きされた場合False．
+
+        """
+        slot = frame_no % self.slots
+        seq = 2 * frame_no + 2
+        if int(self._seq[slot]) != seq:
+            return False
+        if rois is None:
+            out[...] = self._frames[slot]
+        else:
+            for roi, roi_out in zip(rois, out):
+                roi_out[...] = self._frames[slot][roi_slice(roi)]
+        if meta is not None:
+            meta[...] = self._meta[slot]
+        # コピー中に書き込みが始まっていればtorn read
+        return int(self._seq[slot]) == seq
+
+    def read_meta(self, frame_no, meta):
+        """
+        フレーム番号frame_noのフレーム情報のみをmetaへコピーする．
+        画像をコピーする前に撮影時刻等で読むフレームを選ぶ場合に使う．
+
+        Parameters
+        --------------------------
+        frame_no: int
+            読み込むフレーム番号
+        meta: numpy.ndarray
+            フレーム情報のコピー先(empty_metaで作成)．
+
+        Returns
+        --------------------------
+        is_read: bool
+            コピーできた場合True．
+            まだ書き込まれていない，もしくは上書きされた場合False．
+
+        """
+        slot = frame_no % self.slots
+        seq = 2 * frame_no + 2
+        if int(self._seq[slot]) != seq:
+            return False
+        meta[...] = self._meta[slot]
+        return int(self._seq[slot]) == seq
+
+    def view(self, frame_no, rois=None, meta=None):
+        """
+        フレーム番号frame_noのスロットをコピーせずに参照する．
+        参照中も書き込み側は待たないため，使用後にis_validで
+        上書きされていないことを確認し，上書きされていれば
+        参照した画像から得た結果は捨てること．
+
+        Parameters
+        --------------------------
+        frame_no: int
+            参照するフレーム番号
+        rois: list of tuple, default None
+            関心領域(x, y, 幅, 高さ)のリスト．
+        meta: numpy.ndarray, default None
+            フレーム情報のコピー先(empty_metaで作成)．
+
+        Returns
+        --------------------------
+        views: numpy.ndarray or list of numpy.ndarray or None
+            スロットの画像(読み込み専用)．roisを指定した場合は
+            関心領域毎の画像のリスト．
+            まだ書き込まれていない，もしくは上書きされた場合None．
+
+        """
+        slot = frame_no % self.slots
+        if int(self._seq[slot]) != 2 * frame_no + 2:
+            return None
+        frame = self._frames[slot].view()
+        frame.flags.writeable = False
+        if meta is not None:
+            meta[...] = self._meta[slot]
+        if self.is_valid(frame_no) is not True:
+            return None
+        if rois is None:
+            return frame
+        return [frame[roi_slice(roi)] for roi in rois]
+
+    def is_valid(self, frame_no):
+        """
+        フレーム番号frame_noのスロットがまだ上書きされていないか確認する．
+
+        Parameters
+        --------------------------
+        frame_no: int
+            確認するフレーム番号
+
+        Returns
+        --------------------------
+        is_valid: bool
+            書き込み完了後に上書きが始まっていなければTrue．
+
+        """
+        return int(self._seq[frame_no % self.slots]) == 2 * frame_no + 2
+
+    def window(self, k, last=None, out=None, metas=None):
+        """
+        フレーム番号lastまでの連続するk枚の画像を(k, 縦, 横, チャンネル)の
+        配列として返す．時間方向の処理(平均，背景差分，動き検出等)を
+        フレーム毎のループなしに行うためのもの．
+
+        k枚のスロットが連続している場合はコピーせずに参照する(読み込み専用)．
+        その場合は使用後にis_valid(先頭のフレーム番号)で上書きされて
+        いないことを確認し，上書きされていれば結果を捨てること．
+        連続していない場合，もしくはoutを指定した場合は1回の
+        まとめたコピー(numpy.take)で取得する．
+
+        Parameters
+        --------------------------
+        k: int
+            枚数．書き込み中のスロットを除いたslots - 1枚まで．
+        last: int, default None
+            最後のフレーム番号．Noneの場合は最新のフレーム．
+        out: numpy.ndarray, default None
+            コピー先 (k, 縦, 横, チャンネル)．
+        metas: numpy.ndarray, default None
+            フレーム情報のコピー先 (k,)．FRAME_META_DTYPEの配列．
+
+        Returns
+        --------------------------
+        first: int or None
+            先頭のフレーム番号．k枚揃っていない，もしくは
+            上書きされた場合None．
+        frames: numpy.ndarray or None
+            k枚の画像 (k, 縦, 横, チャンネル)．古い順．
+
+        """
+        if k < 1 or k > self.slots - 1:
+            raise ValueError('k must be 1 to slots - 1: ' + str(k))
+        if last is None:
+            last = self.count - 1
+        first = last - k + 1
+        if first < 0 or last >= self.count:
+            return None, None
+        frame_nos = np.arange(first, last + 1, dtype=np.uint64)
+        # np.takeの添字はintpのみ受け付けるため，スロット番号はintpで持つ
+        slots = (np.arange(first, last + 1) % self.slots).astype(np.intp)
+        if not np.array_equal(self._seq[slots], 2 * frame_nos + 2):
+            return None, None
+        start = int(slots[0])
+        if out is None and start + k <= self.slots:
+            frames = self._slot_array[start:start + k].view()
+            frames.flags.writeable = False
+        else:
+            frames = np.take(self._slot_array, slots, axis=0, out=out)
+        if metas is not None:
+            metas[...] = self._meta[slots]
+        # 最も古いフレームが上書きされていなければ全て上書きされていない
+        if self.is_valid(first) is not True:
+            return None, None
+        return first, frames
+
+    def read_latest(self, out, meta=None, retry=10, rois=None):
+        """
+        最新の画像をoutへコピーする．
+        torn readを検出した場合は最新フレームを読み直す．
+
+        Parameters
+        --------------------------
+        out: numpy.ndarray or list of numpy.ndarray
+            コピー先．形状と型はリングバッファと同じ．
+            roisを指定した場合は関心領域毎のコピー先のリスト．
+        meta: numpy.ndarray, default None
+            フレーム情報のコピー先(empty_metaで作成)．
+        retry: int
+            読み直しの最大回数
+        rois: list of tuple, default None
+            関心領域(x, y, 幅, 高さ)のリスト．
+
+        Returns
+        --------------------------
+        frame_no: int or None
+            コピーしたフレーム番号．
+            画像がまだない場合，読み直しに失敗した場合None．
+
+        """
+        for _ in range(retry + 1):
+            count = self.count
+            if count == 0:
+                return None
+            if self.read(count - 1, out, meta, rois) is True:
+                return count - 1
+        return None
+
+
+class FrameReader:
+    """
+    FrameRingの読み込み側．読み込み側プロセス毎に1つ作成する．
+    各インスタンスが自身の読み込み位置(カーソル)を持つため，
+    1つのリングバッファへ任意の数の読み込み側が接続できる．
+    書き込み側は読み込み側の数に関係なく1回書き込むだけでよい．
+
+    <モード>
+        'latest': 常に最新の画像を読む．間のフレームは読み飛ばす．
+        'every': 全てのフレームを順番に読む．読み込みが遅れて
+                 上書きされたフレームは読み飛ばしてdroppedへ加算する．
+
+    <関心領域>
+        roisを指定した場合は画像全体ではなく関心領域のみを読む．
+        readは関心領域毎の小さな配列(empty_roisで作成)へコピーし，
+        read_viewはスロット上の関心領域をコピーせずに参照する．
+
+    <世代の切り替え>
+        リングバッファが次の世代へ置き換えられた場合は，前の世代の
+        フレームを読み終えた時点で最新の世代へ切り替える(self.ringが
+        変わる)．形状か型が変わった場合はフレームを読まずにNoneを返すため，
+        読み込み側はself.ring.shapeを確認して読み込み先を作り直す．
+
+    """
+    def __init__(self, ring, mode='latest', counter=None, rois=None):
+        """
+        リングバッファの通知を購読し，カーソルを現在位置に合わせる．
+        読み込み側のプロセス内で作成すること．
+
+        Parameters
+        --------------------------
+        ring: FrameRing
+            読み込むリングバッファ
+        mode: str
+            'latest'もしくは'every'
+        counter: stage_stats.StageCounter, default None
+            指定した場合は待ち時間，コピー時間，遅延等を記録する．
+        rois: list of tuple, default None
+            関心領域(x, y, 幅, 高さ)のリスト．Noneの場合は画像全体．
+
+        """
+        if mode not in ('latest', 'every'):
+            raise ValueError('unknown mode: ' + str(mode))
+        # 再起動時等で既に置き換えられている場合は最新の世代を読む
+        self._origin = ring
+        self.ring = ring.latest()
+        if rois is not None:
+            rois = [tuple(int(v) for v in roi) for roi in rois]
+            self._check_rois(rois)
+        self.mode = mode
+        self.counter = counter
+        self.rois = rois
+        # 次に読み込むフレーム番号
+        self.cursor = self.ring.count
+        # 直前の読み込みを始めた時のカーソル
+        self._previous_cursor = self.cursor
+        # 'every'モードで読み飛ばしたフレーム数
+        self.dropped = 0
+        self._subscriber = ring.subscribe()
+        # 遅延の記録用のフレーム情報
+        self._meta = empty_meta()
+        return None
+
+    def _check_rois(self, rois):
+        """
+        関心領域が画像内にあることを確認する．
+
+        """
+        height, width = self.ring.shape[:2]
+        for roi in rois:
+            x, y, roi_width, roi_height = roi
+            if x < 0 or y < 0 or roi_width <= 0 or roi_height <= 0 or \
+                    x + roi_width > width or y + roi_height > height:
+                raise ValueError('roi out of frame: ' + str(roi))
+        return None
+
+    def _switch(self):
+        """
+        最新の世代のリングバッファへ切り替える．
+
+        Returns
+        --------------------------
+        is_changed: bool
+            画像の形状か型が変わった場合True
+
+        """
+        previous = self.ring
+        self.ring = self._origin.latest()
+        if previous is not self._origin:
+            try:
+                previous.close()
+            except BufferError:
+                # read_viewの参照が残っている場合は参照が消えるまで閉じない
+                pass
+        print('switch to ' + self.ring.name)
+        if self.rois is not None:
+            self._check_rois(self.rois)
+        return previous.shape != self.ring.shape or \
+            previous.dtype != self.ring.dtype
+
+    def empty_rois(self):
+        """
+        関心領域毎のコピー先を作成する．
+
+        Returns
+        --------------------------
+        outs: list of numpy.ndarray
+            関心領域毎のコピー先 (高さ, 幅, チャンネル数)
+
+        """
+        return [
+            np.empty((height, width, self.ring.shape[2]), self.ring.dtype)
+            for _, _, width, height in self.rois
+        ]
+
+    def read(self, out, timeout=None, meta=None):
+        """
+        カーソル以降のフレームが公開されるまで待ち，outへコピーする．
+
+        Parameters
+        --------------------------
+        out: numpy.ndarray or list of numpy.ndarray
+            コピー先．形状と型はリングバッファと同じ．
+            roisを指定した場合は関心領域毎のコピー先(empty_roisで作成)．
+        timeout: float, default None
+            最大待機時間[s]．Noneの場合は無制限．
+        meta: numpy.ndarray, default None
+            フレーム情報のコピー先(empty_metaで作成)．
+
+        Returns
+        --------------------------
+        frame_no: int or None
+            コピーしたフレーム番号．タイムアウトした場合None．
+
+        """
+        if meta is None and self.counter is not None:
+            meta = self._meta
+
+        def fetch(frame_no):
+            if self.ring.read(frame_no, out, meta, self.rois) is True:
+                return frame_no
+            return None
+        frame_no, _ = self._record(self._read(fetch, timeout), meta)
+        return frame_no
+
+    def read_view(self, timeout=None, meta=None):
+        """
+        カーソル以降のフレームが公開されるまで待ち，
+        スロット上の画像(関心領域)をコピーせずに参照する．
+        参照した画像の使用後はis_validで上書きされていないことを確認し，
+        上書きされていれば結果を捨てること．
+
+        Parameters
+        --------------------------
+        timeout: float, default None
+            最大待機時間[s]．Noneの場合は無制限．
+        meta: numpy.ndarray, default None
+            フレーム情報のコピー先(empty_metaで作成)．
+
+        Returns
+        --------------------------
+        frame_no: int or None
+            参照したフレーム番号．タイムアウトした場合None．
+        views: numpy.ndarray or list of numpy.ndarray or None
+            スロット上の画像(読み込み専用)．roisを指定した場合は
+            関心領域毎の画像のリスト．タイムアウトした場合None．
+
+        """
+        if meta is None and self.counter is not None:
+            meta = self._meta
+
+        def fetch(frame_no):
+            return self.ring.view(frame_no, self.rois, meta)
+        return self._record(self._read(fetch, timeout), meta)
+
+    def read_window(self, k, out=None, timeout=None, metas=None):
+        """
+        カーソル以降のフレームが公開されるまで待ち，そのフレームまでの
+        k枚の画像を(k, 縦, 横, チャンネル)の配列として返す．
+        'every'モードではフレーム毎に1枚ずつずらした窓を返す．
+        (窓の先頭が上書きされる前に読めるよう，kはslotsより十分小さくする)
+        詳細はFrameRing.window参照．
+
+        Parameters
+        --------------------------
+        k: int
+            枚数．slots - 1枚まで．
+        out: numpy.ndarray, default None
+            コピー先 (k, 縦, 横, チャンネル)．Noneの場合は可能であれば
+            コピーせずに参照する．
+        timeout: float, default None
+            最大待機時間[s]．Noneの場合は無制限．
+        metas: numpy.ndarray, default None
+            フレーム情報のコピー先 (k,)．FRAME_META_DTYPEの配列．
+
+        Returns
+        --------------------------
+        frame_no: int or None
+            最後(最新)のフレーム番号．タイムアウトした場合None．
+        frames: numpy.ndarray or None
+            k枚の画像 (k, 縦, 横, チャンネル)．古い順．
+            参照の場合は使用後にis_valid(frame_no - k + 1)で確認すること．
+
+        """
+        if metas is None and self.counter is not None:
+            metas = np.zeros(k, dtype=FRAME_META_DTYPE)
+
+        def fetch(frame_no):
+            return self.ring.window(k, frame_no, out, metas)[1]
+        frame_no, frames = self._read(fetch, timeout)
+        meta = None if metas is None else metas[-1]
+        return self._record((frame_no, frames), meta)
+
+    def is_valid(self, frame_no):
+        """
+        read_viewで参照したフレームがまだ上書きされていないか確認する．
+
+        Parameters
+        --------------------------
+        frame_no: int
+            read_viewで参照したフレーム番号
+
+        Returns
+        --------------------------
+        is_valid: bool
+            上書きされていなければTrue．
+
+        """
+        return self.ring.is_valid(frame_no)
+
+    def _record(self, read_result, meta):
+        """
+        counterが指定されている場合は読み込んだフレームの統計情報を記録する．
+
+        """
+        frame_no, _ = read_result
+        if self.counter is None:
+            return read_result
+        if frame_no is not None:
+            # 'latest'モードで読み飛ばしたフレームも含めて記録する
+            self.counter.add('frames_in')
+            self.counter.add('dropped', frame_no - self._previous_cursor)
+            self.counter.add_latency(
+                time.monotonic_ns() - int(meta['capture_ns']))
+        self.counter.beat()
+        return read_result
+
+    def _read(self, fetch, timeout):
+        """
+        read，read_viewの本体．fetch(フレーム番号)で読み込み，
+        読めなかった場合はNoneが返るものとする．
+        counterが指定されている場合は待ち時間とコピー時間を記録する．
+
+        Returns
+        --------------------------
+        frame_no: int or None
+            読み込んだフレーム番号．タイムアウトした場合，もしくは
+            形状か型の変わる世代へ切り替えた場合None．
+        result: object
+            fetchの戻り値
+
+        """
+        self._previous_cursor = self.cursor
+        while True:
+            # 前の世代のフレームを読み終えてから次の世代へ切り替える
+            if self.cursor >= self.ring.count and \
+                    self.ring.is_superseded is True and \
+                    self._switch() is True:
+                return None, None
+            start = time.perf_counter_ns()
+            is_ready = self.ring.wait(self.cursor, self._subscriber, timeout)
+            copy_start = time.perf_counter_ns()
+            if is_ready is not True:
+                self._add_time(start, copy_start, copy_start)
+                return None, None
+            if self.cursor >= self.ring.count:
+                # 置き換えられたため待機を終えた
+                continue
+            if self.mode == 'latest':
+                frame_no, result = self._fetch_latest(fetch)
+            else:
+                frame_no, result = self._fetch_next(fetch)
+            self._add_time(start, copy_start, time.perf_counter_ns())
+            if frame_no is not None:
+                self.cursor = frame_no + 1
+                return frame_no, result
+
+    def _add_time(self, start, copy_start, end):
+        """
+        待ち時間とコピー時間を記録する．
+
+        """
+        if self.counter is not None:
+            self.counter.add('wait_ns', copy_start - start)
+            self.counter.add('copy_ns', end - copy_start)
+        return None
+
+    def _fetch_latest(self, fetch, retry=10):
+        """
+        最新のフレームを読む．torn readを検出した場合は
+        最新フレームを読み直す．
+
+        """
+        for _ in range(retry + 1):
+            count = self.ring.count
+            if count == 0:
+                break
+            result = fetch(count - 1)
+            if result is not None:
+                return count - 1, result
+        return None, None
+
+    def _fetch_next(self, fetch):
+        """
+        カーソル位置のフレームを読む．上書きされていた場合は
+        読める中で最も古いフレームまでカーソルを進めて読み直す．
+
+        """
+        while self.cursor < self.ring.count:
+            result = fetch(self.cursor)
+            if result is not None:
+                return self.cursor, result
+            # 書き込み中のスロットを除いたslots - 1枚が読める範囲
+            oldest = self.ring.count - self.ring.slots + 1
+            skip_to = max(self.cursor + 1, oldest)
+            self.dropped += skip_to - self.cursor
+            self.cursor = skip_to
+        return None, None
+
+    def close(self):
+        """
+        通知の購読を終了する．
+
+        """
+        self.ring.unsubscribe(self._subscriber)
+        return None
+
+
+def _unlink_name(name):
+    """
+    名前を指定して共有メモリを削除する．既に削除されている場合は何もしない．
+
+    """
+    try:
+        shm = shared_frame.attach_shared_memory(name)
+    except FileNotFoundError:
+        return None
+    shm.close()
+    shm.unlink()
+    return None
@@ -0,0 +1,225 @@
+import collections
+import time
+
+import numpy as np
+
+import frame_ring
+import stage_stats
+
+
+def split_frames(image, cameras):
+    """
+    FrameSynchronizerが出力した画像をカメラ毎の画像へ分ける．
+    コピーせずにビューを返す．
+
+    Parameters
+    --------------------------
+    image: numpy.ndarray
+        出力のリングバッファから読み込んだ画像 (カメラ数*縦, 横, チャンネル数)
+    cameras: int
+        カメラ数
+
+    Returns
+    --------------------------
+    frames: numpy.ndarray
+        カメラ毎の画像 (カメラ数, 縦, 横, チャンネル数)
+
+    """
+    return image.reshape((cameras, -1) + image.shape[1:])
+
+
+class FrameSynchronizer:
+    """
+    複数カメラの同期ステージ．
+    カメラ毎のリングバッファから撮影時刻の差がtolerance以内の
+    フレームの組を探し，1枚の画像(カメラ順に縦に並べたもの)として
+    出力のリングバッファへ書き込む．
+    読み込み側はsplit_framesでカメラ毎の画像を取り出せるため，
+    各自で対応付けを行う必要がない．
+
+    フレームの組を決めるまではフレーム情報のみを読み，
+    画像は出力のリングバッファのスロットへ直接コピーする(1回のみ)．
+    組にできなかったフレームはカメラ毎のdroppedへ加算する．
+
+    <出力のフレーム情報>
+        capture_ns: 組の中で最も早い撮影時刻
+        params: skew_ns(組の撮影時刻の最大差)，
+                offset<i>_ns(カメラiの撮影時刻のcapture_nsとの差)
+
+    """
+    def __init__(self, tolerance=0.005):
+        """
+        Parameters
+        --------------------------
+        tolerance: float
+            同じ組とみなす撮影時刻の差の上限[s]
+
+        """
+        print('__init__:FrameSynchronizer')
+        self.tolerance = tolerance
+        self.param_names = ()
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        # 統計情報のステージ名
+        self.stage_name = 'sync'
+        return None
+
+    def get_frame_format(self, shapes, dtypes):
+        """
+        出力画像の形状と型を取得する．
+        全てのカメラの画像の形状と型が同じであること．
+
+        Parameters
+        --------------------------
+        shapes: list of tuple
+            カメラ毎の画像の形状 (縦, 横, チャンネル数)
+        dtypes: list of str
+            カメラ毎の画像の型
+
+        Returns
+        ----------------------
+        shape: tuple
+            出力画像の形状 (カメラ数*縦, 横, チャンネル数)
+        dtype: str
+            出力画像の型
+
+        """
+        if len(set(map(tuple, shapes))) != 1 or len(set(dtypes)) != 1:
+            raise ValueError(
+                'frame format mismatch: ' + str(shapes) + ' ' + str(dtypes))
+        if len(shapes) + 1 > frame_ring.MAX_PARAMS:
+            raise ValueError('too many cameras: ' + str(len(shapes)))
+        self.param_names = ['skew_ns'] + [
+            'offset' + str(i) + '_ns' for i in range(len(shapes))]
+        height, width, channels = shapes[0]
+        return (height * len(shapes), width, channels), dtypes[0]
+
+    def main(self, kwargs):
+        in_rings = kwargs["in_rings"]
+        out_ring = kwargs.get("out_ring")
+        stop_event = kwargs["stop_event"]
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        cameras = len(in_rings)
+        tolerance_ns = int(self.tolerance * 1e9)
+        subscribers = [ring.subscribe() for ring in in_rings]
+        cursors = [ring.count for ring in in_rings]
+        # カメラ毎の組にしていないフレーム (フレーム番号, 撮影時刻)
+        pending = [collections.deque() for _ in in_rings]
+        meta = frame_ring.empty_meta()
+        # 組の数，カメラ毎の読み飛ばしたフレーム数，組の撮影時刻の差の分布
+        self.sets = 0
+        self.dropped = [0] * cameras
+        self.skew_hist = np.zeros(stage_stats.HIST_BUCKETS, np.uint64)
+        error = False
+        print('start sync')
+        while error is False and stop_event.is_set() is False:
+            try:
+                # フレーム情報のみ読んで候補へ加える
+                for i, ring in enumerate(in_rings):
+                    cursors[i] = self._collect(
+                        i, ring, cursors[i], pending[i], meta, counter)
+                empty = [i for i in range(cameras) if len(pending[i]) == 0]
+                if len(empty) > 0:
+                    # 候補のないカメラの新しいフレームを待つ
+                    i = empty[0]
+                    start = time.perf_counter_ns()
+                    in_rings[i].wait(
+                        cursors[i], subscribers[i], self.stop_interval)
+                    if counter is not None:
+                        counter.add('wait_ns', time.perf_counter_ns() - start)
+                        counter.beat()
+                    continue
+                heads = [pending[i][0][1] for i in range(cameras)]
+                if max(heads) - min(heads) > tolerance_ns:
+                    # 最も古いフレームは以降のどの組にも入らない
+                    i = int(np.argmin(heads))
+                    pending[i].popleft()
+                    self._drop(i, 1, counter)
+                    continue
+                frames = [pending[i].popleft() for i in range(cameras)]
+                self._emit(in_rings, out_ring, frames, counter)
+            except Exception as e:
+                error = e
+                print(error)
+        for ring, subscriber in zip(in_rings, subscribers):
+            ring.unsubscribe(subscriber)
+        print('sets: ' + str(self.sets) + ' dropped: ' + str(self.dropped) +
+              ' skew p50[ms]: ' +
+              str(stage_stats.percentile(self.skew_hist, 50)) +
+              ' p99[ms]: ' + str(stage_stats.percentile(self.skew_hist, 99)))
+        print('end sync')
+        if error is not False:
+            raise error
+        return None
+
+    def _collect(self, i, ring, cursor, pending, meta, counter):
+        """
+        カメラiの公開済みフレームのフレーム情報を読み，候補へ加える．
+        上書きされて読めないフレームは読み飛ばす．
+
+        Returns
+        --------------------------
+        cursor: int
+            次に読むフレーム番号
+
+        """
+        count = ring.count
+        # 書き込み中のスロットを除いたslots - 1枚が読める範囲
+        first = max(cursor, count - ring.slots + 1)
+        skipped = first - cursor
+        for frame_no in range(first, count):
+            if ring.read_meta(frame_no, meta) is True:
+                pending.append((frame_no, int(meta['capture_ns'])))
+            else:
+                skipped += 1
+        # 既に上書きされた候補は捨てる
+        while len(pending) > 0 and pending[0][0] < count - ring.slots + 1:
+            pending.popleft()
+            skipped += 1
+        self._drop(i, skipped, counter)
+        return count
+
+    def _emit(self, in_rings, out_ring, frames, counter):
+        """
+        フレームの組を出力のリングバッファへ書き込む．
+        コピー中に上書きされたフレームがあれば組を捨てる．
+
+        """
+        capture_times = [capture_ns for _, capture_ns in frames]
+        capture_ns = min(capture_times)
+        skew_ns = max(capture_times) - capture_ns
+        if out_ring is not None:
+            start = time.perf_counter_ns()
+            images = split_frames(out_ring.begin_write(), len(in_rings))
+            for i, (ring, (frame_no, _)) in enumerate(zip(in_rings, frames)):
+                if ring.read(frame_no, images[i]) is not True:
+                    # end_writeしなければ次の組で同じスロットを使う．
+                    # 組の全カメラのフレームを取り出し済みのため全て捨てる．
+                    for j in range(len(frames)):
+                        self._drop(j, 1, counter)
+                    return None
+            out_ring.end_write(
+                capture_ns,
+                [skew_ns] + [t - capture_ns for t in capture_times])
+            if counter is not None:
+                counter.add('copy_ns', time.perf_counter_ns() - start)
+        self.sets += 1
+        self.skew_hist[stage_stats.histogram_bucket(skew_ns)] += 1
+        if counter is not None:
+            counter.add('frames_in', len(frames))
+            counter.add('frames_out')
+            counter.add_latency(time.monotonic_ns() - capture_ns)
+            counter.beat()
+        return None
+
+    def _drop(self, i, frames, counter):
+        """
+        カメラiの読み飛ばしたフレーム数を加算する．
+
+        """
+        if frames > 0:
+            self.dropped[i] += frames
+            if counter is not None:
+                counter.add('dropped', frames)
+        return None
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import queue
+
+import numpy as np
+import cv2
+
+import shared_frame
+
+
+# 保存形式毎の拡張子
+EXTENSIONS = {'png': '.png', 'jpg': '.jpg', 'npy': '.npy'}
+
+# ワーカープロセス内で参照する保存待ち画像の共有メモリ
+_worker_shm = None
+_worker_frames = None
+
+
+def _init_worker(name, shape, dtype, slots):
+    """
+    ワーカープロセスの初期化関数．
+    保存待ち画像の共有メモリへ接続する．
+
+    """
+    global _worker_shm, _worker_frames
+    _worker_shm = shared_frame.attach_shared_memory(name)
+    _worker_frames = np.ndarray(
+        (slots,) + tuple(shape), dtype, buffer=_worker_shm.buf)
+    return None
+
+
+def _write_image(slot, path, codec, params):
+    """
+    ワーカープロセスで共有メモリ上の画像をエンコードして保存する．
+
+    Returns
+    ---------------------
+    slot: int
+        保存が終わり再利用できるスロット番号
+    error: str or None
+        保存に失敗した場合のエラーメッセージ
+
+    """
+    try:
+        image = _worker_frames[slot]
+        if codec == 'npy':
+            np.save(path, image)
+        elif cv2.imwrite(path, image, params) is not True:
+            raise IOError('imwrite failed: ' + path)
+    except Exception as e:
+        return slot, str(e)
+    return slot, None
+
+
+class ImageWriter:
+    """
+    画像保存専用のステージ．
+    保存する画像を共有メモリ上の保存待ちスロットへ1回コピーし，
+    エンコードとファイル書き込みはプロセスプールで並列に行う．
+    そのため呼び出し側(表示ループ等)はエンコードを待たない．
+
+    保存待ちスロット数がキューの上限となり，一杯の場合は
+    policyに従って画像を捨てる('drop')か空くまで待つ('block')．
+
+    """
+    def __init__(
+            self, shape, dtype, codec='png', quality=None,
+            workers=None, max_queue=8, policy='drop'):
+        """
+        保存待ち画像の共有メモリとプロセスプールを作成する．
+        保存を行うプロセス内で作成すること．
+
+        Parameters
+        --------------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型
+        codec: str
+            保存形式．'png'，'jpg'，'npy'(無圧縮)のいずれか．
+        quality: int, default None
+            'png'の場合は圧縮レベル(0-9)，'jpg'の場合は品質(0-100)．
+            Noneの場合はOpenCVの既定値．
+        workers: int, default None
+            エンコードを行うプロセス数．Noneの場合はCPU数．
+        max_queue: int
+            保存待ちにできる画像数の上限
+        policy: str
+            キューが一杯の場合の動作．'drop'もしくは'block'．
+
+        """
+        if codec not in EXTENSIONS:
+            raise ValueError('unknown codec: ' + str(codec))
+        if policy not in ('drop', 'block'):
+            raise ValueError('unknown policy: ' + str(policy))
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.codec = codec
+        self.policy = policy
+        self.params = []
+        if quality is not None and codec == 'png':
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, quality]
+        elif quality is not None and codec == 'jpg':
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        # 保存済み，破棄，失敗した画像数
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._shm = shared_frame.create_shared_memory(
+            None, shared_frame.frame_nbytes(self.shape, self.dtype) *
+            max_queue)
+        self._frames = np.ndarray(
+            (max_queue,) + self.shape, self.dtype, buffer=self._shm.buf)
+        # 空いている保存待ちスロット番号
+        self._free = queue.Queue()
+        for slot in range(max_queue):
+            self._free.put(slot)
+        self._pool = multiprocessing.Pool(
+            workers if workers is not None else os.cpu_count(),
+            initializer=_init_worker,
+            initargs=(self._shm.name, self.shape, self.dtype, max_queue))
+        return None
+
+    def submit(self, name, image):
+        """
+        画像を保存待ちにする．エンコードの完了は待たない．
+
+        Parameters
+        --------------------------
+        name: str
+            拡張子を除いた保存先のファイルパス
+        image: numpy.ndarray
+            保存する画像
+
+        Returns
+        --------------------------
+        is_queued: bool
+            保存待ちにできた場合True，キューが一杯で破棄した場合False．
+
+        """
+        try:
+            slot = self._free.get(block=self.policy == 'block')
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        self._frames[slot] = image.reshape(self.shape)
+        self._pool.apply_async(
+            _write_image,
+            (slot, name + EXTENSIONS[self.codec], self.codec, self.params),
+            callback=self._done)
+        return True
+
+    def _done(self, result):
+        """
+        保存完了時のコールバック．スロットを空きへ戻す．
+
+        """
+        slot, error = result
+        if error is None:
+            self.written += 1
+        else:
+            self.errors += 1
+            print('writer error : ' + error)
+        self._free.put(slot)
+        return None
+
+    def close(self):
+        """
+        保存待ちの画像を全て保存してからプロセスプールと
+        共有メモリを破棄する．
+
+        """
+        self._pool.close()
+        self._pool.join()
+        self._frames = None
+        self._shm.close()
+        self._shm.unlink()
+        return None
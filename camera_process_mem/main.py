@@ -1,87 +1,130 @@
-import multiprocessing
-import multiprocessing.sharedctypes
-
 import camera_main_process
+import pipeline
+import supervisor
 
 
 if __name__ == '__main__':
     # 次の3つのプロセスABCを動作させる．
     # また以下の共有変数がある．
     # <共有変数>
-    #   <a>．カメラ画像用共有メモリ3つ
-    #   <b>．aのうち，最後に保存されたメモリを示すインデックス
-    #   <c>．表示画像用共有メモリ1つ
-    #   <d>．画像アップデート要求用共有変数1つ
+    #   <a>．カメラ画像用リングバッファ(スロット数可変，seqlock)
     # (プロセス)
-    #   (A)．カメラインスタンスを作成，カメラ画像を常に取得して<a>へ書き込み，
-    #        <b>をアップデートする．
-    #   (B)．<d>が要求側に変わった場合，<b>に対応する<a>へアクセスして取得した
-    #        画像を<c>へ書き込む．
-    #   (C)．<c>から画像を取得し，<d>を要求側に変更する．
+    #   (A)．カメラインスタンスを作成，カメラ画像を常に取得して<a>へ
+    #        ロックなしで書き込み，新しい画像の公開を通知する．
+    #   (B)．<a>の新しい画像の通知を待ち，最新画像を読み込んで処理する．
+    #   (C)．<a>の新しい画像の通知を待ち，表示と保存を行う．
+    # BとCはそれぞれ自身の読み込み位置を持ち，互いに独立して<a>を読む．
+    # 各プロセスは通知が来るまでブロックするため，スリープによる
+    # ポーリングは行わない．
+    # リングバッファ，通知，プロセスはgraphからpipeline.Pipelineが
+    # 確保するため，ステージの追加や設定の変更はgraphを変えるだけでよい．
+    # 各プロセスは統計情報(フレームレート，遅延，待ち時間等)を
+    # 共有メモリへ記録する．実行中に別の端末から
+    #     python stage_stats.py camera0_stats
+    # で表示できる．
+    # カメラのパラメータは撮影中に別の端末から
+    #     python camera_control.py camera0_control camera [パラメータ名] [値]
+    # で取得，設定できる．(各ステージからはkwargs["control"]を使用する)
+    # 縦横(camera_width，camera_height)を変えた場合は撮影プロセスが
+    # 新しい大きさのリングバッファ(次の世代)を作成し，読み込み側は
+    # フレームの境目で切り替える．(縦と横は1回ずつ切り替わる)
+    # 世代の切り替えに対応していないステージ(RecordPicture等)がある場合，
+    # 縦横は変えられない．
 
     # マルチプロセスバージョン
     # 画像をメモリ空間で受け渡す必要がある．
-    camera = camera_main_process.Camera()
-    width = int(camera.get_param('camera_width'))
-    height = int(camera.get_param('camera_height'))
-    print('shape: ' + str((height, width)))
-    # 保存，表示のために画像を復元する必要があるためサイズを渡す．
-    pick = camera_main_process.PickPicture()
-    show = camera_main_process.ShowPicture(height, width)
-
-    # メモリ空間上に画像用のスペースを確保する．
-    camera_memory0_0 = multiprocessing.sharedctypes.RawArray(
-        'f', height*width*3)
-    # メモリ空間上に画像用のスペースを確保する．
-    camera_memory0_1 = multiprocessing.sharedctypes.RawArray(
-        'f', height*width*3)
-    # メモリ空間上に画像用のスペースを確保する．
-    camera_memory0_2 = multiprocessing.sharedctypes.RawArray(
-        'f', height*width*3)
-    # メモリ空間上に画像用のスペースを確保する．
-    pict_memory0 = multiprocessing.sharedctypes.RawArray(
-        'f', height*width*3)
-    # 画像インデックス
-    image_index = multiprocessing.Value("i", 2)
-    # showからthrowへ画像更新要求
-    need_update = multiprocessing.Value("i", 0)
-    # 排他制御用変数
-    camera_pick_lock = multiprocessing.Lock()
-    # 排他制御用変数
-    pick_show_lock = multiprocessing.Lock()
+    # カメラは撮影プロセス内で開き，画像の形状と型をパイプラインへ送る．
+    # (カメラを開いている間に他のステージを起動する)
+    camera = camera_main_process.Camera(open_in_process=True)
+    # 実機のカメラがない場合は合成画像や記録済み画像を使用できる．
+    # camera = camera_main_process.Camera(
+    #     'synthetic', width=1920, height=1080, fps=30)
+    # camera = camera_main_process.Camera(
+    #     'replay', '/ramdisk/record.raw', realtime=True)
+    # 読み込み側が遅くてもカメラ内部のバッファの古い画像を読まないよう，
+    # 取り込みスレッドで最新の画像のみ取り出す場合
+    # camera = camera_main_process.Camera(grab_thread=True)
+    # 実機のカメラで最速の形式，縦横，フレームレートの組み合わせは
+    #     python camera_opencv_process.py [デバイス番号]
+    # で調べられる．撮影前(パイプラインの作成前)に設定する．
+    # (カメラを開く前の設定は撮影プロセス内で開いた時に反映される)
+    # (形式，縦横，フレームレートの順に設定する)
+    # camera.set_param('camera_fourcc', 'MJPG')
+    # camera.set_param('camera_width', 1920)
+    # camera.set_param('camera_height', 1080)
+    # camera.set_param('camera_fps', 60)
+    # camera.set_param('camera_buffersize', 1)
 
-    camera_kwargs = {
-        "cam_mem1/3": camera_memory0_0,
-        "cam_mem2/3": camera_memory0_1,
-        "cam_mem3/3": camera_memory0_2,
-        "cam_mem_index": image_index,
-        "cam_pick_lock": camera_pick_lock,
-    }
-    pick_kwargs = {
-        "cam_mem1/3": camera_memory0_0,
-        "cam_mem2/3": camera_memory0_1,
-        "cam_mem3/3": camera_memory0_2,
-        "cam_mem_index": image_index,
-        "cam_pick_lock": camera_pick_lock,
-        "pick_mem1/1": pict_memory0,
-        "need_update": need_update,
-        "pick_show_lock": pick_show_lock,
-    }
-    show_kwargs = {
-        "pick_mem1/1": pict_memory0,
-        "need_update": need_update,
-        "pick_show_lock": pick_show_lock,
+    # {ステージ名: 設定}．設定の詳細はpipeline.py参照．
+    # joinを指定したステージ(表示ウィンドウで'q'を押す)が終了すると，
+    # 他のステージも終了要求で終了させる．
+    # (ShowPictureは保存用のプロセスプールを持つためデーモンにはできない)
+    graph = {
+        'camera': {
+            'stage': camera,
+            'slots': 3,
+        },
+        'pick': {
+            'stage': camera_main_process.PickPicture(),
+            'input': 'camera',
+        },
+        'show': {
+            'stage': camera_main_process.ShowPicture(),
+            'input': 'camera',
+            'join': True,
+            'options': {'mode': 'latest'},
+        },
     }
-    # マルチプロセス定義
-    camera_process = multiprocessing.Process(
-        target=camera.main, args=(camera_kwargs,))
-    pick_process = multiprocessing.Process(
-        target=pick.main, args=(pick_kwargs,))
-    show_process = multiprocessing.Process(
-        target=show.main, args=(show_kwargs,), daemon=True)
-    camera_process.start()
-    pick_process.start()
-    show_process.start()
+    # 例: 表示は縮小したプレビューを読む場合
+    #     (撮影プロセスが1フレームにつき1回縮小して別のリングバッファへ書く)
+    # graph['camera']['options'] = {'preview_scale': 4}
+    # graph['show']['input'] = 'camera.preview'
+    # 例: 画像の一部のみ使う場合は関心領域(x, y, 幅, 高さ)のみコピーする
+    # graph['pick']['options'] = {'rois': [(0, 0, 64, 64), (320, 240, 64, 64)]}
+    # 例: 処理関数を複数のワーカープロセスで並列に実行する場合
+    #     (出力はフレーム番号順．入力のslotsは処理の遅れを吸収できる数にする)
+    # import frame_processor
+    # graph['process'] = {
+    #     'stage': frame_processor.FrameProcessor(
+    #         frame_processor.sample_function),
+    #     'input': 'camera',
+    #     'options': {'workers': 4},
+    # }
+    # 例: 複数カメラを並列に撮影し，撮影時刻の揃った組を出力する場合
+    #     (カメラ毎に撮影プロセスとリングバッファを持つ．
+    #      syncの出力はframe_synchronizer.split_framesでカメラ毎に分ける)
+    # import frame_synchronizer
+    # graph['camera1'] = {
+    #     'stage': camera_main_process.Camera(source=1),
+    #     'slots': 8,
+    # }
+    # graph['sync'] = {
+    #     'stage': frame_synchronizer.FrameSynchronizer(tolerance=0.005),
+    #     'input': ['camera', 'camera1'],
+    # }
+    # 例: 全フレームの記録を追加する場合
+    # graph['record'] = {
+    #     'stage': camera_main_process.RecordPicture(
+    #         '/ramdisk/record.raw', 1000),
+    #     'input': 'camera',
+    # }
+    # 例: トリガーの前5秒と後5秒の画像を記録する場合
+    #     (別の端末から
+    #          python camera_control.py camera0_control trigger trigger 1
+    #      もしくは記録プロセスへSIGUSR1を送るとトリガーになる．
+    #      解析ステージからはkwargs["control"]の要求で送る)
+    # import trigger_recorder
+    # graph['trigger'] = {
+    #     'stage': trigger_recorder.TriggerRecorder(5.0, 5.0, max_fps=60),
+    #     'input': 'camera',
+    # }
 
-    pick_process.join()
-    camera_process.join()
+    # 名前付きのため，外部のプロセスからも'camera0_camera'で
+    # カメラ画像のリングバッファへ接続できる．
+    # カメラを撮影プロセス内で開くため，start_methodは'fork'以外
+    # ('spawn'，'forkserver')も指定できる．
+    camera_pipeline = pipeline.Pipeline(graph, name='camera0')
+    # 異常終了したステージや応答のないステージは再起動する．
+    # (open_in_processの撮影プロセスはカメラを開き直す)
+    # Ctrl-Cでも全ステージを終了させる．
+    supervisor.Supervisor(camera_pipeline).run()
@@ -0,0 +1,525 @@
+import multiprocessing
+
+import camera_control
+import frame_notifier
+import frame_ring
+import stage_stats
+
+
+"""
+ステージのグラフからパイプラインを組み立てて実行する．
+
+<グラフ>
+    {ステージ名: 設定(dict)}
+    設定のキー
+        'stage': ステージのインスタンス(mainメソッドを持つ)．必須．
+        'input': 読み込むステージ名．省略した場合は入力元(source)となる．
+                 複数のステージを読む場合はステージ名のリスト．
+                 '<ステージ名>.<出力名>'の場合はそのステージの
+                 フルサイズ以外の出力(例: 'camera.preview')を読む．
+        'slots': 出力するリングバッファのスロット数．既定値はDEFAULT_SLOTS．
+        'join': Trueの場合はこのステージの終了を待ってから全体を終了する．
+                指定したステージがない場合はsourceの終了を待つ．
+        'options': ステージのインスタンスへ設定する属性
+                   (例: {'mode': 'every'})．
+
+<ステージの種類>
+    source: inputを持たない．out_ringへ書き込む．
+    transform: inputを持ち，他のステージのinputとなる．
+               in_ringを読んでout_ringへ書き込む．
+    sink: inputを持ち，他のステージのinputとならない．in_ringを読む．
+
+    出力を持つステージ(source，transform)はget_frame_formatで出力画像の
+    形状と型を返すこと．transformの場合は入力の形状と型が渡される．
+    (inputがリストの場合は形状と型もそれぞれリスト)
+    フルサイズ以外の出力を持つステージはget_output_format(出力名)で
+    その形状と型を返すこと．
+
+<撮影プロセス内でのカメラの初期化>
+    open_in_processがTrueのsourceはパイプラインを作成するプロセスでは
+    カメラを開かないため，出力の形状がわからない．
+    そのためリングバッファの確保を起動時まで遅らせ，startで最初に起動する．
+    ステージはプロセス内でカメラを開き，connect_outputsで出力の形状と型を
+    送る(handshake)．パイプラインは受け取った形状でリングバッファを確保して
+    名前を返し，ステージはその名前で接続する．
+    カメラを開いている間に他のステージを起動するため起動が速く，
+    カメラのオブジェクトを子プロセスへ渡さないため
+    start_methodが'spawn'，'forkserver'の場合も動作する．
+
+<mainへ渡すkwargs>
+    "in_ring": 読み込むリングバッファ(inputを持つ場合)
+    "in_rings": 読み込むリングバッファのリスト(inputがリストの場合)
+    "out_ring": 書き込むリングバッファ(出力を持つ場合)
+    "out_rings": {出力名: フルサイズ以外の出力のリングバッファ}
+                 (読むステージがある出力のみ)
+    "stop_event": 終了要求
+    "stats": 全ステージの統計情報
+    "control": カメラのパラメータの取得，設定要求
+               (camera_control.CameraControl)．要求元名はステージ名．
+    "renegotiable": 出力を読む全てのステージがリングバッファの世代の
+                    切り替え(frame_ring.FrameRing.renegotiate)に対応して
+                    いる(supports_renegotiationがTrue)場合True．
+                    (出力を持つ場合)
+    "handshake", "notifiers": 出力の確保を遅らせたsourceの起動時のみ．
+                              connect_outputsで使用する．
+
+"""
+
+
+# 出力リングバッファの既定のスロット数
+DEFAULT_SLOTS = 3
+# ステージ設定で使用できるキー
+NODE_KEYS = ('stage', 'input', 'slots', 'join', 'options')
+
+
+class Pipeline:
+    """
+    ステージのグラフに従って，リングバッファ，統計情報，
+    終了要求，プロセスを確保して実行するクラス．
+    ステージの追加や読み込みモード，スロット数の変更は
+    グラフの設定を変えるだけでよい．
+
+    """
+    def __init__(self, graph, name='pipeline', start_method=None):
+        """
+        グラフを検証し，ステージ毎の出力リングバッファと
+        統計情報を確保する．フォーク前に作成すること．
+        open_in_processがTrueのsourceとそれを読むステージの
+        出力リングバッファはstartで確保する．
+
+        Parameters
+        --------------------------
+        graph: dict
+            {ステージ名: 設定(dict)}．モジュールのdocstring参照．
+        name: str
+            共有メモリ名の接頭辞．リングバッファは'<name>_<ステージ名>'
+            (フルサイズ以外の出力は'<name>_<ステージ名>_<出力名>')，
+            統計情報は'<name>_stats'，カメラのパラメータの要求欄は
+            '<name>_control'の名前で外部から接続できる．
+        start_method: str, default None
+            ステージのプロセスの起動方法('fork'，'spawn'，'forkserver')．
+            Noneの場合はmultiprocessingの既定値．'spawn'，'forkserver'の
+            場合はステージのインスタンスがpickleできること．
+
+        """
+        self.name = name
+        self.graph = graph
+        self.order = self._sort(graph)
+        # 出力(inputに指定する名前)毎の読み込み側のステージ名
+        self.consumers = {}
+        for stage_name in self.order:
+            for source in self.inputs(stage_name):
+                self.consumers.setdefault(source, []).append(stage_name)
+        self.context = multiprocessing.get_context(start_method)
+        self.stop_event = self.context.Event()
+        # 出力毎のリングバッファ
+        self.rings = {}
+        # リングバッファの確保を起動時まで遅らせたステージ名
+        self.deferred = []
+        # 出力毎の通知用インスタンス．確保を遅らせたsourceの出力は
+        # 起動時に渡す必要があるため先に作成する．
+        self.notifiers = {}
+        for stage_name in self.order:
+            self._setup_stage(stage_name)
+        self.stats = stage_stats.StageStats(
+            self.order, name=name + '_stats')
+        # パイプライン外のプロセス用の要求欄も確保する
+        self.control = camera_control.CameraControl(
+            self.order + [camera_control.EXTERNAL_CLIENT],
+            name=name + '_control')
+        self.processes = {}
+        return None
+
+    def inputs(self, stage_name):
+        """
+        ステージが読み込むステージ名のリスト．sourceの場合は空．
+
+        Parameters
+        --------------------------
+        stage_name: str
+            ステージ名
+
+        Returns
+        --------------------------
+        sources: list of str
+            読み込むステージ名
+
+        """
+        return _inputs(self.graph[stage_name])
+
+    @staticmethod
+    def _sort(graph):
+        """
+        グラフを検証し，入力側から順に並べたステージ名を返す．
+
+        """
+        order = []
+        while len(order) < len(graph):
+            added = False
+            for stage_name, node in graph.items():
+                unknown = set(node) - set(NODE_KEYS)
+                if len(unknown) > 0:
+                    raise ValueError(
+                        'unknown keys in ' + stage_name + ': ' + str(unknown))
+                sources = [source.split('.')[0] for source in _inputs(node)]
+                for source in sources:
+                    if source not in graph:
+                        raise ValueError(
+                            'unknown input of ' + stage_name + ': ' + source)
+                if stage_name not in order and \
+                        all(source in order for source in sources):
+                    order.append(stage_name)
+                    added = True
+            if added is False:
+                raise ValueError('graph has a cycle')
+        return order
+
+    def _setup_stage(self, stage_name):
+        """
+        ステージへ設定を反映し，出力を持つ場合はリングバッファを確保する．
+        カメラをプロセス内で開くsourceとそれを読むステージは
+        確保を起動時まで遅らせる．
+
+        """
+        node = self.graph[stage_name]
+        stage = node['stage']
+        for key, value in node.get('options', {}).items():
+            if not hasattr(stage, key):
+                raise AttributeError(
+                    stage_name + ' has no option: ' + str(key))
+            setattr(stage, key, value)
+        # 統計情報はグラフ上のステージ名で記録する
+        stage.stage_name = stage_name
+        sources = self.inputs(stage_name)
+        if len(sources) == 0 and \
+                getattr(stage, 'open_in_process', False) is True:
+            self.deferred.append(stage_name)
+            for source in self._outputs(stage_name):
+                self._create_notifier(source)
+            return None
+        if any(source not in self.rings for source in sources):
+            self.deferred.append(stage_name)
+            return None
+        self._create_outputs(stage_name)
+        return None
+
+    def _outputs(self, stage_name):
+        """
+        ステージの出力(inputに指定する名前)の一覧．
+        フルサイズ以外の出力のみ読まれる場合もフルサイズは書き込む．
+        読むステージがない場合は空．
+
+        """
+        outputs = [
+            source for source in self.consumers
+            if source.startswith(stage_name + '.')
+        ]
+        if stage_name not in self.consumers and len(outputs) == 0:
+            return []
+        return [stage_name] + outputs
+
+    def _create_outputs(self, stage_name):
+        """
+        ステージの出力リングバッファを確保する．
+
+        """
+        node = self.graph[stage_name]
+        stage = node['stage']
+        outputs = self._outputs(stage_name)
+        if len(outputs) == 0:
+            return None
+        source = node.get('input')
+        if source is None:
+            shape, dtype = stage.get_frame_format()
+        elif isinstance(source, str):
+            in_ring = self.rings[source]
+            shape, dtype = stage.get_frame_format(
+                in_ring.shape, in_ring.dtype)
+        else:
+            in_rings = [self.rings[name] for name in source]
+            shape, dtype = stage.get_frame_format(
+                [ring.shape for ring in in_rings],
+                [ring.dtype for ring in in_rings])
+        self._create_ring(stage_name, shape, dtype)
+        for output in outputs[1:]:
+            shape, dtype = stage.get_output_format(
+                output[len(stage_name) + 1:])
+            self._create_ring(output, shape, dtype)
+        return None
+
+    def _create_notifier(self, source):
+        """
+        出力の通知用インスタンスを作成する．
+        プロセスの起動方法に合わせたコンテキストで作成する．
+
+        """
+        self.notifiers[source] = frame_notifier.FrameNotifier(
+            max(len(self.consumers.get(source, [])), 1), self.context)
+        return self.notifiers[source]
+
+    def _create_ring(self, source, shape, dtype, param_names=None):
+        """
+        出力のリングバッファを確保する．
+
+        """
+        stage_name = source.split('.')[0]
+        name = self.name + '_' + source.replace('.', '_')
+        if param_names is None:
+            param_names = getattr(
+                self.graph[stage_name]['stage'], 'param_names', ())
+        if source not in self.notifiers:
+            self._create_notifier(source)
+        self.rings[source] = frame_ring.FrameRing(
+            shape, dtype,
+            slots=self.graph[stage_name].get('slots', DEFAULT_SLOTS),
+            name=name, param_names=param_names,
+            notifier=self.notifiers[source])
+        print('ring: ' + name + ' shape: ' + str(shape) + ' dtype: ' + dtype)
+        return None
+
+    def stage_kwargs(self, stage_name):
+        """
+        ステージのmainへ渡すkwargsを作成する．
+
+        Parameters
+        --------------------------
+        stage_name: str
+            ステージ名
+
+        Returns
+        --------------------------
+        kwargs: dict
+            リングバッファ，終了要求，統計情報，カメラのパラメータの要求欄
+
+        """
+        kwargs = {
+            "stop_event": self.stop_event,
+            "stats": self.stats,
+            "control": self.control,
+        }
+        source = self.graph[stage_name].get('input')
+        if isinstance(source, str):
+            kwargs["in_ring"] = self.rings[source]
+        elif source is not None:
+            kwargs["in_rings"] = [self.rings[name] for name in source]
+        if stage_name in self.rings:
+            kwargs["out_ring"] = self.rings[stage_name]
+        outputs = self._outputs(stage_name)
+        if len(outputs) > 0:
+            kwargs["renegotiable"] = all(
+                getattr(self.graph[consumer]['stage'],
+                        'supports_renegotiation', False) is True
+                for source in outputs
+                for consumer in self.consumers.get(source, []))
+        kwargs["out_rings"] = {
+            source[len(stage_name) + 1:]: ring
+            for source, ring in self.rings.items()
+            if source.startswith(stage_name + '.')
+        }
+        return kwargs
+
+    def start(self):
+        """
+        全ステージのプロセスを起動する．
+        読み込み側から起動し，最初のフレームから読めるようにする．
+        カメラをプロセス内で開くsourceは最初に起動し，カメラを開いている間に
+        他のステージを起動する．その後，送られた形状でリングバッファを確保し，
+        それを読むステージを起動してからsourceへリングバッファの名前を返す．
+
+        """
+        handshakes = {}
+        for stage_name in self.order:
+            if stage_name in self.deferred and \
+                    len(self.inputs(stage_name)) == 0:
+                handshake, child_handshake = self.context.Pipe()
+                self.start_stage(stage_name, child_handshake)
+                # 子プロセスが終了した場合にrecvが終わるよう閉じる
+                child_handshake.close()
+                handshakes[stage_name] = handshake
+        for stage_name in reversed(self.order):
+            if stage_name not in self.deferred:
+                self.start_stage(stage_name)
+        names = {}
+        for stage_name, handshake in handshakes.items():
+            try:
+                outputs = handshake.recv()
+            except EOFError:
+                raise RuntimeError(stage_name + ' failed to open')
+            for source, (shape, dtype) in outputs['formats'].items():
+                self._create_ring(
+                    source, shape, dtype, outputs['param_names'])
+            names[stage_name] = {
+                source: self.rings[source].name
+                for source in outputs['formats']
+            }
+        for stage_name in self.order:
+            if stage_name in self.deferred and stage_name not in handshakes:
+                self._create_outputs(stage_name)
+        for stage_name in reversed(self.order):
+            if stage_name in self.deferred and stage_name not in handshakes:
+                self.start_stage(stage_name)
+        for stage_name, handshake in handshakes.items():
+            handshake.send(names[stage_name])
+            handshake.close()
+        return None
+
+    def start_stage(self, stage_name, handshake=None):
+        """
+        1つのステージのプロセスを起動する．
+        再起動の場合も既存のリングバッファへ接続し直すだけで，
+        カメラ等の入力元は開き直さない．
+        (open_in_processがTrueのsourceはプロセス内で開き直す)
+
+        Parameters
+        --------------------------
+        stage_name: str
+            ステージ名
+        handshake: multiprocessing.connection.Connection, default None
+            出力の確保を遅らせたsourceの初回起動時のみ．
+            出力の形状と型を受け取るための接続．
+
+        Returns
+        --------------------------
+        process: multiprocessing.Process
+            起動したプロセス
+
+        """
+        kwargs = self.stage_kwargs(stage_name)
+        if handshake is not None:
+            kwargs["handshake"] = handshake
+            kwargs["notifiers"] = {
+                source: self.notifiers[source]
+                for source in self._outputs(stage_name)
+            }
+        process = self.context.Process(
+            target=self.graph[stage_name]['stage'].main,
+            args=(kwargs,), name=stage_name)
+        process.start()
+        self.processes[stage_name] = process
+        return process
+
+    @property
+    def end_stages(self):
+        """
+        終了するとパイプライン全体を終了させるステージ名の一覧．
+        joinを指定したステージ．指定がない場合はsource．
+
+        """
+        stage_names = [
+            stage_name for stage_name in self.order
+            if self.graph[stage_name].get('join', False) is True
+        ]
+        if len(stage_names) > 0:
+            return stage_names
+        return [
+            stage_name for stage_name in self.order
+            if len(self.inputs(stage_name)) == 0
+        ]
+
+    def join(self):
+        """
+        end_stagesの終了を待ち，終了要求を出して
+        残りのステージの終了を待つ．
+
+        """
+        for stage_name in self.end_stages:
+            self.processes[stage_name].join()
+        self.stop()
+        for process in self.processes.values():
+            process.join()
+        return None
+
+    def stop(self):
+        """
+        全ステージへ終了を要求する．
+
+        """
+        self.stop_event.set()
+        return None
+
+    def close(self):
+        """
+        リングバッファ，統計情報，要求欄の共有メモリを破棄する．
+        全ステージの終了後に呼ぶこと．
+
+        """
+        for ring in self.rings.values():
+            ring.close()
+            ring.unlink()
+        self.stats.close()
+        self.stats.unlink()
+        self.control.close()
+        self.control.unlink()
+        return None
+
+    def run(self):
+        """
+        全ステージを起動し，終了後に共有メモリを破棄する．
+
+        """
+        self.start()
+        try:
+            self.join()
+        finally:
+            self.close()
+        return None
+
+
+def connect_outputs(stage, kwargs):
+    """
+    出力の確保を遅らせたsourceのプロセス内で，出力の形状と型を
+    パイプラインへ送り，確保されたリングバッファへ接続する．
+    カメラを開いた後，mainの最初に呼ぶ．
+    確保済みの場合(再起動時等)は何もしない．
+
+    Parameters
+    --------------------------
+    stage: object
+        ステージのインスタンス．get_frame_format(出力によっては
+        get_output_format)で形状と型を返すこと．
+    kwargs: dict
+        mainへ渡されたkwargs
+
+    Returns
+    --------------------------
+    kwargs: dict
+        "out_ring"，"out_rings"へ接続したリングバッファを設定したkwargs
+
+    """
+    handshake = kwargs.pop("handshake", None)
+    notifiers = kwargs.pop("notifiers", None)
+    if handshake is None:
+        return kwargs
+    formats = {}
+    for source in notifiers:
+        if source == stage.stage_name:
+            formats[source] = stage.get_frame_format()
+        else:
+            formats[source] = stage.get_output_format(
+                source[len(stage.stage_name) + 1:])
+    handshake.send({
+        'formats': formats,
+        'param_names': list(getattr(stage, 'param_names', ())),
+    })
+    names = handshake.recv()
+    handshake.close()
+    for source, name in names.items():
+        ring = frame_ring.FrameRing.attach(name, notifiers[source])
+        if source == stage.stage_name:
+            kwargs["out_ring"] = ring
+        else:
+            kwargs["out_rings"][source[len(stage.stage_name) + 1:]] = ring
+    return kwargs
+
+
+def _inputs(node):
+    """
+    ステージ設定のinputをステージ名のリストにする．
+
+    """
+    source = node.get('input')
+    if source is None:
+        return []
+    if isinstance(source, str):
+        return [source]
+    return list(source)
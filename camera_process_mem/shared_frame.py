@@ -0,0 +1,131 @@
+import multiprocessing.sharedctypes
+import sys
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# attach_shared_memoryがresource_tracker.registerを差し替えている間，
+# 他のスレッドの共有メモリの作成，接続を待たせるためのロック
+_register_lock = threading.Lock()
+
+
+def frame_nbytes(shape, dtype):
+    """
+    画像1枚分のバイト数を計算する．
+
+    Parameters
+    --------------------------
+    shape: tuple
+        画像の形状 (縦, 横, チャンネル数)
+    dtype: numpy.dtype, str
+        画像の型
+
+    Returns
+    --------------------------
+    nbytes: int
+        画像1枚分のバイト数
+
+    """
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+def allocate_frame_memory(shape, dtype):
+    """
+    画像1枚分の共有メモリを画像本来の型のサイズで確保する．
+    float等へ変換せずにバイト列として確保するため，
+    uint8のBGR画像であれば縦*横*3バイトとなる．
+
+    Parameters
+    --------------------------
+    shape: tuple
+        画像の形状 (縦, 横, チャンネル数)
+    dtype: numpy.dtype, str
+        画像の型
+
+    Returns
+    --------------------------
+    memory: multiprocessing.sharedctypes.RawArray
+        画像用の共有メモリ
+
+    """
+    return multiprocessing.sharedctypes.RawArray(
+        'B', frame_nbytes(shape, dtype))
+
+
+def as_frame_array(memory, shape, dtype):
+    """
+    共有メモリをコピーせずに画像の形状のnumpy配列として参照する．
+
+    Parameters
+    --------------------------
+    memory: multiprocessing.sharedctypes.RawArray
+        allocate_frame_memoryで確保した共有メモリ
+    shape: tuple
+        画像の形状 (縦, 横, チャンネル数)
+    dtype: numpy.dtype, str
+        画像の型
+
+    Returns
+    --------------------------
+    array: numpy.ndarray
+        共有メモリを参照するnumpy配列
+
+    """
+    return np.frombuffer(memory, dtype=dtype).reshape(shape)
+
+
+def create_shared_memory(name, nbytes):
+    """
+    名前付き共有メモリを新しく確保する．
+    作成したプロセスが最後にunlinkすること．
+
+    Parameters
+    --------------------------
+    name: str or None
+        共有メモリ名．Noneの場合は自動で決める．
+    nbytes: int
+        確保するバイト数
+
+    Returns
+    --------------------------
+    shm: multiprocessing.shared_memory.SharedMemory
+        確保した共有メモリ
+
+    """
+    with _register_lock:
+        return shared_memory.SharedMemory(
+            name=name, create=True, size=nbytes)
+
+
+def attach_shared_memory(name):
+    """
+    既存の名前付き共有メモリへ接続する．
+    接続側の終了時に共有メモリが削除されないよう，
+    resource_trackerへ登録せずに接続する．
+    (spawnの子プロセスは親とresource_trackerを共有するため，
+    登録後に解除すると親の登録まで消えてしまう)
+
+    Parameters
+    --------------------------
+    name: str
+        共有メモリ名
+
+    Returns
+    --------------------------
+    shm: multiprocessing.shared_memory.SharedMemory
+        接続した共有メモリ
+
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with _register_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return shm
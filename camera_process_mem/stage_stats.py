@@ -0,0 +1,349 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+import shared_frame
+
+
+"""
+パイプラインの各ステージの統計情報を共有メモリ上に記録する．
+各ステージは自身の行のみ書き込むためロックは不要で，
+記録はカウンタの加算のみのためパイプラインの速度に影響しない．
+
+(使い方) 起動中のパイプラインの統計情報を表示する
+    python stage_stats.py [共有メモリ名] [表示間隔[s]]
+
+"""
+
+
+# 遅延のヒストグラムの区間数．区間kは[2^(k-1), 2^k)マイクロ秒．
+HIST_BUCKETS = 32
+# ステージ毎の統計情報
+STAGE_STATS_DTYPE = np.dtype([
+    ('name', 'S32'),
+    ('pid', '<u8'),
+    ('heartbeat_ns', '<u8'),
+    ('frames_in', '<u8'),
+    ('frames_out', '<u8'),
+    ('dropped', '<u8'),
+    ('wait_ns', '<u8'),
+    ('copy_ns', '<u8'),
+    ('latency_hist', '<u8', (HIST_BUCKETS,)),
+])
+# 共有メモリがStageStatsであることを示す値
+MAGIC_VALUE = int.from_bytes(b'STGSTAT1', 'little')
+# 共有メモリ先頭のヘッダ(MAGIC，ステージ数)のバイト数
+HEADER_NBYTES = 64
+
+
+class StageStats:
+    """
+    全ステージの統計情報を持つ共有メモリ．
+    パイプラインの起動前に全ステージ名を指定して作成し，
+    各ステージはstageで自身の統計情報を取得して記録する．
+
+    """
+    def __init__(self, stage_names, name=None):
+        """
+        ステージ数分の統計情報を名前付き共有メモリに確保する．
+
+        Parameters
+        --------------------------
+        stage_names: list of str
+            ステージ名の一覧
+        name: str, default None
+            共有メモリ名．表示コマンドからはこの名前で接続する．
+
+        """
+        nbytes = HEADER_NBYTES + STAGE_STATS_DTYPE.itemsize * len(stage_names)
+        shm = shared_frame.create_shared_memory(name, nbytes)
+        header = np.ndarray((2,), np.uint64, buffer=shm.buf)
+        header[1] = len(stage_names)
+        records = np.ndarray(
+            (len(stage_names),), STAGE_STATS_DTYPE, buffer=shm.buf,
+            offset=HEADER_NBYTES)
+        records[...] = np.zeros((), STAGE_STATS_DTYPE)
+        for i, stage_name in enumerate(stage_names):
+            records['name'][i] = stage_name.encode()
+        header[0] = MAGIC_VALUE
+        del header, records
+        self._setup(shm, True)
+        return None
+
+    @classmethod
+    def attach(cls, name):
+        """
+        既存の統計情報の共有メモリへ接続する．
+
+        Parameters
+        --------------------------
+        name: str
+            共有メモリ名
+
+        Returns
+        --------------------------
+        stats: StageStats
+            接続した統計情報
+
+        """
+        stats = cls.__new__(cls)
+        stats._setup(shared_frame.attach_shared_memory(name), False)
+        return stats
+
+    def _setup(self, shm, is_owner):
+        """
+        共有メモリ上の統計情報をnumpy配列として参照する．
+
+        """
+        header = np.ndarray((2,), np.uint64, buffer=shm.buf)
+        if int(header[0]) != MAGIC_VALUE:
+            raise ValueError('not a StageStats: ' + shm.name)
+        self.shm = shm
+        self.name = shm.name
+        self.is_owner = is_owner
+        self.records = np.ndarray(
+            (int(header[1]),), STAGE_STATS_DTYPE, buffer=shm.buf,
+            offset=HEADER_NBYTES)
+        return None
+
+    def __getstate__(self):
+        """
+        プロセス生成時のpickle用．共有メモリ名のみ渡して接続し直す．
+
+        """
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        """
+        プロセス生成時のunpickle用．
+
+        """
+        self._setup(shared_frame.attach_shared_memory(state['name']), False)
+        return None
+
+    @property
+    def stage_names(self):
+        """
+        ステージ名の一覧．
+
+        """
+        return [name.decode() for name in self.records['name']]
+
+    def stage(self, stage_name):
+        """
+        ステージの統計情報を記録するためのインスタンスを取得する．
+        ステージのプロセス内で呼ぶ．
+
+        Parameters
+        --------------------------
+        stage_name: str
+            ステージ名
+
+        Returns
+        --------------------------
+        counter: StageCounter
+            統計情報の記録用インスタンス
+
+        """
+        index = self.stage_names.index(stage_name)
+        return StageCounter(self.records[index])
+
+    def close(self):
+        """
+        共有メモリを閉じる．
+
+        """
+        self.records = None
+        self.shm.close()
+        return None
+
+    def unlink(self):
+        """
+        共有メモリを削除する．作成したプロセスで最後に1度だけ呼ぶ．
+
+        """
+        if self.is_owner is True:
+            self.shm.unlink()
+        return None
+
+
+class StageCounter:
+    """
+    1つのステージの統計情報を記録するクラス．
+    共有メモリ上の行を直接加算する．
+
+    """
+    def __init__(self, record):
+        """
+        Parameters
+        --------------------------
+        record: numpy.void
+            共有メモリ上のSTAGE_STATS_DTYPEの行
+
+        """
+        self.record = record
+        self.record['pid'] = os.getpid()
+        self.beat()
+        return None
+
+    def beat(self):
+        """
+        生存確認用の時刻(time.monotonic_ns)を更新する．
+
+        """
+        self.record['heartbeat_ns'] = time.monotonic_ns()
+        return None
+
+    def add(self, field, value=1):
+        """
+        カウンタ(frames_in，frames_out，dropped，wait_ns，copy_ns)へ加算する．
+
+        Parameters
+        --------------------------
+        field: str
+            加算するカウンタ名
+        value: int
+            加算する値
+
+        """
+        self.record[field] += value
+        return None
+
+    def add_latency(self, latency_ns):
+        """
+        遅延をヒストグラムへ加算する．
+
+        Parameters
+        --------------------------
+        latency_ns: int
+            撮影からの遅延[ns]
+
+        """
+        self.record['latency_hist'][histogram_bucket(latency_ns)] += 1
+        return None
+
+
+def histogram_bucket(latency_ns):
+    """
+    遅延が入るヒストグラムの区間番号を求める．
+
+    Parameters
+    --------------------------
+    latency_ns: int
+        遅延[ns]
+
+    Returns
+    --------------------------
+    bucket: int
+        区間番号．区間kは[2^(k-1), 2^k)マイクロ秒．
+
+    """
+    bucket = (max(int(latency_ns), 0) // 1000).bit_length()
+    return min(bucket, HIST_BUCKETS - 1)
+
+
+def open_counter(stats, stage_name):
+    """
+    ステージのプロセス内で統計情報の記録用インスタンスを取得する．
+    統計情報を使用しない場合(statsがNone)はNoneを返す．
+
+    Parameters
+    --------------------------
+    stats: StageStats or None
+        全ステージの統計情報
+    stage_name: str
+        ステージ名
+
+    Returns
+    --------------------------
+    counter: StageCounter or None
+        統計情報の記録用インスタンス
+
+    """
+    if stats is None:
+        return None
+    return stats.stage(stage_name)
+
+
+def percentile(hist, q):
+    """
+    ヒストグラムから遅延のパーセンタイル値を求める．
+    区間の上限値を返すため，最大で2倍程度大きめの値となる．
+
+    Parameters
+    --------------------------
+    hist: numpy.ndarray
+        latency_hist
+    q: float
+        パーセンタイル(0-100)
+
+    Returns
+    --------------------------
+    latency: float
+        遅延[ms]．記録がない場合は0．
+
+    """
+    total = int(hist.sum())
+    if total == 0:
+        return 0.0
+    bucket = int(np.searchsorted(np.cumsum(hist), total * q / 100))
+    return 2**bucket / 1000
+
+
+def show(stats, interval=1.0):
+    """
+    統計情報を一定間隔で表示し続ける．
+    読み込みのみ行うためパイプラインの速度に影響しない．
+
+    Parameters
+    --------------------------
+    stats: StageStats
+        表示する統計情報
+    interval: float
+        表示間隔[s]
+
+    """
+    previous = stats.records.copy()
+    previous_time = time.monotonic_ns()
+    while True:
+        time.sleep(interval)
+        now = time.monotonic_ns()
+        records = stats.records.copy()
+        elapsed = (now - previous_time) / 1e9
+        print('{0:<12}{1:>9}{2:>9}{3:>8}{4:>8}{5:>10}{6:>9}{7:>9}{8:>7}'
+              .format(
+            'stage', 'in/s', 'out/s', 'drop', 'wait%', 'copy[ms]',
+            'p50[ms]', 'p99[ms]', 'age[s]'))
+        for record, last in zip(records, previous):
+            frames = int(record['frames_in'] - last['frames_in']) or \
+                int(record['frames_out'] - last['frames_out'])
+            copy_ms = int(record['copy_ns'] - last['copy_ns']) / 1e6
+            hist = record['latency_hist'] - last['latency_hist']
+            print('{0:<12}{1:>9.1f}{2:>9.1f}{3:>8}{4:>8.1f}{5:>10.3f}'
+                  '{6:>9.2f}{7:>9.2f}{8:>7.1f}'.format(
+                      record['name'].decode(),
+                      int(record['frames_in'] - last['frames_in']) / elapsed,
+                      int(record['frames_out'] - last['frames_out']) /
+                      elapsed,
+                      int(record['dropped']),
+                      int(record['wait_ns'] - last['wait_ns']) / 1e7 /
+                      elapsed,
+                      copy_ms / frames if frames > 0 else 0,
+                      percentile(hist, 50), percentile(hist, 99),
+                      (now - int(record['heartbeat_ns'])) / 1e9))
+        print(flush=True)
+        previous = records
+        previous_time = now
+
+
+if __name__ == '__main__':
+    stats_name = sys.argv[1] if len(sys.argv) > 1 else 'camera0_stats'
+    show_interval = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    attached = StageStats.attach(stats_name)
+    try:
+        show(attached, show_interval)
+    except KeyboardInterrupt:
+        pass
+    attached.close()
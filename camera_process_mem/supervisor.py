@@ -0,0 +1,177 @@
+import time
+
+
+class Supervisor:
+    """
+    パイプラインの監視クラス．パイプラインを作成したプロセスで実行する．
+    終了要求(pipeline.stop_event)を持ち，各ステージのプロセスの
+    生存と統計情報の生存確認時刻(heartbeat)を監視する．
+
+    <再起動>
+        ステージのプロセスが異常終了(終了コードが0以外)した場合や，
+        heartbeat_timeoutの間生存確認時刻が更新されない場合は，
+        そのステージのみを再起動する．
+        リングバッファや統計情報は作り直さずに既存のものへ接続し直す．
+        カメラはパイプラインを作成したプロセスで開いた場合は開き直さず，
+        open_in_processがTrueの場合は新しいプロセス内で開き直す．
+        (pipeline.Pipeline.start_stage参照)
+
+    <終了>
+        pipeline.end_stagesが全て正常終了した場合，実行時間が
+        経過した場合，もしくは終了要求が出された場合に全ステージへ
+        終了を要求する．
+
+    """
+    def __init__(
+            self, pipeline, heartbeat_timeout=5.0, max_restarts=10,
+            check_interval=0.5):
+        """
+        Parameters
+        --------------------------
+        pipeline: pipeline.Pipeline
+            監視するパイプライン
+        heartbeat_timeout: float
+            生存確認時刻が更新されない場合に再起動するまでの時間[s]．
+            処理の間隔がこれより長いステージがないようにすること．
+        max_restarts: int
+            ステージ毎の再起動回数の上限．超えた場合は全体を終了する．
+        check_interval: float
+            監視間隔[s]
+
+        """
+        print('__init__:Supervisor')
+        self.pipeline = pipeline
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_restarts = max_restarts
+        self.check_interval = check_interval
+        # 終了要求後，ステージの終了を待つ最大時間[s]
+        self.stop_timeout = 10
+        # ステージ毎の再起動回数
+        self.restarts = {stage_name: 0 for stage_name in pipeline.order}
+        # 正常終了したステージ名
+        self.finished = set()
+        # ステージ毎の起動時刻(time.monotonic_ns)
+        self._started = {}
+        return None
+
+    def run(self, duration=None):
+        """
+        全ステージを起動して監視し，終了後に共有メモリを破棄する．
+
+        Parameters
+        --------------------------
+        duration: float, default None
+            実行時間[s]．Noneの場合は終了条件を満たすまで実行する．
+
+        """
+        print('start supervisor')
+        try:
+            # カメラを開けなかった場合も起動済みのステージを終了させる
+            self.pipeline.start()
+            now = time.monotonic_ns()
+            for stage_name in self.pipeline.order:
+                self._started[stage_name] = now
+            self._watch(duration)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.pipeline.stop()
+            self._join_all()
+            self.pipeline.close()
+        print('restarts: ' + str(self.restarts))
+        print('end supervisor')
+        return None
+
+    def _watch(self, duration):
+        """
+        終了条件を満たすまで全ステージを監視する．
+
+        """
+        stop_event = self.pipeline.stop_event
+        deadline = None if duration is None else time.monotonic() + duration
+        end_stages = set(self.pipeline.end_stages)
+        while stop_event.is_set() is False:
+            for stage_name in self.pipeline.order:
+                if stage_name not in self.finished:
+                    self._check(stage_name)
+            if end_stages <= self.finished:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            stop_event.wait(self.check_interval)
+        return None
+
+    def _check(self, stage_name):
+        """
+        ステージの状態を確認し，必要であれば再起動する．
+
+        """
+        process = self.pipeline.processes[stage_name]
+        if process.is_alive() is False:
+            if process.exitcode == 0:
+                self.finished.add(stage_name)
+                return None
+            reason = 'exit code ' + str(process.exitcode)
+        elif self.heartbeat_age(stage_name) > self.heartbeat_timeout:
+            reason = 'no heartbeat'
+            process.terminate()
+        else:
+            return None
+        process.join()
+        self._restart(stage_name, process.pid, reason)
+        return None
+
+    def heartbeat_age(self, stage_name):
+        """
+        ステージの生存確認時刻からの経過時間．
+        起動直後は生存確認時刻の代わりに起動時刻を使う．
+
+        Parameters
+        --------------------------
+        stage_name: str
+            ステージ名
+
+        Returns
+        --------------------------
+        age: float
+            経過時間[s]
+
+        """
+        index = self.pipeline.order.index(stage_name)
+        heartbeat_ns = int(self.pipeline.stats.records['heartbeat_ns'][index])
+        last_ns = max(heartbeat_ns, self._started[stage_name])
+        return (time.monotonic_ns() - last_ns) / 1e9
+
+    def _restart(self, stage_name, pid, reason):
+        """
+        終了したステージを既存のリングバッファへ接続し直して再起動する．
+
+        """
+        self.restarts[stage_name] += 1
+        print('restart ' + stage_name + ' (' + reason + ') : ' +
+              str(self.restarts[stage_name]))
+        if self.restarts[stage_name] > self.max_restarts:
+            print('too many restarts: ' + stage_name)
+            self.pipeline.stop()
+            return None
+        # 終了したプロセスが解放できなかった通知の購読を解放する
+        for source in self.pipeline.inputs(stage_name):
+            self.pipeline.rings[source].release(pid)
+        self.pipeline.start_stage(stage_name)
+        self._started[stage_name] = time.monotonic_ns()
+        return None
+
+    def _join_all(self):
+        """
+        全ステージの終了を待つ．stop_timeoutを過ぎても
+        終了しないステージは強制終了する．
+
+        """
+        deadline = time.monotonic() + self.stop_timeout
+        for stage_name, process in self.pipeline.processes.items():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive() is True:
+                print('terminate ' + stage_name)
+                process.terminate()
+                process.join()
+        return None
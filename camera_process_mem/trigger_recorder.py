@@ -0,0 +1,418 @@
+import collections
+import os
+import queue
+import signal
+import threading
+import time
+
+import numpy as np
+
+import frame_recorder
+import frame_ring
+import stage_stats
+
+
+"""
+トリガー前後の画像を記録する．
+入力のリングバッファの全フレームを直近pre_seconds秒分だけメモリ上の
+循環バッファ(FrameHistory)に保持し，トリガーが来たらトリガー前の
+履歴とトリガー後post_seconds秒分のフレームを1つのファイルへ記録する．
+
+撮影プロセスはリングバッファへロックなしで書き込むため，記録が遅れても
+撮影は止まらない．ファイルへの書き込みは書き込みスレッドで
+1回のまとめ書き(frame_recorder.RawRecorder.extend)として行い，
+その間の読み込みは別の循環バッファへ切り替えて続ける．
+
+<トリガー>
+    パラメータ要求: 他のステージや外部のコマンドから
+        camera_controlでset_param(ステージ名, 'trigger', 1)を送る．
+        (解析ステージの結果で記録する場合はこれを使う)
+    シグナル: 記録プロセスへtrigger_signal(SIGUSR1)を送る．
+    判定関数: trigger_function(画像)が真を返したフレームで記録する．
+        記録プロセス内で毎フレーム呼ぶため軽い処理のみとする．
+
+"""
+
+
+class FrameHistory:
+    """
+    直近のフレームと情報を保持するメモリ上の循環バッファ．
+    count番目のフレームはcount % capacityのスロットに書き込まれ，
+    capacityフレーム前のフレームは上書きされる．
+
+    """
+    def __init__(self, shape, dtype, capacity):
+        """
+        Parameters
+        --------------------------
+        shape: tuple
+            画像の形状 (縦, 横, チャンネル数)
+        dtype: str
+            画像の型
+        capacity: int
+            保持するフレーム数
+
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.capacity = capacity
+        self.frames = np.empty((capacity,) + self.shape, self.dtype)
+        self.metas = np.zeros((capacity,), frame_ring.FRAME_META_DTYPE)
+        self.count = 0
+        return None
+
+    @property
+    def oldest(self):
+        """
+        保持している最も古いフレームの番号．
+
+        """
+        return max(0, self.count - self.capacity)
+
+    def next_frame(self):
+        """
+        次に書き込む画像領域を返す．書き込み後はcommitを呼ぶこと．
+
+        """
+        return self.frames[self.count % self.capacity]
+
+    def next_meta(self):
+        """
+        次に書き込むフレーム情報の領域(0次元配列)を返す．
+
+        """
+        return self.metas[self.count % self.capacity, ...]
+
+    def commit(self):
+        """
+        書き込んだフレームを確定する．
+
+        """
+        self.count += 1
+        return None
+
+    def clear(self):
+        """
+        保持しているフレームを全て破棄する．
+
+        """
+        self.count = 0
+        return None
+
+    def capture_ns(self, index):
+        """
+        index番目のフレームの撮影時刻．
+
+        """
+        return int(self.metas['capture_ns'][index % self.capacity])
+
+    def find(self, capture_ns):
+        """
+        撮影時刻がcapture_ns以降の最も古いフレームの番号を返す．
+
+        Parameters
+        --------------------------
+        capture_ns: int
+            撮影時刻(time.monotonic_ns)
+
+        Returns
+        --------------------------
+        index: int
+            フレームの番号．該当しない場合はcount．
+
+        """
+        indices = np.arange(self.oldest, self.count) % self.capacity
+        return self.oldest + int(np.searchsorted(
+            self.metas['capture_ns'][indices], capture_ns))
+
+    def chunks(self, first, last):
+        """
+        first番目からlast番目の手前までのフレームを，
+        スロットの連続した部分毎(最大2つ)に古い順で返す．
+
+        Returns
+        --------------------------
+        chunks: list of tuple
+            (画像, フレーム情報)の一覧．コピーせずに参照する．
+
+        """
+        chunks = []
+        while first < last:
+            start = first % self.capacity
+            stop = min(self.capacity, start + last - first)
+            chunks.append((self.frames[start:stop], self.metas[start:stop]))
+            first += stop - start
+        return chunks
+
+
+class TriggerRecorder:
+    """
+    サンプルの作業プロセス．
+    トリガー前pre_seconds秒とトリガー後post_seconds秒の画像を
+    frame_recorder.RawRecorderの形式で記録する．
+    記録中のトリガーは記録の終わりをそのトリガーのpost_seconds秒後まで
+    延ばす．循環バッファが一杯になった場合はそこで記録を区切る．
+
+    循環バッファはbuffers個確保し，書き込み中のバッファ以外へ読み込む．
+    記録を区切った直後のトリガーのトリガー前の履歴は，前の記録の
+    末尾と重なる分が新しいバッファにないため短くなる．
+    メモリ使用量は約 buffers * (pre_seconds + post_seconds) * max_fps
+    フレーム分．
+
+    """
+    def __init__(
+            self, pre_seconds=5.0, post_seconds=5.0, max_fps=60,
+            path='/ramdisk/trigger_{0:04d}.raw', trigger_function=None,
+            buffers=2):
+        """
+        Parameters
+        --------------------------
+        pre_seconds: float
+            トリガー前に記録する時間[s]
+        post_seconds: float
+            トリガー後に記録する時間[s]
+        max_fps: float
+            最大フレームレート．循環バッファのフレーム数を決める．
+        path: str
+            記録先のファイルパス．{0}に記録番号が入る．
+            既存のファイルは上書きせずに次の番号を使う．
+        trigger_function: callable, default None
+            画像を受け取り，記録する場合に真を返す判定関数．
+            spawnで起動する場合はpickleできる(モジュールの関数)こと．
+        buffers: int
+            循環バッファの数．2以上．
+
+        """
+        print('__init__:TriggerRecorder')
+        if buffers < 2:
+            raise ValueError('buffers must be 2 or more: ' + str(buffers))
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_fps = max_fps
+        self.name = path.format
+        self.trigger_function = trigger_function
+        self.buffers = buffers
+        # 上書きされたフレーム以外は全て保持する
+        self.mode = 'every'
+        # 記録のトリガーとするシグナル
+        self.trigger_signal = signal.SIGUSR1
+        # 終了要求を確認する間隔[s]
+        self.stop_interval = 0.1
+        # 統計情報のステージ名
+        self.stage_name = 'trigger'
+        return None
+
+    @property
+    def capacity(self):
+        """
+        循環バッファ1つあたりのフレーム数．
+
+        """
+        return int(np.ceil(
+            (self.pre_seconds + self.post_seconds) * self.max_fps)) + 1
+
+    def trigger(self, trigger_ns=None):
+        """
+        記録を要求する．記録プロセス内(シグナル，判定関数，
+        パラメータ要求)から呼ばれる．
+
+        Parameters
+        --------------------------
+        trigger_ns: int, default None
+            トリガーの時刻(time.monotonic_ns)．Noneの場合は現在時刻．
+
+        """
+        if trigger_ns is None:
+            trigger_ns = time.monotonic_ns()
+        # シグナルハンドラからも呼ばれるため追加のみ行う
+        self._triggers.append(trigger_ns)
+        return None
+
+    def main(self, kwargs):
+        in_ring = kwargs["in_ring"]
+        stop_event = kwargs["stop_event"]
+        control = kwargs.get("control")
+        counter = stage_stats.open_counter(
+            kwargs.get("stats"), self.stage_name)
+        reader = frame_ring.FrameReader(in_ring, self.mode, counter)
+        histories = [
+            FrameHistory(in_ring.shape, in_ring.dtype, self.capacity)
+            for _ in range(self.buffers)]
+        # 書き込みが終わって空いている循環バッファ
+        free = queue.Queue()
+        for history in histories[1:]:
+            free.put(history)
+        history = histories[0]
+        del histories
+        # 書き込みスレッドへ渡す(循環バッファ, 先頭, 末尾)
+        clips = queue.Queue()
+        self._triggers = collections.deque()
+        self._write_error = None
+        self.triggered = 0
+        self.written = 0
+        self._clip_no = 0
+        writer = threading.Thread(
+            target=self._write_clips, args=(clips, free, in_ring.param_names))
+        writer.start()
+        previous_handler = signal.signal(
+            self.trigger_signal, lambda signum, frame: self.trigger())
+        # 記録中の(先頭のフレームの番号, 記録を終える撮影時刻)
+        clip = None
+        error = False
+        print('start trigger')
+        while error is False and history is not None and \
+                stop_event.is_set() is False:
+            try:
+                if self._write_error is not None:
+                    raise self._write_error
+                image = history.next_frame()
+                meta = history.next_meta()
+                if reader.read(image, self.stop_interval, meta) is not None:
+                    history.commit()
+                    if counter is not None:
+                        counter.add('frames_out')
+                    if self.trigger_function is not None and \
+                            self.trigger_function(image):
+                        self.trigger(int(meta['capture_ns']))
+                if control is not None and \
+                        control.has_requests(self.stage_name) is True:
+                    control.serve(
+                        self.stage_name, self._set_param, self._get_param)
+                clip = self._update_clip(history, clip)
+                if clip is not None and self._is_done(history, clip) is True:
+                    clips.put((history, clip[0], history.count))
+                    clip = None
+                    history = self._next_history(free, stop_event, counter)
+            except Exception as e:
+                error = e
+                print(error)
+        signal.signal(self.trigger_signal, previous_handler)
+        # 終了時に記録中のフレームも書き込む
+        if clip is not None and history is not None:
+            clips.put((history, clip[0], history.count))
+        clips.put(None)
+        writer.join()
+        reader.close()
+        print('triggered: ' + str(self.triggered) +
+              ' written: ' + str(self.written) +
+              ' dropped: ' + str(reader.dropped))
+        print('end trigger')
+        if error is False and self._write_error is not None:
+            error = self._write_error
+        if error is not False:
+            raise error
+        return None
+
+    def _update_clip(self, history, clip):
+        """
+        受け付けたトリガーから記録範囲を決める．
+
+        Returns
+        --------------------------
+        clip: list or None
+            (先頭のフレームの番号, 記録を終える撮影時刻)．
+            記録中でない場合None．
+
+        """
+        pre_ns = int(self.pre_seconds * 1e9)
+        post_ns = int(self.post_seconds * 1e9)
+        while len(self._triggers) > 0:
+            trigger_ns = self._triggers.popleft()
+            self.triggered += 1
+            if clip is None:
+                clip = [history.find(max(0, trigger_ns - pre_ns)),
+                        trigger_ns + post_ns]
+            else:
+                clip[1] = max(clip[1], trigger_ns + post_ns)
+        return clip
+
+    def _is_done(self, history, clip):
+        """
+        記録範囲のフレームが揃ったかどうか．
+        次のフレームで先頭が上書きされる場合も区切る．
+
+        """
+        if history.count - clip[0] >= history.capacity:
+            return True
+        return history.count > clip[0] and \
+            history.capture_ns(history.count - 1) >= clip[1]
+
+    def _next_history(self, free, stop_event, counter):
+        """
+        空いている循環バッファを取得する．全て書き込み中の場合は
+        書き込みが終わるまで待つ(その間のフレームは読み飛ばす)．
+
+        Returns
+        --------------------------
+        history: FrameHistory or None
+            空いている循環バッファ．待つ間に終了要求が来た場合None．
+
+        """
+        while stop_event.is_set() is False:
+            try:
+                return free.get(timeout=self.stop_interval)
+            except queue.Empty:
+                print('trigger: waiting for writer')
+                if counter is not None:
+                    counter.beat()
+        return None
+
+    def _write_clips(self, clips, free, param_names):
+        """
+        書き込みスレッド．記録範囲のフレームを1つのファイルへまとめて
+        書き込み，循環バッファを空きへ戻す．
+
+        """
+        while True:
+            item = clips.get()
+            if item is None:
+                break
+            history, first, last = item
+            try:
+                path = self._next_path()
+                recorder = frame_recorder.RawRecorder(
+                    path, history.shape, history.dtype, last - first,
+                    param_names)
+                for frames, metas in history.chunks(first, last):
+                    recorder.extend(frames, metas)
+                recorder.close()
+                self.written += 1
+                print('trigger saved: ' + path +
+                      ' frames: ' + str(recorder.count))
+            except Exception as e:
+                self._write_error = e
+            history.clear()
+            free.put(history)
+        return None
+
+    def _next_path(self):
+        """
+        既存のファイルと重ならない記録先のファイルパスを返す．
+
+        """
+        while os.path.exists(self.name(self._clip_no)) is True:
+            self._clip_no += 1
+        path = self.name(self._clip_no)
+        self._clip_no += 1
+        return path
+
+    def _set_param(self, param_name, value):
+        """
+        パラメータ要求による設定．'trigger'で記録を要求する．
+
+        """
+        if param_name != 'trigger':
+            raise KeyError('unknown parameter: ' + param_name)
+        self.trigger()
+        return None
+
+    def _get_param(self, param_name):
+        """
+        パラメータ要求による取得．
+
+        """
+        if param_name == 'trigger':
+            return self.triggered + len(self._triggers)
+        elif param_name == 'written':
+            return self.written
+        raise KeyError('unknown parameter: ' + param_name)